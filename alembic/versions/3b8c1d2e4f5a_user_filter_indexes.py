@@ -0,0 +1,41 @@
+"""user filter and search indexes
+
+Revision ID: 3b8c1d2e4f5a
+Revises: f9a075ca46e9
+Create Date: 2022-10-20 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8c1d2e4f5a'
+down_revision = 'f9a075ca46e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # CONCURRENTLY does not lock the table against writes, it cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index(op.f('ix_user_role'), 'user', ['role'], unique=False, postgresql_concurrently=True)
+        op.create_index(op.f('ix_user_is_active'), 'user', ['is_active'], unique=False, postgresql_concurrently=True)
+        op.create_index(op.f('ix_user_last_login'), 'user', ['last_login'], unique=False,
+                        postgresql_concurrently=True)
+        op.create_index('ix_user_created_at', 'user', ['created_at'], unique=False, postgresql_concurrently=True)
+        # lower(column) LIKE '%...%' of the q= search
+        op.create_index('ix_user_full_name_trgm', 'user', [sa.text('lower(full_name) gin_trgm_ops')],
+                        postgresql_using='gin', postgresql_concurrently=True)
+        op.create_index('ix_user_email_trgm', 'user', [sa.text('lower(email) gin_trgm_ops')],
+                        postgresql_using='gin', postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_user_email_trgm', table_name='user')
+    op.drop_index('ix_user_full_name_trgm', table_name='user')
+    op.drop_index('ix_user_created_at', table_name='user')
+    op.drop_index(op.f('ix_user_last_login'), table_name='user')
+    op.drop_index(op.f('ix_user_is_active'), table_name='user')
+    op.drop_index(op.f('ix_user_role'), table_name='user')
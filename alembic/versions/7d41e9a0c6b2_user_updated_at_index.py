@@ -0,0 +1,25 @@
+"""user updated_at index
+
+Revision ID: 7d41e9a0c6b2
+Revises: 3b8c1d2e4f5a
+Create Date: 2022-10-24 10:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7d41e9a0c6b2'
+down_revision = '3b8c1d2e4f5a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # max(updated_at) probe of the list ETags
+    with op.get_context().autocommit_block():
+        op.create_index('ix_user_updated_at', 'user', ['updated_at'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    op.drop_index('ix_user_updated_at', table_name='user')
@@ -0,0 +1,32 @@
+from typing import Any
+
+from fastapi import APIRouter, Depends
+
+from app.db.base import engine
+from app.db.session import SessionStats
+from app.helpers.login_manager import PermissionRequired
+from app.helpers.request_timing import query_budget
+from app.schemas.sche_base import DataResponse
+from app.schemas.sche_db import DBSessionStats, DBPoolStats
+
+router = APIRouter()
+
+
+@router.get("/db/sessions", dependencies=[Depends(PermissionRequired('admin'))],
+            response_model=DataResponse[DBSessionStats])
+@query_budget(1)
+def db_sessions() -> Any:
+    """
+    API get how many requests actually opened a DB session
+    """
+    return DataResponse().success_response(data=SessionStats.as_dict())
+
+
+@router.get("/db/pool", dependencies=[Depends(PermissionRequired('admin'))],
+            response_model=DataResponse[DBPoolStats])
+@query_budget(1)
+def db_pool() -> Any:
+    """
+    API get connection pool usage of this worker
+    """
+    return DataResponse().success_response(data=engine.pool.stats())
@@ -1,13 +1,15 @@
 from datetime import datetime
 
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi_sqlalchemy import db
+from fastapi import APIRouter, HTTPException, Depends, Request
 from pydantic import EmailStr, BaseModel
 
 from app.core.security import create_access_token
 from app.schemas.sche_base import DataResponse
 from app.schemas.sche_token import Token
+from app.services.srv_last_login import last_login_writer
 from app.services.srv_user import UserService
+from app.helpers.rate_limit import rate_limiter
+from app.helpers.request_timing import query_budget
 
 router = APIRouter()
 
@@ -18,15 +20,16 @@ class LoginRequest(BaseModel):
 
 
 @router.post('', response_model=DataResponse[Token])
-def login_access_token(form_data: LoginRequest, user_service: UserService = Depends()):
-    user = user_service.authenticate(email=form_data.username, password=form_data.password)
+@query_budget(1)
+async def login_access_token(request: Request, form_data: LoginRequest, user_service: UserService = Depends()):
+    await rate_limiter.check(request, form_data.username)
+    user = await user_service.authenticate(email=form_data.username, password=form_data.password)
     if not user:
         raise HTTPException(status_code=400, detail='Incorrect email or password')
     elif not user.is_active:
         raise HTTPException(status_code=401, detail='Inactive user')
 
-    user.last_login = datetime.now()
-    db.session.commit()
+    last_login_writer.push(user.id, datetime.now())
 
     return DataResponse().success_response({
         'access_token': create_access_token(user_id=user.id)
@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from fastapi import APIRouter, HTTPException, Depends, Request
+
+from app.api.api_login import LoginRequest
+from app.core.security import create_access_token
+from app.schemas.sche_base import DataResponse
+from app.schemas.sche_token import Token
+from app.services.srv_last_login import last_login_writer
+from app.services.srv_user_async import AsyncUserService
+from app.helpers.rate_limit import rate_limiter
+from app.helpers.request_timing import query_budget
+
+router = APIRouter()
+
+
+@router.post('', response_model=DataResponse[Token])
+@query_budget(1)
+async def login_access_token(request: Request, form_data: LoginRequest,
+                             user_service: AsyncUserService = Depends()):
+    await rate_limiter.check(request, form_data.username)
+    user = await user_service.authenticate(email=form_data.username, password=form_data.password)
+    if not user:
+        raise HTTPException(status_code=400, detail='Incorrect email or password')
+    elif not user.is_active:
+        raise HTTPException(status_code=401, detail='Inactive user')
+
+    last_login_writer.push(user.id, datetime.now())
+
+    return DataResponse().success_response({
+        'access_token': create_access_token(user_id=user.id)
+    })
@@ -0,0 +1,66 @@
+from typing import Any, Iterable
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.core import security
+from app.db.base import engine
+from app.db.session import SessionStats
+from app.helpers.metrics import registry, gauge_lines, histogram_lines
+from app.helpers.paging import count_cache
+from app.helpers.rate_limit import rate_limiter
+from app.services.srv_last_login import last_login_writer
+from app.services.srv_user import user_cache
+
+router = APIRouter()
+
+
+def collect_db() -> Iterable[str]:
+    pool = engine.pool
+    lines = gauge_lines('db_pool_size', 'Configured pool size', pool.size())
+    lines += gauge_lines('db_pool_checked_out', 'Connections in use', pool.checkedout())
+    lines += gauge_lines('db_pool_idle', 'Connections idle in the pool', pool.checkedin())
+    lines += gauge_lines('db_pool_overflow_in_use', 'Connections opened beyond the pool size', max(pool.overflow(), 0))
+    lines += gauge_lines('db_pool_checkout_timeouts_total', 'Checkouts that timed out', pool.timeouts, 'counter')
+    lines += histogram_lines('db_pool_checkout_wait_seconds', 'Time waited for a connection',
+                             [('', pool.checkout_wait)])
+    lines += gauge_lines('db_session_requests_total', 'Requests seen by DBSessionMiddleware',
+                         SessionStats.requests, 'counter')
+    lines += gauge_lines('db_session_requests_with_session_total', 'Requests that opened a DB session',
+                         SessionStats.requests_with_session, 'counter')
+    return lines
+
+
+def collect_caches() -> Iterable[str]:
+    lines = []
+    for name, cache in (('user_cache', user_cache), ('count_cache', count_cache)):
+        lines += gauge_lines(f'{name}_size', f'Entries in {name}', len(cache))
+        lines += gauge_lines(f'{name}_hits_total', f'{name} hits', cache.hits, 'counter')
+        lines += gauge_lines(f'{name}_misses_total', f'{name} misses', cache.misses, 'counter')
+    lines += gauge_lines('password_hash_pending', 'bcrypt jobs queued or running', security.hash_pending)
+    lines += gauge_lines('rate_limit_rejected_total', 'Login/register requests answered 429',
+                         rate_limiter.rejected, 'counter')
+    return lines
+
+
+def collect_last_login() -> Iterable[str]:
+    lines = gauge_lines('last_login_queue_depth', 'Users whose last_login waits to be written', len(last_login_writer))
+    lines += gauge_lines('last_login_flushed_total', 'last_login values written', last_login_writer.flushed, 'counter')
+    lines += gauge_lines('last_login_flush_failures_total', 'Failed last_login writes', last_login_writer.failures,
+                         'counter')
+    lines += histogram_lines('last_login_flush_seconds', 'Duration of a last_login write',
+                             [('', last_login_writer.flush_latency)])
+    return lines
+
+
+registry.add_collector(collect_db)
+registry.add_collector(collect_caches)
+registry.add_collector(collect_last_login)
+
+
+@router.get("", response_class=PlainTextResponse)
+def metrics() -> Any:
+    """
+    API metrics of this worker in the Prometheus text format
+    """
+    return PlainTextResponse(registry.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
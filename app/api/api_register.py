@@ -1,8 +1,13 @@
 from typing import Any
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 
+from app.core.security import get_password_hash_async
 from app.helpers.exception_handler import CustomException
+from app.helpers.rate_limit import rate_limiter
+from app.helpers.request_timing import query_budget
+from app.helpers.responses import fast_response
 from app.schemas.sche_base import DataResponse
 from app.schemas.sche_user import UserItemResponse, UserRegisterRequest
 from app.services.srv_user import UserService
@@ -11,9 +16,13 @@ router = APIRouter()
 
 
 @router.post('', response_model=DataResponse[UserItemResponse])
-def register(register_data: UserRegisterRequest, user_service: UserService = Depends()) -> Any:
+@query_budget(1)
+async def register(request: Request, register_data: UserRegisterRequest,
+                   user_service: UserService = Depends()) -> Any:
+    await rate_limiter.check(request, register_data.email)
+    hashed_password = await get_password_hash_async(register_data.password)
     try:
-        register_user = user_service.register_user(register_data)
-        return DataResponse().success_response(data=register_user)
+        register_user = await run_in_threadpool(user_service.register_user, register_data, hashed_password)
+        return fast_response(DataResponse().success_response(data=register_user), UserItemResponse)
     except Exception as e:
         raise CustomException(http_code=400, code='400', message=str(e))
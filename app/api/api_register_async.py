@@ -0,0 +1,27 @@
+from typing import Any
+
+from fastapi import APIRouter, Depends, Request
+
+from app.core.security import get_password_hash_async
+from app.helpers.exception_handler import CustomException
+from app.helpers.rate_limit import rate_limiter
+from app.helpers.request_timing import query_budget
+from app.helpers.responses import fast_response
+from app.schemas.sche_base import DataResponse
+from app.schemas.sche_user import UserItemResponse, UserRegisterRequest
+from app.services.srv_user_async import AsyncUserService
+
+router = APIRouter()
+
+
+@router.post('', response_model=DataResponse[UserItemResponse])
+@query_budget(1)
+async def register(request: Request, register_data: UserRegisterRequest,
+                   user_service: AsyncUserService = Depends()) -> Any:
+    await rate_limiter.check(request, register_data.email)
+    hashed_password = await get_password_hash_async(register_data.password)
+    try:
+        register_user = await user_service.register_user(register_data, hashed_password)
+        return fast_response(DataResponse().success_response(data=register_user), UserItemResponse)
+    except Exception as e:
+        raise CustomException(http_code=400, code='400', message=str(e))
@@ -1,6 +1,7 @@
 from fastapi import APIRouter
 
-from app.api import api_user, api_login, api_register, api_healthcheck
+from app.api import api_user, api_login, api_register, api_healthcheck, api_admin, api_metrics
+from app.core.config import settings
 
 router = APIRouter()
 
@@ -8,3 +9,17 @@ router.include_router(api_healthcheck.router, tags=["health-check"], prefix="/he
 router.include_router(api_login.router, tags=["login"], prefix="/login")
 router.include_router(api_register.router, tags=["register"], prefix="/register")
 router.include_router(api_user.router, tags=["user"], prefix="/users")
+router.include_router(api_admin.router, tags=["admin"], prefix="/admin")
+router.include_router(api_metrics.router, tags=["metrics"], prefix="/metrics")
+
+if settings.ASYNC_DB_ENABLED:
+    # Same API on the asyncio database stack, mounted side by side to compare throughput.
+    # Imported here so that the sync-only deployments don't build these routes.
+    from app.api import api_user_async, api_login_async, api_register_async
+
+    router.include_router(api_login_async.router, tags=["login-async"],
+                          prefix=f"{settings.ASYNC_API_PREFIX}/login")
+    router.include_router(api_register_async.router, tags=["register-async"],
+                          prefix=f"{settings.ASYNC_API_PREFIX}/register")
+    router.include_router(api_user_async.router, tags=["user-async"],
+                          prefix=f"{settings.ASYNC_API_PREFIX}/users")
@@ -1,87 +1,181 @@
 import logging
-from typing import Any
+from typing import Any, List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi_sqlalchemy import db
+from fastapi import APIRouter, Depends, File, Header, Query, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 
+from app.core.config import settings
+from app.core.security import get_password_hash_async, get_password_hashes_async
+from app.db.session import db
+from app.helpers.enums import FileFormat
+from app.helpers.etag import is_not_modified, make_etag, not_modified, page_version, resource_version, with_etag
 from app.helpers.exception_handler import CustomException
+from app.helpers.fieldsets import SparseFields, select_columns
 from app.helpers.login_manager import login_required, PermissionRequired
 from app.helpers.paging import Page, PaginationParams, paginate
+from app.helpers.request_timing import query_budget
+from app.helpers.responses import EXPORT_MEDIA_TYPES, export_response, fast_response
 from app.schemas.sche_base import DataResponse
-from app.schemas.sche_user import UserItemResponse, UserCreateRequest, UserUpdateMeRequest, UserUpdateRequest
+from app.schemas.sche_user import UserItemResponse, UserCreateRequest, UserUpdateMeRequest, UserUpdateRequest, \
+    UserSnapshot, UserImportResult, UserBatchUpdateRequest, UserBatchUpdateResult, UserFilterParams
 from app.services.srv_user import UserService
+from app.services.srv_user_import import UserImportService
 from app.models import User
 
 logger = logging.getLogger()
 router = APIRouter()
 
+USER_FIELDS = tuple(UserItemResponse.__fields__)
+
 
 @router.get("", dependencies=[Depends(login_required)], response_model=Page[UserItemResponse])
-def get(params: PaginationParams = Depends()) -> Any:
+@query_budget(5)
+def get(request: Request, params: PaginationParams = Depends(), filters: UserFilterParams = Depends(),
+        fields: Tuple[str, ...] = Depends(SparseFields(UserItemResponse)),
+        if_none_match: Optional[str] = Header(None)) -> Any:
     """
-    API Get list User
+    API Get list User, 304 Not Modified when If-None-Match has the ETag of the page
     """
     try:
-        _query = db.session.query(User)
+        clauses = UserService.list_filters(filters)
+        # Probe before reading the page: a write in between leaves an older ETag on newer data, never the reverse
+        etag = make_etag(page_version(*UserService.list_state(clauses), request.query_params.multi_items()), fields)
+        if is_not_modified(if_none_match, etag):
+            return not_modified(etag)
+        _query = db.read_session.query(*select_columns(User, fields)).filter(*clauses)
         users = paginate(model=User, query=_query, params=params)
-        return users
+        return with_etag(fast_response(users, UserItemResponse, fields), etag)
+    except CustomException:
+        raise
     except Exception as e:
-        return HTTPException(status_code=400, detail=logger.error(e))
+        logger.error(e)
+        raise CustomException(http_code=400, code='400', message=str(e))
+
+
+@router.patch("", dependencies=[Depends(PermissionRequired('admin'))],
+              response_model=DataResponse[UserBatchUpdateResult])
+async def batch_update(items: List[UserBatchUpdateRequest], user_service: UserService = Depends()) -> Any:
+    """
+    API update many User at once, each item only changes the fields it sets.
+    Unknown ids are reported in missing_ids instead of failing the batch.
+    """
+    hashed_passwords = iter(await get_password_hashes_async([item.password for item in items if item.password]))
+    try:
+        result = await run_in_threadpool(
+            user_service.batch_update, items, [next(hashed_passwords) if item.password else None for item in items])
+        return DataResponse().success_response(data=result)
+    except Exception as e:
+        raise CustomException(http_code=400, code='400', message=str(e))
+
+
+@router.get("/export", dependencies=[Depends(PermissionRequired('admin'))], response_class=StreamingResponse,
+            responses={200: {'content': {media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()}}})
+@query_budget(2)
+def export(export_format: FileFormat = Query(FileFormat.NDJSON, alias='format'), filters: UserFilterParams = Depends(),
+           fields: Tuple[str, ...] = Depends(SparseFields(UserItemResponse))) -> Any:
+    """
+    API export User as NDJSON or CSV, with the filters of API Get list User, streamed in id order with constant memory
+    """
+    partitions = UserService.export_rows(select_columns(User, fields), UserService.list_filters(filters),
+                                         settings.EXPORT_CHUNK_SIZE, session_factory=db.read_session_factory)
+    return export_response(partitions, fields, export_format, filename='users')
 
 
 @router.post("", dependencies=[Depends(PermissionRequired('admin'))], response_model=DataResponse[UserItemResponse])
-def create(user_data: UserCreateRequest, user_service: UserService = Depends()) -> Any:
+@query_budget(2)
+async def create(user_data: UserCreateRequest, user_service: UserService = Depends()) -> Any:
     """
     API Create User
     """
+    hashed_password = await get_password_hash_async(user_data.password)
     try:
-        new_user = user_service.create_user(user_data)
-        return DataResponse().success_response(data=new_user)
+        new_user = await run_in_threadpool(user_service.create_user, user_data, hashed_password)
+        return fast_response(DataResponse().success_response(data=new_user), UserItemResponse)
     except Exception as e:
         raise CustomException(http_code=400, code='400', message=str(e))
 
 
-@router.get("/me", dependencies=[Depends(login_required)], response_model=DataResponse[UserItemResponse])
-def detail_me(current_user: User = Depends(UserService.get_current_user)) -> Any:
+@router.post("/import", dependencies=[Depends(PermissionRequired('admin'))],
+             response_model=DataResponse[UserImportResult])
+async def import_users(file: UploadFile = File(...),
+                       file_format: Optional[FileFormat] = Query(None, alias='format')) -> Any:
+    """
+    API import User in bulk from a CSV or NDJSON file (columns: full_name, email, password, role, is_active).
+    format defaults to the file extension. Invalid rows are skipped and reported, the others are created.
+    """
+    if file_format is None:
+        file_format = FileFormat.NDJSON if file.filename.endswith(('.ndjson', '.jsonl')) else FileFormat.CSV
+    result = await UserImportService.import_users(file.file, file_format)
+    return DataResponse().success_response(data=result)
+
+
+@router.get("/me", response_model=DataResponse[UserItemResponse])
+@query_budget(1)
+def detail_me(current_user: UserSnapshot = Depends(login_required), if_none_match: Optional[str] = Header(None)) -> Any:
     """
-    API get detail current User
+    API get detail current User, 304 Not Modified when If-None-Match has its ETag
     """
-    return DataResponse().success_response(data=current_user)
+    etag = make_etag(resource_version(current_user.id, current_user.updated_at), USER_FIELDS)
+    if is_not_modified(if_none_match, etag):
+        return not_modified(etag)
+    return with_etag(fast_response(DataResponse().success_response(data=current_user), UserItemResponse), etag)
 
 
-@router.put("/me", dependencies=[Depends(login_required)], response_model=DataResponse[UserItemResponse])
-def update_me(user_data: UserUpdateMeRequest,
-              current_user: User = Depends(UserService.get_current_user),
-              user_service: UserService = Depends()) -> Any:
+@router.put("/me", response_model=DataResponse[UserItemResponse])
+@query_budget(2)
+async def update_me(user_data: UserUpdateMeRequest,
+                    current_user: UserSnapshot = Depends(login_required),
+                    user_service: UserService = Depends()) -> Any:
     """
     API Update current User
     """
+    hashed_password = await get_password_hash_async(user_data.password) if user_data.password else None
     try:
-        updated_user = user_service.update_me(data=user_data, current_user=current_user)
-        return DataResponse().success_response(data=updated_user)
+        updated_user = await run_in_threadpool(
+            user_service.update_me, data=user_data, current_user=current_user, hashed_password=hashed_password)
+        return with_etag(fast_response(DataResponse().success_response(data=updated_user), UserItemResponse),
+                         make_etag(resource_version(updated_user.id, updated_user.updated_at), USER_FIELDS))
     except Exception as e:
         raise CustomException(http_code=400, code='400', message=str(e))
 
 
 @router.get("/{user_id}", dependencies=[Depends(login_required)], response_model=DataResponse[UserItemResponse])
-def detail(user_id: int, user_service: UserService = Depends()) -> Any:
+@query_budget(3)
+def detail(user_id: int, fields: Tuple[str, ...] = Depends(SparseFields(UserItemResponse)),
+           if_none_match: Optional[str] = Header(None), user_service: UserService = Depends()) -> Any:
     """
-    API get Detail User
+    API get Detail User. With If-None-Match, a primary key probe of updated_at answers 304 Not Modified
+    when the client's copy is current, without loading nor serializing the user.
     """
     try:
-        return DataResponse().success_response(data=user_service.get(user_id))
+        if if_none_match is not None:
+            version = user_service.get_version(user_id)
+            if version is not None and is_not_modified(if_none_match, make_etag(version, fields)):
+                return not_modified(make_etag(version, fields))
+        user = user_service.get(user_id, columns=select_columns(User, fields, 'id', 'updated_at'))
+        return with_etag(fast_response(DataResponse().success_response(data=user), UserItemResponse, fields),
+                         make_etag(resource_version(user.id, user.updated_at), fields))
     except Exception as e:
         raise CustomException(http_code=400, code='400', message=str(e))
 
 
 @router.put("/{user_id}", dependencies=[Depends(PermissionRequired('admin'))],
             response_model=DataResponse[UserItemResponse])
-def update(user_id: int, user_data: UserUpdateRequest, user_service: UserService = Depends()) -> Any:
+@query_budget(3)
+async def update(user_id: int, user_data: UserUpdateRequest, if_match: Optional[str] = Header(None),
+                 user_service: UserService = Depends()) -> Any:
     """
-    API update User
+    API update User. With If-Match (an ETag of API get Detail User), 412 Precondition Failed
+    when the user changed since the client read it.
     """
+    hashed_password = await get_password_hash_async(user_data.password) if user_data.password else None
     try:
-        updated_user = user_service.update(user_id=user_id, data=user_data)
-        return DataResponse().success_response(data=updated_user)
+        updated_user = await run_in_threadpool(
+            user_service.update, user_id=user_id, data=user_data, hashed_password=hashed_password, if_match=if_match)
+        return with_etag(fast_response(DataResponse().success_response(data=updated_user), UserItemResponse),
+                         make_etag(resource_version(updated_user.id, updated_user.updated_at), USER_FIELDS))
+    except CustomException:
+        raise
     except Exception as e:
         raise CustomException(http_code=400, code='400', message=str(e))
@@ -0,0 +1,135 @@
+import logging
+from typing import Any, Optional, Tuple
+
+from fastapi import APIRouter, Depends, Header, Request
+from sqlalchemy import select
+
+from app.core.security import get_password_hash_async
+from app.helpers.etag import is_not_modified, make_etag, not_modified, page_version, resource_version, with_etag
+from app.helpers.exception_handler import CustomException
+from app.helpers.fieldsets import SparseFields, select_columns
+from app.helpers.login_manager import async_login_required, AsyncPermissionRequired
+from app.helpers.paging import Page, PaginationParams, paginate_async
+from app.helpers.request_timing import query_budget
+from app.helpers.responses import fast_response
+from app.schemas.sche_base import DataResponse
+from app.schemas.sche_user import UserItemResponse, UserCreateRequest, UserUpdateMeRequest, UserUpdateRequest, \
+    UserSnapshot, UserFilterParams
+from app.services.srv_user import UserService
+from app.services.srv_user_async import AsyncUserService
+from app.models import User
+
+logger = logging.getLogger()
+router = APIRouter()
+
+USER_FIELDS = tuple(UserItemResponse.__fields__)
+
+
+@router.get("", dependencies=[Depends(async_login_required)], response_model=Page[UserItemResponse])
+@query_budget(5)
+async def get(request: Request, params: PaginationParams = Depends(), filters: UserFilterParams = Depends(),
+              fields: Tuple[str, ...] = Depends(SparseFields(UserItemResponse)),
+              if_none_match: Optional[str] = Header(None), user_service: AsyncUserService = Depends()) -> Any:
+    """
+    API Get list User, 304 Not Modified when If-None-Match has the ETag of the page
+    """
+    try:
+        clauses = UserService.list_filters(filters)
+        etag = make_etag(
+            page_version(*await user_service.list_state(clauses), request.query_params.multi_items()), fields)
+        if is_not_modified(if_none_match, etag):
+            return not_modified(etag)
+        statement = select(*select_columns(User, fields)).filter(*clauses)
+        users = await paginate_async(model=User, session=user_service.session, statement=statement, params=params)
+        return with_etag(fast_response(users, UserItemResponse, fields), etag)
+    except CustomException:
+        raise
+    except Exception as e:
+        logger.error(e)
+        raise CustomException(http_code=400, code='400', message=str(e))
+
+
+@router.post("", dependencies=[Depends(AsyncPermissionRequired('admin'))],
+             response_model=DataResponse[UserItemResponse])
+@query_budget(2)
+async def create(user_data: UserCreateRequest, user_service: AsyncUserService = Depends()) -> Any:
+    """
+    API Create User
+    """
+    hashed_password = await get_password_hash_async(user_data.password)
+    try:
+        new_user = await user_service.create_user(user_data, hashed_password)
+        return fast_response(DataResponse().success_response(data=new_user), UserItemResponse)
+    except Exception as e:
+        raise CustomException(http_code=400, code='400', message=str(e))
+
+
+@router.get("/me", response_model=DataResponse[UserItemResponse])
+@query_budget(1)
+async def detail_me(current_user: UserSnapshot = Depends(async_login_required),
+                    if_none_match: Optional[str] = Header(None)) -> Any:
+    """
+    API get detail current User, 304 Not Modified when If-None-Match has its ETag
+    """
+    etag = make_etag(resource_version(current_user.id, current_user.updated_at), USER_FIELDS)
+    if is_not_modified(if_none_match, etag):
+        return not_modified(etag)
+    return with_etag(fast_response(DataResponse().success_response(data=current_user), UserItemResponse), etag)
+
+
+@router.put("/me", response_model=DataResponse[UserItemResponse])
+@query_budget(2)
+async def update_me(user_data: UserUpdateMeRequest,
+                    current_user: UserSnapshot = Depends(async_login_required),
+                    user_service: AsyncUserService = Depends()) -> Any:
+    """
+    API Update current User
+    """
+    hashed_password = await get_password_hash_async(user_data.password) if user_data.password else None
+    try:
+        updated_user = await user_service.update_me(data=user_data, current_user=current_user,
+                                                    hashed_password=hashed_password)
+        return with_etag(fast_response(DataResponse().success_response(data=updated_user), UserItemResponse),
+                         make_etag(resource_version(updated_user.id, updated_user.updated_at), USER_FIELDS))
+    except Exception as e:
+        raise CustomException(http_code=400, code='400', message=str(e))
+
+
+@router.get("/{user_id}", dependencies=[Depends(async_login_required)],
+            response_model=DataResponse[UserItemResponse])
+@query_budget(3)
+async def detail(user_id: int, fields: Tuple[str, ...] = Depends(SparseFields(UserItemResponse)),
+                 if_none_match: Optional[str] = Header(None), user_service: AsyncUserService = Depends()) -> Any:
+    """
+    API get Detail User, 304 Not Modified from a primary key probe when If-None-Match has its ETag
+    """
+    try:
+        if if_none_match is not None:
+            version = await user_service.get_version(user_id)
+            if version is not None and is_not_modified(if_none_match, make_etag(version, fields)):
+                return not_modified(make_etag(version, fields))
+        user = await user_service.get(user_id, columns=select_columns(User, fields, 'id', 'updated_at'))
+        return with_etag(fast_response(DataResponse().success_response(data=user), UserItemResponse, fields),
+                         make_etag(resource_version(user.id, user.updated_at), fields))
+    except Exception as e:
+        raise CustomException(http_code=400, code='400', message=str(e))
+
+
+@router.put("/{user_id}", dependencies=[Depends(AsyncPermissionRequired('admin'))],
+            response_model=DataResponse[UserItemResponse])
+@query_budget(3)
+async def update(user_id: int, user_data: UserUpdateRequest, if_match: Optional[str] = Header(None),
+                 user_service: AsyncUserService = Depends()) -> Any:
+    """
+    API update User, 412 Precondition Failed when If-Match is not an ETag of its current version
+    """
+    hashed_password = await get_password_hash_async(user_data.password) if user_data.password else None
+    try:
+        updated_user = await user_service.update(user_id=user_id, data=user_data, hashed_password=hashed_password,
+                                                 if_match=if_match)
+        return with_etag(fast_response(DataResponse().success_response(data=updated_user), UserItemResponse),
+                         make_etag(resource_version(updated_user.id, updated_user.updated_at), USER_FIELDS))
+    except CustomException:
+        raise
+    except Exception as e:
+        raise CustomException(http_code=400, code='400', message=str(e))
@@ -12,8 +12,60 @@ class Settings(BaseSettings):
     API_PREFIX = ''
     BACKEND_CORS_ORIGINS = ['*']
     DATABASE_URL = os.getenv('SQL_DATABASE_URL', '')
+    # Pool of the shared engine, per worker: size workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) below max_connections
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30  # Seconds to wait for a connection before failing
+    DB_POOL_RECYCLE: int = 1800  # Seconds before a connection is replaced, -1 to never recycle
+    DB_POOL_PRE_PING: bool = True
+    # Read replicas (comma separated URLs) serving the GET endpoints of the user API, none = all on the primary
+    DB_REPLICA_URLS = [url.strip() for url in os.getenv('SQL_REPLICA_DATABASE_URLS', '').split(',') if url.strip()]
+    DB_REPLICA_MAX_LAG: float = 5  # Seconds of replication lag above which a replica is taken out of rotation
+    DB_REPLICA_CHECK_INTERVAL: float = 2  # Seconds between two lag checks of each worker
+    DB_READ_YOUR_WRITES_WINDOW: float = 5  # Seconds a principal reads from the primary after a write, per worker
+    DB_READ_YOUR_WRITES_CACHE_SIZE: int = 10000  # Recent writers kept per worker, the oldest writes are dropped beyond
+    DB_CREATE_ALL: bool = False  # create_all on startup (local dev), the schema is owned by the alembic migrations
+    # Async (asyncio) database stack, served next to the sync API under ASYNC_API_PREFIX
+    ASYNC_DB_ENABLED: bool = False
+    ASYNC_DATABASE_URL = os.getenv('SQL_ASYNC_DATABASE_URL', '')  # Derived from DATABASE_URL when empty
+    ASYNC_API_PREFIX = '/async'
+    PAGINATION_COUNT_STRATEGY = os.getenv('PAGINATION_COUNT_STRATEGY', 'exact')  # Default of CountStrategy
+    PAGINATION_COUNT_CACHE_TTL: int = 60
+    PAGINATION_COUNT_CACHE_SIZE: int = 1024
+    EXPORT_CHUNK_SIZE: int = 1000  # Rows fetched from the server side cursor and sent per chunk by exports
+    BATCH_UPDATE_CHUNK_SIZE: int = 1000  # Rows per UPDATE ... FROM (VALUES ...) of PATCH /users
+    # Write-behind of user.last_login, see app.services.srv_last_login
+    LAST_LOGIN_FLUSH_INTERVAL: float = 1  # Seconds between two writes of the pending last_login values
+    LAST_LOGIN_FLUSH_SIZE: int = 1000  # Pending users that trigger a write before the interval
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL: int = 30  # Seconds another worker may serve a stale user after an update
     ACCESS_TOKEN_EXPIRE_SECONDS: int = 60 * 60 * 24 * 7  # Token expired after 7 days
     SECURITY_ALGORITHM = 'HS256'
+    PASSWORD_HASH_WORKERS: int = os.cpu_count() or 1  # bcrypt process pool size, 0 = default threadpool
+    PASSWORD_HASH_MAX_PENDING: int = 256  # Hashing jobs allowed to queue before answering 503
+    # Token buckets of the password hashing endpoints (login, register), per worker, see app.helpers.rate_limit
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_IP_RATE: float = 1  # Requests per second a client IP gets back
+    RATE_LIMIT_IP_BURST: int = 20
+    # The IP is request.client.host. Behind a load balancer or reverse proxy, app.server takes it from the
+    # X-Forwarded-For header of these proxies (comma separated IPs, '*' = any): list the proxies' IPs, otherwise
+    # every client shares the proxy's bucket. '*' only if the workers can't be reached without the proxy.
+    SERVER_PROXY_HEADERS: bool = True
+    SERVER_FORWARDED_ALLOW_IPS = '127.0.0.1'
+    RATE_LIMIT_EMAIL_RATE: float = 0.2  # Requests per second an email (login attempts, registration) gets back
+    RATE_LIMIT_EMAIL_BURST: int = 5
+    RATE_LIMIT_MAX_KEYS: int = 100000  # Buckets kept, the least recently used are dropped beyond
+    # Per-request SQL instrumentation, see app.helpers.request_timing
+    SQL_SLOW_QUERY_MS: int = 200  # Statements slower than this are logged with their route
+    SQL_N_PLUS_ONE_THRESHOLD: int = 10  # Same statement repeated this many times in one request is logged
+    SQL_QUERY_BUDGET_STRICT: bool = False  # Fail requests going over their endpoint's query_budget
+    # Pre-fork server of app.server
+    SERVER_HOST = '0.0.0.0'
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: int = 0  # 0 = one per CPU available to the container
+    SERVER_BACKLOG: int = 2048
+    SERVER_GRACEFUL_TIMEOUT: float = 30  # Seconds workers get to finish in-flight requests on SIGTERM
+    SERVER_ACCESS_LOG: bool = True
     LOGGING_CONFIG_FILE = os.path.join(BASE_DIR, 'logging.ini')
 
 
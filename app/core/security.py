@@ -1,12 +1,19 @@
+import os
 import jwt
+import asyncio
 
-from typing import Any, Union
+from typing import Any, Callable, List, Optional, Union
+from concurrent.futures import Executor, ProcessPoolExecutor
+from fastapi import HTTPException
 from app.core.config import settings
 from datetime import datetime, timedelta
 from passlib.context import CryptContext
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+hash_executor: Optional[Executor] = None
+hash_pending = 0  # Hashing jobs submitted and not finished yet, only touched from the event loop
+
 
 def create_access_token(user_id: Union[int, Any]) -> str:
     expire = datetime.utcnow() + timedelta(
@@ -25,3 +32,70 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+
+def get_password_hashes(passwords: List[str]) -> List[str]:
+    return [pwd_context.hash(password) for password in passwords]
+
+
+def start_hash_executor() -> None:
+    """
+    Start the bcrypt process pool and spawn its workers now rather than on the first login.
+    PASSWORD_HASH_WORKERS = 0 keeps hashing in the default threadpool.
+    """
+    global hash_executor
+    if hash_executor is not None or settings.PASSWORD_HASH_WORKERS <= 0:
+        return
+    hash_executor = ProcessPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS)
+    for future in [hash_executor.submit(os.getpid) for _ in range(settings.PASSWORD_HASH_WORKERS)]:
+        future.result()
+
+
+def shutdown_hash_executor() -> None:
+    global hash_executor
+    if hash_executor is not None:
+        hash_executor.shutdown(wait=True)
+        hash_executor = None
+
+
+async def _run_hashing(func: Callable, *args) -> Any:
+    """
+    Run a bcrypt call in the process pool so that it uses every core and keeps the GIL free.
+    Reject right away with 503 once PASSWORD_HASH_MAX_PENDING jobs are queued instead of piling up.
+    """
+    global hash_pending
+    if hash_pending >= settings.PASSWORD_HASH_MAX_PENDING:
+        raise HTTPException(status_code=503, detail='Server is busy, please try again later',
+                            headers={'Retry-After': '1'})
+    start_hash_executor()
+    hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(hash_executor, func, *args)
+    finally:
+        hash_pending -= 1
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_hashing(verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_hashing(get_password_hash, password)
+
+
+async def get_password_hashes_async(passwords: List[str], chunk_size: int = 4) -> List[str]:
+    """
+    Hash many passwords (bulk import), chunk_size per pool job.
+    At most one job per worker is queued at a time, so a login waits behind one small chunk at worst
+    instead of the whole import.
+    """
+    chunks = [passwords[start:start + chunk_size] for start in range(0, len(passwords), chunk_size)]
+    workers = max(settings.PASSWORD_HASH_WORKERS, 1)
+    hashes: List[str] = []
+    for start in range(0, len(chunks), workers):
+        results = await asyncio.gather(*[
+            _run_hashing(get_password_hashes, chunk) for chunk in chunks[start:start + workers]
+        ])
+        for result in results:
+            hashes.extend(result)
+    return hashes
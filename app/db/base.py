@@ -1,15 +1,55 @@
-from typing import Generator
+from typing import AsyncGenerator, Generator
 from app.core.config import settings
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
-engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True)
+from app.db.pool import InstrumentedQueuePool
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+}
+
+POOL_OPTIONS = dict(
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+)
+
+
+# The one engine (and pool) of the process, shared by SessionLocal and db.session
+engine = create_engine(settings.DATABASE_URL, poolclass=InstrumentedQueuePool, **POOL_OPTIONS)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+def get_async_database_url() -> str:
+    """
+    Return ASYNC_DATABASE_URL, or DATABASE_URL with its driver swapped for the asyncio one
+    """
+    if settings.ASYNC_DATABASE_URL:
+        return settings.ASYNC_DATABASE_URL
+    url = make_url(settings.DATABASE_URL)
+    return str(url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)))
+
+
+async_engine = create_async_engine(get_async_database_url(), **POOL_OPTIONS) \
+    if settings.ASYNC_DB_ENABLED else None
+AsyncSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine, class_=AsyncSession
+)
+
+
 def get_db() -> Generator:
     try:
         db = SessionLocal()
         yield db
     finally:
         db.close()
+
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,50 @@
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+from app.helpers.metrics import Histogram
+
+CHECKOUT_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool recording how long each checkout waited for a connection and how many timed out
+    """
+    _sqla_logger_namespace = 'sqlalchemy.pool.impl.QueuePool'  # Log under sqlalchemy.*, not the DEBUG app.* logger
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.checkout_wait = Histogram(CHECKOUT_WAIT_BUCKETS)
+        self.timeouts = 0
+        self._stats_lock = threading.Lock()
+
+    def recreate(self) -> 'InstrumentedQueuePool':
+        pool = super().recreate()
+        pool.checkout_wait, pool.timeouts = self.checkout_wait, self.timeouts
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            with self._stats_lock:
+                self.checkout_wait.observe(time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        return {
+            'pool_size': self.size(),
+            'max_overflow': self._max_overflow,
+            'checked_out': self.checkedout(),
+            'idle': self.checkedin(),
+            'overflow_in_use': max(self.overflow(), 0),
+            'timeouts': self.timeouts,
+            'checkout_wait': self.checkout_wait.as_dict(),
+        }
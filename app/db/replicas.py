@@ -0,0 +1,117 @@
+import itertools
+import logging
+import threading
+from typing import List, Optional
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import settings
+from app.db.base import POOL_OPTIONS
+from app.db.pool import InstrumentedQueuePool
+from app.helpers.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Seconds since the last replayed transaction, 0 on a primary or a replica that has replayed all it received
+# (an idle primary sends nothing, pg_last_xact_replay_timestamp() then ages without any real lag)
+LAG_QUERY = text(
+    'SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+)
+
+
+class Replica(object):
+    __slots__ = ('name', 'engine', 'session_factory', 'lag', 'healthy')
+
+    def __init__(self, url: str) -> None:
+        self.name = make_url(url).render_as_string(hide_password=True)
+        self.engine: Engine = create_engine(url, poolclass=InstrumentedQueuePool, **POOL_OPTIONS)
+        self.session_factory = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.lag: Optional[float] = None
+        self.healthy = True
+
+
+class ReplicaSet(object):
+    """
+    Read replicas of the primary, handed out round-robin to the read-only requests (see db.read_session).
+    A monitor thread measures the replication lag of each replica every DB_REPLICA_CHECK_INTERVAL seconds and
+    takes out of rotation the ones over DB_REPLICA_MAX_LAG or unreachable, until they catch up.
+    """
+
+    def __init__(self) -> None:
+        self.replicas: List[Replica] = []
+        self._counter = itertools.count()
+        self._stop = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    def configure(self, urls: List[str]) -> None:
+        self.dispose()
+        self.replicas = [Replica(url) for url in urls]
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.replicas)
+
+    def choose(self) -> Optional[Replica]:
+        """
+        Next healthy replica, None when there is none (the reads then go to the primary)
+        """
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)]
+
+    def measure_lag(self, replica: Replica) -> float:
+        with replica.engine.connect() as connection:
+            return float(connection.execute(LAG_QUERY).scalar())
+
+    def check(self) -> None:
+        for replica in self.replicas:
+            try:
+                replica.lag = self.measure_lag(replica)
+                healthy = replica.lag <= settings.DB_REPLICA_MAX_LAG
+            except SQLAlchemyError as e:
+                replica.lag, healthy = None, False
+                logger.debug('Replica %s lag check failed: %s', replica.name, e)
+            if healthy != replica.healthy:
+                replica.healthy = healthy
+                if healthy:
+                    logger.warning('Replica %s back in rotation (lag %.1fs)', replica.name, replica.lag)
+                else:
+                    logger.warning('Replica %s out of rotation (lag %s)', replica.name,
+                                   'unknown' if replica.lag is None else f'{replica.lag:.1f}s')
+
+    def _run_monitor(self) -> None:
+        while not self._stop.wait(settings.DB_REPLICA_CHECK_INTERVAL):
+            self.check()
+
+    def start_monitor(self) -> None:
+        if not self.replicas or self._monitor is not None:
+            return
+        self.check()
+        self._stop.clear()
+        self._monitor = threading.Thread(target=self._run_monitor, name='replica-monitor', daemon=True)
+        self._monitor.start()
+
+    def stop_monitor(self) -> None:
+        if self._monitor is not None:
+            self._stop.set()
+            self._monitor.join()
+            self._monitor = None
+
+    def dispose(self, close: bool = True) -> None:
+        for replica in self.replicas:
+            replica.engine.dispose(close=close)
+
+
+replicas = ReplicaSet()
+replicas.configure(settings.DB_REPLICA_URLS)
+
+# Principals that wrote in the last DB_READ_YOUR_WRITES_WINDOW seconds, their reads stay on the primary.
+# Per worker process, like user_cache: a client whose next request lands on another worker may read from a
+# replica that has not replayed its write yet, within DB_REPLICA_MAX_LAG.
+recent_writers = TTLCache(maxsize=settings.DB_READ_YOUR_WRITES_CACHE_SIZE,
+                         ttl=settings.DB_READ_YOUR_WRITES_WINDOW)
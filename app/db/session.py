@@ -0,0 +1,199 @@
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.db.base import SessionLocal
+from app.db.replicas import recent_writers, replicas
+
+
+SAFE_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+
+class MissingSessionError(Exception):
+    def __init__(self) -> None:
+        super().__init__('No session context: db.session is only available inside DBSessionMiddleware '
+                         'or a `with db():` block')
+
+
+class _LazySession:
+    """
+    Per-request slot for the session, created the first time db.session is read.
+    It is a mutable object (not the session itself) in the context var so that a session created in a
+    threadpool worker, which runs on a copy of the context, is still seen and closed by the middleware.
+    """
+    __slots__ = ('factory', 'session', 'used')
+
+    def __init__(self, factory: sessionmaker) -> None:
+        self.factory = factory
+        self.session: Optional[Session] = None
+        self.used = False
+
+    def get(self) -> Session:
+        if self.session is None:
+            self.session = self.factory()
+            self.used = True
+        return self.session
+
+    def close(self, rollback: bool = False) -> None:
+        session, self.session = self.session, None
+        if session is not None:
+            if rollback:
+                session.rollback()
+            session.close()
+
+
+class _LazyReadSession:
+    """
+    Per-request slot for db.read_session: the first read picks a healthy replica, or the primary's slot when
+    there is none or the principal wrote in the last DB_READ_YOUR_WRITES_WINDOW seconds (read-your-writes).
+    All the reads of the request then stay on that one source.
+    """
+    __slots__ = ('primary', 'principal', 'slot')
+
+    def __init__(self, primary: _LazySession) -> None:
+        self.primary = primary
+        self.principal: Optional[int] = None
+        self.slot: Optional[_LazySession] = None
+
+    def source(self) -> _LazySession:
+        if self.slot is None:
+            replica = None if self.principal is not None and recent_writers.get(self.principal) \
+                else replicas.choose()
+            self.slot = self.primary if replica is None else _LazySession(replica.session_factory)
+        return self.slot
+
+    def get(self) -> Session:
+        return self.source().get()
+
+    @property
+    def used(self) -> bool:
+        return self.slot is not None and self.slot.used
+
+    def close(self) -> None:
+        if self.slot is not None and self.slot is not self.primary:
+            self.slot.close()
+
+
+_lazy_session: ContextVar[Optional[_LazySession]] = ContextVar('_lazy_session', default=None)
+_lazy_read_session: ContextVar[Optional[_LazyReadSession]] = ContextVar('_lazy_read_session', default=None)
+
+
+class SessionStats:
+    requests = 0  # HTTP requests seen by DBSessionMiddleware
+    requests_with_session = 0  # of which actually opened a session
+
+    @classmethod
+    def as_dict(cls) -> dict:
+        return {'requests': cls.requests, 'requests_with_session': cls.requests_with_session}
+
+
+class DBSessionMeta(type):
+    # db.session as a class level property, same interface as fastapi_sqlalchemy
+    @property
+    def session(cls) -> Session:
+        """Return the Session of the current request/`with db():` block, creating it on first use."""
+        lazy_session = _lazy_session.get()
+        if lazy_session is None:
+            raise MissingSessionError
+        return lazy_session.get()
+
+    @property
+    def read_session(cls) -> Session:
+        """Return the Session of the current request's reads, a replica's or db.session. Never write with it."""
+        return cls._read_slot().get()
+
+    @property
+    def read_session_factory(cls) -> sessionmaker:
+        """Session factory of the source of db.read_session, for the sessions outliving the request's"""
+        return cls._read_slot().source().factory
+
+
+class DBSession(metaclass=DBSessionMeta):
+    session_factory: sessionmaker = SessionLocal
+
+    def __init__(self, commit_on_exit: bool = False) -> None:
+        self.token = None
+        self.commit_on_exit = commit_on_exit
+
+    @classmethod
+    def configure(cls, session_factory: sessionmaker) -> None:
+        cls.session_factory = session_factory
+
+    @classmethod
+    def _read_slot(cls) -> _LazyReadSession:
+        lazy_read_session = _lazy_read_session.get()
+        if lazy_read_session is None:
+            raise MissingSessionError
+        return lazy_read_session
+
+    @classmethod
+    def set_principal(cls, user_id: int) -> None:
+        """
+        Tell who the current request runs for: its reads stay on the primary for DB_READ_YOUR_WRITES_WINDOW seconds
+        after a successful write of the same principal
+        """
+        lazy_read_session = _lazy_read_session.get()
+        if lazy_read_session is not None:
+            lazy_read_session.principal = user_id
+
+    def __enter__(self):
+        lazy_session = _LazySession(type(self).session_factory)
+        self.token = _lazy_session.set(lazy_session), _lazy_read_session.set(_LazyReadSession(lazy_session))
+        return type(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        lazy_session, lazy_read_session = _lazy_session.get(), _lazy_read_session.get()
+        if exc_type is None and self.commit_on_exit and lazy_session.session is not None:
+            lazy_session.session.commit()
+        lazy_read_session.close()
+        lazy_session.close(rollback=exc_type is not None)
+        _lazy_read_session.reset(self.token[1])
+        _lazy_session.reset(self.token[0])
+
+
+db = DBSession
+
+
+class DBSessionMiddleware:
+    """
+    Give each HTTP request a lazy db.session: no session nor pooled connection is taken until a handler
+    or dependency reads db.session, and it is closed as soon as the response starts, before the body
+    is sent. A StreamingResponse that reads the database while streaming must use its own connection.
+    A successful unsafe request (POST, PUT, PATCH, DELETE) of a principal keeps its next reads on the primary.
+    """
+
+    def __init__(self, app: ASGIApp, session_factory: Optional[sessionmaker] = None) -> None:
+        self.app = app
+        if session_factory is not None:
+            DBSession.configure(session_factory)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        lazy_session = _LazySession(DBSession.session_factory)
+        lazy_read_session = _LazyReadSession(lazy_session)
+        token = _lazy_session.set(lazy_session)
+        read_token = _lazy_read_session.set(lazy_read_session)
+
+        async def send_wrapper(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                lazy_read_session.close()
+                lazy_session.close()
+                if replicas.enabled and lazy_read_session.principal is not None \
+                        and scope['method'] not in SAFE_METHODS and message['status'] < 400:
+                    recent_writers.set(lazy_read_session.principal, True)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            lazy_read_session.close()
+            lazy_session.close()
+            _lazy_read_session.reset(read_token)
+            _lazy_session.reset(token)
+            SessionStats.requests += 1
+            SessionStats.requests_with_session += lazy_session.used or lazy_read_session.used
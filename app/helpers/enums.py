@@ -4,3 +4,16 @@ import enum
 class UserRole(enum.Enum):
     ADMIN = 'admin'
     GUEST = 'guest'
+
+
+class CountStrategy(enum.Enum):
+    EXACT = 'exact'          # SELECT count(*) FROM (query)
+    NONE = 'none'            # skip the count, total_items is null
+    ESTIMATED = 'estimated'  # pg_class.reltuples / planner row estimate (Postgres only)
+    CACHED = 'cached'        # exact count, cached for PAGINATION_COUNT_CACHE_TTL seconds per query
+    WINDOW = 'window'        # count(*) OVER() in the page query itself
+
+
+class FileFormat(enum.Enum):
+    NDJSON = 'ndjson'  # one JSON object per line
+    CSV = 'csv'        # header row with the field names, then one line per row
@@ -0,0 +1,72 @@
+import hashlib
+from datetime import datetime
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from starlette.responses import Response
+
+CACHE_CONTROL = 'private, no-cache'  # Clients may keep the response but must revalidate it with If-None-Match
+
+
+def _digest(value: str) -> str:
+    return hashlib.blake2b(value.encode(), digest_size=8).hexdigest()
+
+
+def resource_version(user_id: int, updated_at: Optional[datetime]) -> str:
+    """
+    Version of a user, changes with every write since updated_at is set on each UPDATE
+    """
+    return _digest(f'{user_id}:{updated_at.isoformat() if updated_at else ""}')
+
+
+def page_version(count: int, max_updated_at: Optional[datetime], params: Iterable[Tuple[str, str]]) -> str:
+    """
+    Version of a list page: the number of users matching its filters, the last change among them, and its query
+    params. A user entering the filtered set moves max(updated_at), a user leaving it (its update no longer
+    matches) only changes the count.
+    """
+    query = '&'.join(f'{key}={value}' for key, value in sorted(params) if key != 'fields')
+    return _digest(f'{count}|{max_updated_at.isoformat() if max_updated_at else ""}|{query}')
+
+
+def make_etag(version: str, fields: Sequence[str]) -> str:
+    """
+    Strong ETag of a representation: the version of the data, then its (sparse) fieldset
+    """
+    return f'"{version}.{_digest(",".join(fields))}"'
+
+
+def _entity_tags(header: str) -> List[str]:
+    return [tag.strip() for tag in header.split(',') if tag.strip()]
+
+
+def is_not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    True when If-None-Match lists etag, the client's copy is current (weak comparison, RFC 7232 3.2)
+    """
+    if if_none_match is None:
+        return False
+    tags = _entity_tags(if_none_match)
+    return '*' in tags or etag in {tag[2:] if tag.startswith('W/') else tag for tag in tags}
+
+
+def is_precondition_met(if_match: Optional[str], version: str) -> bool:
+    """
+    If-Match of a write (strong comparison, RFC 7232 3.1): True when it is missing or lists an ETag of the
+    current version, whatever the fieldset the client read
+    """
+    if if_match is None:
+        return True
+    tags = _entity_tags(if_match)
+    return '*' in tags or any(
+        not tag.startswith('W/') and tag.strip('"').split('.')[0] == version for tag in tags
+    )
+
+
+def with_etag(response: Response, etag: str) -> Response:
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
+
+
+def not_modified(etag: str) -> Response:
+    return with_etag(Response(status_code=304), etag)
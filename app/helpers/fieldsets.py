@@ -0,0 +1,37 @@
+from typing import List, Optional, Tuple, Type
+
+from fastapi import Query
+from pydantic import BaseModel
+
+from app.helpers.exception_handler import CustomException
+
+
+class SparseFields:
+    """
+    Dependency parsing the `fields` query param (comma separated) against the fields of schema.
+    Returns the requested names in schema order, or all of them when the param is missing.
+    """
+
+    def __init__(self, schema: Type[BaseModel]):
+        self.schema = schema
+
+    def __call__(self, fields: Optional[str] = Query(
+            None, description='Comma separated fields to return, e.g. id,email. Defaults to all fields')
+    ) -> Tuple[str, ...]:
+        if not fields:
+            return tuple(self.schema.__fields__)
+        requested = {name.strip() for name in fields.split(',') if name.strip()}
+        unknown = requested.difference(self.schema.__fields__)
+        if unknown or not requested:
+            raise CustomException(http_code=400, code='400',
+                                  message=f'Invalid fields: {", ".join(sorted(unknown)) or fields}')
+        return tuple(name for name in self.schema.__fields__ if name in requested)
+
+
+def select_columns(model, fields: Tuple[str, ...], *required: str) -> List:
+    """
+    Columns of model to SELECT for fields, plus the required ones (id, sort_by, ...) the caller needs
+    internally but does not output
+    """
+    names = dict.fromkeys(fields + required)
+    return [getattr(model, name) for name in names]
@@ -1,20 +1,44 @@
 from fastapi import HTTPException, Depends
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.models import User
+from app.db.base import get_async_db
+from app.db.session import db
+from app.helpers.request_timing import timed
+from app.schemas.sche_user import UserSnapshot
 from app.services.srv_user import UserService
+from app.services.srv_user_async import AsyncUserService
 
 
-def login_required(http_authorization_credentials=Depends(UserService().reusable_oauth2)):
-    return UserService().get_current_user(http_authorization_credentials)
+def login_required(http_authorization_credentials=Depends(UserService.reusable_oauth2)) -> UserSnapshot:
+    """
+    The request's principal. Routes take it with Depends(login_required) instead of calling
+    UserService.get_current_user, so FastAPI's per-request dependency cache resolves it only once
+    however many routes params/dependencies/PermissionRequired ask for it.
+    It is also the principal of db.read_session's read-your-writes window.
+    """
+    with timed('auth'):
+        user = UserService.get_current_user(http_authorization_credentials)
+    db.set_principal(user.id)
+    return user
+
+
+async def async_login_required(http_authorization_credentials=Depends(UserService.reusable_oauth2),
+                               session: AsyncSession = Depends(get_async_db)) -> UserSnapshot:
+    with timed('auth'):
+        return await AsyncUserService(session).get_current_user(http_authorization_credentials)
 
 
 class PermissionRequired:
     def __init__(self, *args):
-        self.user = None
         self.permissions = args
 
-    def __call__(self, user: User = Depends(login_required)):
-        self.user = user
-        if self.user.role not in self.permissions and self.permissions:
+    def __call__(self, user: UserSnapshot = Depends(login_required)) -> UserSnapshot:
+        if user.role not in self.permissions and self.permissions:
             raise HTTPException(status_code=400,
-                                detail=f'User {self.user.email} can not access this api')
+                                detail=f'User {user.email} can not access this api')
+        return user
+
+
+class AsyncPermissionRequired(PermissionRequired):
+    async def __call__(self, user: UserSnapshot = Depends(async_login_required)) -> UserSnapshot:
+        return super().__call__(user)
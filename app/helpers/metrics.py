@@ -0,0 +1,220 @@
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from starlette.routing import BaseRoute, Route
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Cumulative-on-read histogram: observe() only bumps one bucket, sum and count.
+    No locking: callers observing from several threads serialize themselves.
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        """
+        [(upper bound, observations <= bound)], ending with +Inf
+        """
+        total, result = 0, []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def as_dict(self) -> dict:
+        return {
+            'buckets': {('+Inf' if bound == float('inf') else str(bound)): count for bound, count in self.cumulative()},
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+LATENCY_BUCKETS = DEFAULT_BUCKETS
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+STATUS_CLASSES = ('1xx', '2xx', '3xx', '4xx', '5xx')
+
+
+class RouteStats:
+    """
+    Series of one (method, route template), allocated once and then only mutated
+    """
+    __slots__ = ('method', 'route', 'in_flight', 'responses', 'latency', 'response_size')
+
+    def __init__(self, method: str, route: str) -> None:
+        self.method = method
+        self.route = route
+        self.in_flight = 0
+        self.responses = [0] * len(STATUS_CLASSES)
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.response_size = Histogram(SIZE_BUCKETS)
+
+
+class MetricsRegistry:
+    """
+    HTTP metrics of this worker. Everything is recorded from the event loop thread
+    (middleware and route wrappers are coroutines), so plain integer updates need no lock.
+    """
+
+    def __init__(self) -> None:
+        self.routes: Dict[Tuple[str, str], RouteStats] = {}
+        self.in_flight = 0
+        self.collectors: List[Callable[[], Iterable[str]]] = []
+
+    def route(self, method: str, route: str) -> RouteStats:
+        stats = self.routes.get((method, route))
+        if stats is None:
+            stats = self.routes[(method, route)] = RouteStats(method, route)
+        return stats
+
+    def add_collector(self, collector: Callable[[], Iterable[str]]) -> None:
+        """
+        Register a callable yielding extra exposition lines (pool, caches...), run on each scrape
+        """
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = [
+            '# HELP http_requests_in_flight Requests being served by this worker',
+            '# TYPE http_requests_in_flight gauge',
+            f'http_requests_in_flight {self.in_flight}',
+        ]
+        routes = sorted(self.routes.values(), key=lambda stats: (stats.route, stats.method))
+
+        lines += ['# HELP http_route_requests_in_flight Requests being served per route',
+                  '# TYPE http_route_requests_in_flight gauge']
+        lines += [f'http_route_requests_in_flight{{{_labels(stats)}}} {stats.in_flight}' for stats in routes]
+
+        lines += ['# HELP http_requests_total Responses sent, by status class',
+                  '# TYPE http_requests_total counter']
+        for stats in routes:
+            for status, count in zip(STATUS_CLASSES, stats.responses):
+                if count:
+                    lines.append(f'http_requests_total{{{_labels(stats)},status="{status}"}} {count}')
+
+        served = [stats for stats in routes if stats.latency.count]
+        lines += histogram_lines('http_request_duration_seconds', 'Request latency',
+                                 [(_labels(stats), stats.latency) for stats in served])
+        lines += histogram_lines('http_response_size_bytes', 'Response body size',
+                                 [(_labels(stats), stats.response_size) for stats in served])
+        for collector in self.collectors:
+            lines += collector()
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(stats: RouteStats) -> str:
+    return f'method="{stats.method}",route="{stats.route}"'
+
+
+def histogram_lines(name: str, help_text: str, series: List[Tuple[str, Histogram]]) -> List[str]:
+    """
+    Exposition lines of histograms, series being [(labels as 'k="v",...' or '', histogram)]
+    """
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for labels, histogram in series:
+        prefix = f'{labels},' if labels else ''
+        for bound, count in histogram.cumulative():
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {count}')
+        suffix = f'{{{labels}}}' if labels else ''
+        lines.append(f'{name}_sum{suffix} {histogram.sum}')
+        lines.append(f'{name}_count{suffix} {histogram.count}')
+    return lines
+
+
+def gauge_lines(name: str, help_text: str, value: float, kind: str = 'gauge') -> List[str]:
+    return [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+
+
+registry = MetricsRegistry()
+
+
+def instrument_routes(routes: Sequence[BaseRoute]) -> None:
+    """
+    Wrap the ASGI app of every route so that requests are labelled with the route template
+    (/users/{user_id}) rather than the raw path, without matching routes a second time
+    """
+    for route in routes:
+        if isinstance(route, Route) and not getattr(route.app, 'instrumented', False):
+            route.app = _RouteInstrument(route.app, {
+                method: registry.route(method, route.path_format) for method in route.methods or ()
+            })
+
+
+class _RouteInstrument:
+    __slots__ = ('app', 'stats_by_method')
+    instrumented = True
+
+    def __init__(self, app: ASGIApp, stats_by_method: Dict[str, RouteStats]) -> None:
+        self.app = app
+        self.stats_by_method = stats_by_method
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        stats = self.stats_by_method.get(scope['method'])
+        if stats is None:
+            await self.app(scope, receive, send)
+            return
+        scope['route_stats'] = stats
+        stats.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            stats.in_flight -= 1
+
+
+class _ResponseRecorder:
+    __slots__ = ('send_', 'status', 'size')
+
+    def __init__(self, send: Send) -> None:
+        self.send_ = send
+        self.status = 500  # Unhandled exceptions are turned into a 500 by ServerErrorMiddleware, outside of us
+        self.size = 0
+
+    async def send(self, message: Message) -> None:
+        if message['type'] == 'http.response.body':
+            self.size += len(message.get('body', b''))
+        elif message['type'] == 'http.response.start':
+            self.status = message['status']
+        await self.send_(message)
+
+
+class MetricsMiddleware:
+    """
+    Record count by status class, latency and response size per route template, and in-flight requests.
+    Requests that match no route are recorded under the route "<unmatched>".
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        recorder = _ResponseRecorder(send)
+        registry.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, recorder.send)
+        finally:
+            elapsed = time.perf_counter() - start
+            registry.in_flight -= 1
+            stats = scope.get('route_stats') or registry.route(scope['method'], '<unmatched>')
+            stats.responses[min(recorder.status // 100, 5) - 1] += 1
+            stats.latency.observe(elapsed)
+            stats.response_size.observe(recorder.size)
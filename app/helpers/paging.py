@@ -1,14 +1,22 @@
+import json
+import base64
 import logging
+from datetime import datetime
 from pydantic import BaseModel, conint
 from abc import ABC, abstractmethod
-from typing import Optional, Generic, Sequence, Type, TypeVar
+from typing import Any, Optional, Generic, NamedTuple, Sequence, Tuple, Type, TypeVar
 
-from sqlalchemy import asc, desc
-from sqlalchemy.orm import Query
+from sqlalchemy import and_, asc, desc, func, or_, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Query, Session
+from sqlalchemy.sql import Select
 from pydantic.generics import GenericModel
 from contextvars import ContextVar
 
+from app.core.config import settings
 from app.schemas.sche_base import ResponseSchemaBase, MetadataSchema
+from app.helpers.cache import TTLCache
+from app.helpers.enums import CountStrategy
 from app.helpers.exception_handler import CustomException
 
 T = TypeVar("T")
@@ -16,12 +24,20 @@ C = TypeVar("C")
 
 logger = logging.getLogger()
 
+# Columns a page may be sorted by: the public ones. A secret column (hashed_password...) could be read back
+# from the cursors, or its values probed through the seek condition. Ties (role, is_active, last_login...)
+# are broken by id, see _order_query.
+SORTABLE_COLUMNS = ('id', 'full_name', 'email', 'is_active', 'role', 'last_login', 'created_at', 'updated_at')
+
 
 class PaginationParams(BaseModel):
     page_size: Optional[conint(gt=0, lt=1001)] = 10
     page: Optional[conint(gt=0)] = 1
-    sort_by: Optional[str] = 'id'
+    sort_by: Optional[str] = 'id'  # One of SORTABLE_COLUMNS
     order: Optional[str] = 'desc'
+    cursor: Optional[str] = None  # next_cursor/prev_cursor of a previous page, replaces page/offset
+    include_total: Optional[bool] = True
+    count_strategy: Optional[CountStrategy] = None  # Defaults to settings.PAGINATION_COUNT_STRATEGY
 
 
 class BasePage(ResponseSchemaBase, GenericModel, Generic[T], ABC):
@@ -51,27 +67,264 @@ class Page(BasePage[T], Generic[T]):
 
 PageType: ContextVar[Type[BasePage]] = ContextVar("PageType", default=Page)
 
+count_cache = TTLCache(maxsize=settings.PAGINATION_COUNT_CACHE_SIZE, ttl=settings.PAGINATION_COUNT_CACHE_TTL)
+
+
+class Cursor(NamedTuple):
+    """
+    Position of a keyset (seek) page: the (sort_by value, id) of the boundary row
+    and the direction to move from it. Cursors carry sort_by/order so they stay opaque to clients.
+    """
+    sort_by: str
+    order: str
+    forward: bool
+    value: Any
+    id: int
+
+
+def encode_cursor(cursor: Cursor) -> str:
+    value = cursor.value.isoformat() if isinstance(cursor.value, datetime) else cursor.value
+    raw = json.dumps([cursor.sort_by, cursor.order, cursor.forward, value, cursor.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(model, token: str) -> Cursor:
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        cursor = Cursor(*json.loads(raw))
+        if cursor.sort_by not in SORTABLE_COLUMNS:
+            raise ValueError(cursor.sort_by)
+        column = getattr(model, cursor.sort_by)
+        if cursor.value is not None and column.type.python_type is datetime:
+            cursor = cursor._replace(value=datetime.fromisoformat(cursor.value))
+    except Exception:
+        raise CustomException(http_code=400, code='400', message='Invalid cursor')
+    return cursor
+
+
+def _sort_params(model, params: PaginationParams) -> Optional[Cursor]:
+    """
+    Decode params.cursor; its sort_by/order take precedence over the ones in the query string
+    """
+    if params.sort_by not in SORTABLE_COLUMNS:
+        raise CustomException(http_code=400, code='400', message='Invalid sort_by')
+    if not params.cursor:
+        return None
+    cursor = decode_cursor(model, params.cursor)
+    params.sort_by, params.order = cursor.sort_by, cursor.order
+    return cursor
+
+
+def _with_sort_keys(model, query, params: PaginationParams):
+    """
+    Cursors are built from the id and sort_by of the page rows: add them to column queries
+    (sparse fieldsets) that do not select them. Entity queries select every column already.
+    """
+    if not params.order:
+        return query
+    selected = (query if isinstance(query, Select) else query.statement).selected_columns.keys()
+    for name in dict.fromkeys(('id', params.sort_by)):
+        if name not in selected:
+            query = query.add_columns(getattr(model, name))
+    return query
+
+
+def _order_query(model, query, params: PaginationParams, cursor: Optional[Cursor]):
+    """
+    Order by (sort_by, id) and, in cursor mode, seek past the cursor row with
+    WHERE (sort_by, id) < (:value, :id) (> when scanning ascending).
+    Moving backwards scans in the opposite order; the page is reversed again in _build_page.
+    NULL sort_by values rank above all the others, as in the Postgres indexes (ASC NULLS LAST, DESC NULLS FIRST):
+    the seek condition has its own branch for them since a NULL never compares.
+    """
+    if not params.order:
+        return query
+    scan_desc = (params.order == 'desc') == (cursor is None or cursor.forward)
+    direction = desc if scan_desc else asc
+    sort_column = getattr(model, params.sort_by)
+    if sort_column is model.id:
+        if cursor is not None:
+            query = query.filter(model.id < cursor.id if scan_desc else model.id > cursor.id)
+        return query.order_by(direction(model.id))
+    if cursor is not None:
+        key, boundary = tuple_(sort_column, model.id), tuple_(cursor.value, cursor.id)
+        after_id = model.id < cursor.id if scan_desc else model.id > cursor.id
+        if scan_desc:
+            seek = key < boundary if cursor.value is not None else or_(sort_column.isnot(None), after_id)
+        else:
+            seek = or_(key > boundary, sort_column.is_(None)) if cursor.value is not None \
+                else and_(sort_column.is_(None), after_id)
+        query = query.filter(seek)
+    nulls = direction(sort_column).nulls_first() if scan_desc else direction(sort_column).nulls_last()
+    return query.order_by(nulls, direction(model.id))
+
+
+def _count_strategy(params: PaginationParams, cursor: Optional[Cursor]) -> CountStrategy:
+    if not params.include_total:
+        return CountStrategy.NONE
+    strategy = params.count_strategy or CountStrategy(settings.PAGINATION_COUNT_STRATEGY)
+    # In cursor mode the page query is filtered by the seek condition, so a window count is not the total
+    if strategy is CountStrategy.WINDOW and cursor is not None:
+        return CountStrategy.EXACT
+    return strategy
+
+
+def _exact_count(session: Session, statement: Select) -> int:
+    return session.execute(select(func.count()).select_from(statement.order_by(None).subquery())).scalar()
+
+
+def _estimated_count(model, session: Session, statement: Select) -> int:
+    """
+    Unfiltered queries read the table's pg_class.reltuples (kept up to date by ANALYZE/autovacuum),
+    filtered ones the planner's row estimate from EXPLAIN
+    """
+    bind = session.get_bind()
+    if statement.whereclause is None:
+        estimate = session.execute(
+            text('SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)'),
+            {'table': bind.dialect.identifier_preparer.format_table(model.__table__)}
+        ).scalar()
+        if estimate is not None and estimate >= 0:  # -1 until the table has been analyzed once
+            return estimate
+    compiled = statement.order_by(None).compile(dialect=bind.dialect)
+    plan = session.connection().exec_driver_sql(
+        f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params
+    ).scalar()
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def _cached_count(session: Session, statement: Select) -> int:
+    compiled = statement.order_by(None).compile(dialect=session.get_bind().dialect)
+    key = (str(compiled), repr(sorted(compiled.params.items())))
+    total = count_cache.get(key)
+    if total is None:
+        total = _exact_count(session, statement)
+        count_cache.set(key, total)
+    return total
+
+
+def count_total(model, session: Session, statement: Select,
+                strategy: CountStrategy) -> Tuple[Optional[int], CountStrategy]:
+    """
+    Count the rows of statement (unordered, before any seek/limit) with strategy.
+    Return (total, strategy actually used): ESTIMATED falls back to EXACT outside Postgres.
+    """
+    if strategy is CountStrategy.NONE:
+        return None, strategy
+    if strategy is CountStrategy.ESTIMATED and session.get_bind().dialect.name == 'postgresql':
+        return _estimated_count(model, session, statement), strategy
+    if strategy is CountStrategy.CACHED:
+        return _cached_count(session, statement), strategy
+    return _exact_count(session, statement), CountStrategy.EXACT
+
+
+def _unwrap_rows(model, rows: list) -> list:
+    """
+    Entity queries return (User, ...) rows, keep only the entity. Column queries (sparse fieldsets) keep
+    their Row tuples, which expose the columns as attributes; an extra window count column is ignored.
+    """
+    if rows and isinstance(rows[0][0], model):
+        return [row[0] for row in rows]
+    return rows
+
+
+def _build_page(rows: list, total: Optional[int], strategy: CountStrategy,
+                params: PaginationParams, cursor: Optional[Cursor]) -> BasePage:
+    """
+    rows holds up to page_size + 1 items; the extra one only tells whether there is a further page
+    """
+    has_more = len(rows) > params.page_size
+    rows = rows[:params.page_size]
+    if cursor is not None and not cursor.forward:
+        rows.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, cursor is not None or params.page > 1
+
+    next_cursor = prev_cursor = None
+    if params.order and rows:
+        if has_next:
+            last = rows[-1]
+            next_cursor = encode_cursor(
+                Cursor(params.sort_by, params.order, True, getattr(last, params.sort_by), last.id))
+        if has_prev:
+            first = rows[0]
+            prev_cursor = encode_cursor(
+                Cursor(params.sort_by, params.order, False, getattr(first, params.sort_by), first.id))
+
+    metadata = MetadataSchema(
+        current_page=None if cursor is not None else params.page,
+        page_size=params.page_size,
+        total_items=total,
+        total_strategy=strategy.value,
+        next_cursor=next_cursor,
+        prev_cursor=prev_cursor
+    )
+    return PageType.get().create('200', 'Success', rows, metadata)
+
 
 def paginate(model, query: Query, params: Optional[PaginationParams]) -> BasePage:
-    code = '200'
-    message = 'Success'
+    """
+    Paginate query by page/offset, or by keyset when params.cursor is given.
+    Both modes return next_cursor/prev_cursor so that clients can switch to seeking at any page.
+    total_items comes from params.count_strategy, see CountStrategy.
+    query may select model or some of its columns, the page data are then Row tuples.
+    """
+    cursor = _sort_params(model, params)
+    strategy = _count_strategy(params, cursor)
 
     try:
-        total = query.count()
+        page_query = _order_query(model, _with_sort_keys(model, query, params), params, cursor)
+        if cursor is None:
+            page_query = page_query.offset(params.page_size * (params.page-1))
 
-        if params.order:
-            direction = desc if params.order == 'desc' else asc
-            query = query.order_by(direction(getattr(model, params.sort_by)))
+        if strategy is CountStrategy.WINDOW:
+            rows = page_query.add_columns(func.count().over()).limit(params.page_size + 1).all()
+            data, total = _unwrap_rows(model, rows), rows[0][-1] if rows else 0
+            if not rows and params.page > 1:
+                total, strategy = count_total(model, query.session, query.statement, CountStrategy.EXACT)
+        else:
+            total, strategy = count_total(model, query.session, query.statement, strategy)
+            data = page_query.limit(params.page_size + 1).all()
 
-        data = query.limit(params.page_size).offset(params.page_size * (params.page-1)).all()
+        page = _build_page(data, total, strategy, params, cursor)
 
-        metadata = MetadataSchema(
-            current_page=params.page,
-            page_size=params.page_size,
-            total_items=total
-        )
+    except Exception as e:
+        raise CustomException(http_code=500, code='500', message=str(e))
+
+    return page
+
+
+async def paginate_async(model, session: AsyncSession, statement: Select,
+                         params: Optional[PaginationParams]) -> BasePage:
+    """
+    asyncio counterpart of paginate(), working on a 2.0 style select() statement
+    """
+    cursor = _sort_params(model, params)
+    strategy = _count_strategy(params, cursor)
+
+    try:
+        page_statement = _order_query(model, _with_sort_keys(model, statement, params), params, cursor)
+        if cursor is None:
+            page_statement = page_statement.offset(params.page_size * (params.page-1))
+
+        if strategy is CountStrategy.WINDOW:
+            result = await session.execute(
+                page_statement.add_columns(func.count().over()).limit(params.page_size + 1))
+            rows = result.all()
+            data, total = _unwrap_rows(model, rows), rows[0][-1] if rows else 0
+            if not rows and params.page > 1:
+                total, strategy = await session.run_sync(
+                    lambda sync_session: count_total(model, sync_session, statement, CountStrategy.EXACT))
+        else:
+            total, strategy = await session.run_sync(
+                lambda sync_session: count_total(model, sync_session, statement, strategy))
+            result = await session.execute(page_statement.limit(params.page_size + 1))
+            data = _unwrap_rows(model, result.all())
+
+        page = _build_page(data, total, strategy, params, cursor)
 
     except Exception as e:
         raise CustomException(http_code=500, code='500', message=str(e))
 
-    return PageType.get().create(code, message, data, metadata)
+    return page
@@ -0,0 +1,103 @@
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Hashable, NamedTuple
+
+from fastapi import HTTPException, Request
+
+from app.core.config import settings
+
+
+class Limit(NamedTuple):
+    rate: float  # Tokens added per second
+    burst: int  # Size of the bucket: requests allowed at once after an idle period
+
+
+class RateLimitBackend(ABC):
+    """
+    Storage of the token buckets. MemoryBackend keeps them in the worker process; a shared backend
+    (e.g. a Redis script doing the same arithmetic) would make the limits global to all the workers.
+    """
+
+    @abstractmethod
+    async def consume(self, key: Hashable, limit: Limit) -> float:
+        """
+        Take one token from the bucket of key. Return 0 when there was one, else the seconds until there is.
+        """
+
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens: float, updated: float) -> None:
+        self.tokens = tokens
+        self.updated = updated
+
+
+class MemoryBackend(RateLimitBackend):
+    """
+    Buckets of the maxsize most recently seen keys, the least recently seen one is dropped beyond that (it starts
+    again with a full bucket). Only used from the event loop, consume() never awaits so it needs no lock.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._buckets: OrderedDict = OrderedDict()
+
+    async def consume(self, key: Hashable, limit: Limit) -> float:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(limit.burst, now)
+            if len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(limit.burst, bucket.tokens + (now - bucket.updated) * limit.rate)
+            bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        return (1 - bucket.tokens) / limit.rate
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class RateLimiter(object):
+    """
+    Token buckets throttling the unauthenticated endpoints that hash a password (login, register) per client IP
+    and per target email, so that a credential stuffing burst can't take every CPU from the other requests
+    """
+
+    def __init__(self, backend: RateLimitBackend) -> None:
+        self.backend = backend
+        self.rejected = 0
+
+    def configure(self, backend: RateLimitBackend) -> None:
+        self.backend = backend
+
+    async def check(self, request: Request, email: str) -> None:
+        """
+        Call it first in the endpoint, before any DB query or hashing.
+        Raise 429 Too Many Requests with Retry-After when the IP or the email has no token left.
+        """
+        if not settings.RATE_LIMIT_ENABLED:
+            return
+        client_ip = request.client.host if request.client else None
+        wait = await self.backend.consume(
+            f'ip:{client_ip}', Limit(settings.RATE_LIMIT_IP_RATE, settings.RATE_LIMIT_IP_BURST))
+        if not wait:
+            wait = await self.backend.consume(
+                f'email:{email.lower()}', Limit(settings.RATE_LIMIT_EMAIL_RATE, settings.RATE_LIMIT_EMAIL_BURST))
+        if wait:
+            self.rejected += 1
+            raise HTTPException(status_code=429, detail='Too many requests, please try again later',
+                                headers={'Retry-After': str(math.ceil(wait))})
+
+
+rate_limiter = RateLimiter(MemoryBackend(settings.RATE_LIMIT_MAX_KEYS))
@@ -0,0 +1,159 @@
+import time
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestTimings:
+    """
+    What one request spent its time on: SQL statements (count, total time, slowest)
+    and named phases such as auth and serialize
+    """
+    __slots__ = ('scope', 'statements', 'db_time', 'slowest_time', 'slowest_statement', 'statement_counts', 'phases')
+
+    def __init__(self, scope: Optional[Scope] = None) -> None:
+        self.scope = scope
+        self.statements = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement: Optional[str] = None
+        self.statement_counts: Counter = Counter()
+        self.phases: Dict[str, float] = {}
+
+    @property
+    def route(self) -> str:
+        stats = self.scope.get('route_stats') if self.scope else None
+        return f'{stats.method} {stats.route}' if stats else '-'
+
+    def add_statement(self, statement: str, elapsed: float) -> None:
+        self.statements += 1
+        self.db_time += elapsed
+        self.statement_counts[statement] += 1
+        if elapsed > self.slowest_time:
+            self.slowest_time, self.slowest_statement = elapsed, statement
+
+    def add_phase(self, name: str, elapsed: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def server_timing(self) -> str:
+        entries = [f'db;dur={self.db_time * 1000:.1f};desc="{self.statements} queries"']
+        entries += [f'{name};dur={elapsed * 1000:.1f}' for name, elapsed in self.phases.items()]
+        return ', '.join(entries)
+
+
+_request_timings: ContextVar[Optional[RequestTimings]] = ContextVar('_request_timings', default=None)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _request_timings.get()
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """
+    Add the time spent in the block to the current request's Server-Timing entry `name`
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.add_phase(name, time.perf_counter() - start)
+
+
+@contextmanager
+def collect_timings() -> Iterator[RequestTimings]:
+    """
+    Collect timings outside of a request, e.g. in a script or a test
+    """
+    timings = RequestTimings()
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+def query_budget(max_statements: int) -> Callable:
+    """
+    Declare how many SQL statements an endpoint may issue. Going over is logged,
+    or fails the request when SQL_QUERY_BUDGET_STRICT is on (as in the test suite).
+    """
+    def decorator(endpoint: Callable) -> Callable:
+        endpoint.query_budget = max_statements
+        return endpoint
+    return decorator
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add_statement(statement, elapsed)
+    if elapsed * 1000 >= settings.SQL_SLOW_QUERY_MS:
+        logger.warning('Slow SQL (%.1f ms) on %s: %s', elapsed * 1000,
+                       timings.route if timings is not None else '-', statement)
+
+
+class ServerTimingMiddleware:
+    """
+    Collect per-request SQL and phase timings, send them in a Server-Timing header,
+    warn about statements repeated SQL_N_PLUS_ONE_THRESHOLD times (N+1 pattern) and
+    check the endpoint's query_budget
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings(scope)
+        token = _request_timings.set(timings)
+
+        async def send_wrapper(message: Message) -> None:
+            if message['type'] == 'http.response.start':
+                self.check(scope, timings)
+                message.setdefault('headers', []).append((b'server-timing', timings.server_timing().encode()))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_timings.reset(token)
+
+    @staticmethod
+    def check(scope: Scope, timings: RequestTimings) -> None:
+        for statement, count in timings.statement_counts.items():
+            if count >= settings.SQL_N_PLUS_ONE_THRESHOLD:
+                logger.warning('Possible N+1 on %s: %d x %s', timings.route, count, statement)
+
+        budget = getattr(scope.get('endpoint'), 'query_budget', None)
+        if budget is not None and timings.statements > budget:
+            message = f'{timings.route} issued {timings.statements} SQL statements, budget is {budget}'
+            if settings.SQL_QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
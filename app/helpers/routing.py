@@ -0,0 +1,31 @@
+from typing import Dict, Optional, Type
+from weakref import WeakKeyDictionary
+
+import fastapi
+import fastapi.routing
+from fastapi.utils import create_cloned_field
+from pydantic import BaseModel
+from pydantic.fields import ModelField
+
+# Response models already cloned, shared by every route of the process
+_cloned_types: Dict[Type[BaseModel], Type[BaseModel]] = WeakKeyDictionary()  # type: ignore
+
+
+def create_cloned_field_cached(
+    field: ModelField, *, cloned_types: Optional[Dict[Type[BaseModel], Type[BaseModel]]] = None
+) -> ModelField:
+    """
+    FastAPI (< 0.95) deep clones the response_model of every route with a new cache each time, and again on each
+    include_router, which is most of the import time of the API modules. Clone each model once instead,
+    like newer FastAPI versions do.
+    """
+    return create_cloned_field(field, cloned_types=_cloned_types if cloned_types is None else cloned_types)
+
+
+def install() -> None:
+    """
+    Must run before the routes are declared, see get_application() in app/main.py.
+    No-op from FastAPI 0.95, which keeps its own cache of cloned response models.
+    """
+    if tuple(int(part) for part in fastapi.__version__.split('.')[:2]) < (0, 95):
+        fastapi.routing.create_cloned_field = create_cloned_field_cached
@@ -1,24 +1,51 @@
-import logging
+import logging.config
 
-import uvicorn
 from fastapi import FastAPI
-from fastapi_sqlalchemy import DBSessionMiddleware
 from starlette.middleware.cors import CORSMiddleware
 
-from app.api.api_router import router
 from app.models import Base
-from app.db.base import engine
+from app.db.base import engine, async_engine
+from app.db.replicas import replicas
+from app.db.session import DBSessionMiddleware
 from app.core.config import settings
+from app.core.security import start_hash_executor, shutdown_hash_executor
+from app.helpers import routing
 from app.helpers.exception_handler import CustomException, http_exception_handler
+from app.helpers.metrics import MetricsMiddleware, instrument_routes
+from app.helpers.request_timing import ServerTimingMiddleware
+from app.helpers.responses import FastJSONResponse
+from app.services.srv_last_login import last_login_writer
 
-logging.config.fileConfig(settings.LOGGING_CONFIG_FILE, disable_existing_loggers=False)
-Base.metadata.create_all(bind=engine)
+
+def configure_logging():
+    logging.config.fileConfig(settings.LOGGING_CONFIG_FILE, disable_existing_loggers=False)
+
+
+def create_schema():
+    """
+    Alembic owns the schema, create_all is only run when DB_CREATE_ALL is set (local dev, demo)
+    """
+    if settings.DB_CREATE_ALL:
+        Base.metadata.create_all(bind=engine)
+
+
+def stop_replicas():
+    replicas.stop_monitor()
+    replicas.dispose()
+
+
+async def dispose_async_engine():
+    if async_engine is not None:
+        await async_engine.dispose()
 
 
 def get_application() -> FastAPI:
+    routing.install()
+    from app.api.api_router import router  # Declares the routes, after routing.install()
+
     application = FastAPI(
         title=settings.PROJECT_NAME, docs_url="/docs", redoc_url='/re-docs',
-        openapi_url=f"{settings.API_PREFIX}/openapi.json",
+        openapi_url=f"{settings.API_PREFIX}/openapi.json", default_response_class=FastJSONResponse,
         description='''
         Base frame with FastAPI micro framework + Postgresql
             - Login/Register with JWT
@@ -35,13 +62,27 @@ def get_application() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
-    application.add_middleware(DBSessionMiddleware, db_url=settings.DATABASE_URL)
+    application.add_middleware(DBSessionMiddleware)
+    application.add_middleware(ServerTimingMiddleware)
     application.include_router(router, prefix=settings.API_PREFIX)
+    instrument_routes(application.routes)
+    application.add_middleware(MetricsMiddleware)
     application.add_exception_handler(CustomException, http_exception_handler)
+    application.add_event_handler('startup', configure_logging)
+    application.add_event_handler('startup', create_schema)
+    application.add_event_handler('startup', start_hash_executor)
+    application.add_event_handler('startup', replicas.start_monitor)
+    application.add_event_handler('startup', last_login_writer.start)
+    application.add_event_handler('shutdown', last_login_writer.stop)
+    application.add_event_handler('shutdown', shutdown_hash_executor)
+    application.add_event_handler('shutdown', stop_replicas)
+    application.add_event_handler('shutdown', dispose_async_engine)
 
     return application
 
 
 app = get_application()
 if __name__ == '__main__':
+    import uvicorn
+
     uvicorn.run(app, host="0.0.0.0", port=8000)
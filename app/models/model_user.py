@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean, DateTime
+from sqlalchemy import Column, String, Boolean, DateTime, DDL, Index, event, func
 
 from app.models.model_base import BareBaseModel
 
@@ -7,6 +7,21 @@ class User(BareBaseModel):
     full_name = Column(String, index=True)
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String(255))
-    is_active = Column(Boolean, default=True)
-    role = Column(String, default='guest')
-    last_login = Column(DateTime)
+    is_active = Column(Boolean, default=True, index=True)
+    role = Column(String, default='guest', index=True)
+    last_login = Column(DateTime, index=True)
+
+    __table_args__ = (
+        Index('ix_user_created_at', 'created_at'),
+        Index('ix_user_updated_at', 'updated_at'),  # max(updated_at) probe of the list ETags
+        # lower(column) LIKE '%...%' of the q= search, see alembic revision 3b8c1d2e4f5a
+        Index('ix_user_full_name_trgm', func.lower(full_name).label('lower_full_name'), postgresql_using='gin',
+              postgresql_ops={'lower_full_name': 'gin_trgm_ops'}),
+        Index('ix_user_email_trgm', func.lower(email).label('lower_email'), postgresql_using='gin',
+              postgresql_ops={'lower_email': 'gin_trgm_ops'}),
+    )
+
+
+# The trigram indexes need the pg_trgm extension (contrib), create_all (tests, dev) installs it first
+event.listen(User.__table__, 'before_create',
+             DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
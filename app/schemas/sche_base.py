@@ -43,6 +43,9 @@ class DataResponse(ResponseSchemaBase, GenericModel, Generic[T]):
 
 
 class MetadataSchema(BaseModel):
-    current_page: int
+    current_page: Optional[int]
     page_size: int
-    total_items: int
+    total_items: Optional[int]
+    total_strategy: Optional[str] = None  # CountStrategy that produced total_items
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
@@ -0,0 +1,24 @@
+from typing import Dict
+
+from pydantic import BaseModel
+
+
+class DBSessionStats(BaseModel):
+    requests: int
+    requests_with_session: int
+
+
+class HistogramSchema(BaseModel):
+    buckets: Dict[str, int]  # Cumulative count per upper bound (seconds)
+    sum: float
+    count: int
+
+
+class DBPoolStats(BaseModel):
+    pool_size: int
+    max_overflow: int
+    checked_out: int
+    idle: int
+    overflow_in_use: int
+    timeouts: int
+    checkout_wait: HistogramSchema
@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, constr
 
 from app.helpers.enums import UserRole
 
@@ -24,6 +24,37 @@ class UserItemResponse(UserBase):
     last_login: Optional[datetime]
 
 
+class UserSnapshot(BaseModel):
+    """
+    Immutable copy of the authenticated user, cached between requests by UserService.get_current_user
+    """
+    id: int
+    full_name: Optional[str]
+    email: Optional[str]
+    is_active: Optional[bool]
+    role: Optional[str]
+    last_login: Optional[datetime]
+    updated_at: Optional[datetime]  # Version of the snapshot, see app.helpers.etag
+
+    class Config:
+        orm_mode = True
+        frozen = True
+
+
+class UserFilterParams(BaseModel):
+    """
+    Filters of GET /users and GET /users/export. Ranges include *_from and exclude *_to.
+    q searches full_name and email (case insensitive substring, 3 characters at least for the trigram indexes).
+    """
+    role: Optional[UserRole] = None
+    is_active: Optional[bool] = None
+    created_at_from: Optional[datetime] = None
+    created_at_to: Optional[datetime] = None
+    last_login_from: Optional[datetime] = None
+    last_login_to: Optional[datetime] = None
+    q: Optional[constr(strip_whitespace=True, min_length=3, max_length=100)] = None
+
+
 class UserCreateRequest(UserBase):
     full_name: Optional[str]
     password: str
@@ -51,3 +82,30 @@ class UserUpdateRequest(BaseModel):
     password: Optional[str]
     is_active: Optional[bool] = True
     role: Optional[UserRole]
+
+
+class UserBatchUpdateRequest(UserUpdateRequest):
+    id: int
+
+
+class UserBatchUpdateError(BaseModel):
+    id: int
+    message: str
+
+
+class UserBatchUpdateResult(BaseModel):
+    updated_ids: List[int]
+    missing_ids: List[int]
+    errors: List[UserBatchUpdateError]
+
+
+class UserImportError(BaseModel):
+    row: int  # 1-based data row (line after the CSV header, line of the NDJSON file)
+    email: Optional[str]
+    message: str
+
+
+class UserImportResult(BaseModel):
+    total_rows: int
+    imported: int
+    errors: List[UserImportError]
@@ -0,0 +1,210 @@
+"""
+Production entrypoint: a pre-fork server running uvicorn workers on one shared listening socket.
+
+    $ python -m app.server
+
+The master imports the application once, binds SERVER_HOST:SERVER_PORT and forks SERVER_WORKERS workers
+(default: one per CPU available to the container). A worker only accepts connections once its startup handlers
+and warm up are done, and a worker that dies is replaced. On SIGTERM/SIGINT the workers stop accepting, finish
+their in-flight requests and run their shutdown handlers; the ones still busy after SERVER_GRACEFUL_TIMEOUT
+are killed.
+
+uvicorn picks uvloop and httptools when they are installed (see requirements.txt), asyncio and h11 otherwise.
+"""
+import importlib.util
+import logging
+import math
+import os
+import signal
+import socket
+import time
+from typing import Dict, Optional
+
+import uvicorn
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.core.config import settings
+from app.db.base import engine, async_engine
+from app.db.replicas import replicas
+from app.main import app, configure_logging
+
+logger = logging.getLogger('app.server')
+
+
+def available_cpus() -> int:
+    """
+    CPUs this process may run on, bounded by the cgroup (v2) CPU quota of its container
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS
+        cpus = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as file:
+            quota, period = file.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(math.ceil(int(quota) / int(period)), 1))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def worker_count() -> int:
+    return settings.SERVER_WORKERS if settings.SERVER_WORKERS > 0 else available_cpus()
+
+
+def bind_socket() -> socket.socket:
+    # proto=IPPROTO_TCP: asyncio only sets TCP_NODELAY on the accepted connections of such sockets,
+    # without it the responses are delayed by Nagle's algorithm (~40ms per keep-alive request)
+    sock = socket.socket(socket.AF_INET6 if ':' in settings.SERVER_HOST else socket.AF_INET, socket.SOCK_STREAM,
+                         socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((settings.SERVER_HOST, settings.SERVER_PORT))
+    sock.listen(settings.SERVER_BACKLOG)
+    return sock
+
+
+def reset_after_fork() -> None:
+    """
+    A pooled connection used by two processes corrupts both sessions: drop the pools inherited from the master
+    without closing its sockets (close=False), the worker opens its own connections.
+    """
+    engine.dispose(close=False)
+    replicas.dispose(close=False)
+    if async_engine is not None:
+        async_engine.sync_engine.dispose(close=False)
+
+
+def fill_pool() -> None:
+    connections = []
+    try:
+        for _ in range(settings.DB_POOL_SIZE):
+            connections.append(engine.connect())
+    except SQLAlchemyError as e:
+        logger.warning('Worker %d could not warm up its connection pool: %s', os.getpid(), e)
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+async def warm_up() -> None:
+    """
+    Last startup handler of a worker: open the pool's connections and serve one request, so that the first
+    clients don't pay for the connects and the lazy initializations
+    """
+    await run_in_threadpool(fill_pool)
+
+    path = f'{settings.API_PREFIX}/healthcheck'
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '', 'headers': [],
+        'client': ('127.0.0.1', 0), 'server': ('warm-up', 0),
+    }
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+def worker_config() -> uvicorn.Config:
+    """
+    uvicorn settings of a worker. With SERVER_PROXY_HEADERS, request.client is the client IP from X-Forwarded-For
+    when the connection comes from one of SERVER_FORWARDED_ALLOW_IPS.
+    """
+    return uvicorn.Config(app, loop='auto', http='auto', lifespan='on', backlog=settings.SERVER_BACKLOG,
+                          access_log=settings.SERVER_ACCESS_LOG, proxy_headers=settings.SERVER_PROXY_HEADERS,
+                          forwarded_allow_ips=settings.SERVER_FORWARDED_ALLOW_IPS)
+
+
+def run_worker(sock: socket.socket, workers: int) -> None:
+    for signum in (signal.SIGTERM, signal.SIGINT):  # uvicorn installs its own once the loop runs
+        signal.signal(signum, signal.SIG_DFL)
+    reset_after_fork()
+    if 'PASSWORD_HASH_WORKERS' not in os.environ:
+        # Share the CPUs between the bcrypt pools of the workers rather than starting a full pool in each
+        settings.PASSWORD_HASH_WORKERS = max(available_cpus() // workers, 1)
+    app.add_event_handler('startup', warm_up)
+    uvicorn.Server(worker_config()).run(sockets=[sock])
+
+
+class PreforkServer(object):
+    """
+    Master process: forks the workers, replaces the ones that die and drains them on shutdown
+    """
+
+    def __init__(self, workers: int):
+        self.worker_count = workers
+        self.workers: Dict[int, float] = {}  # pid: start time
+        self.sock: Optional[socket.socket] = None
+        self.stopping_since: Optional[float] = None
+        self.killed = False
+
+    def spawn(self) -> None:
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.sock, self.worker_count)
+            except BaseException:
+                logger.exception('Worker %d failed', os.getpid())
+                code = 1
+            finally:
+                os._exit(code)  # Never return into the master's loop
+        self.workers[pid] = time.monotonic()
+
+    def signal_workers(self, signum: int) -> None:
+        for pid in self.workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def stop(self, signum, frame) -> None:
+        if self.stopping_since is None:
+            logger.info('Received %s, draining %d workers', signal.Signals(signum).name, len(self.workers))
+            self.stopping_since = time.monotonic()
+            self.signal_workers(signal.SIGTERM)
+
+    def run(self) -> None:
+        self.sock = bind_socket()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.worker_count):
+            self.spawn()
+
+        while self.workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                if self.stopping_since is not None and not self.killed \
+                        and time.monotonic() - self.stopping_since > settings.SERVER_GRACEFUL_TIMEOUT:
+                    logger.warning('Killing %d workers still busy after %ss', len(self.workers),
+                                   settings.SERVER_GRACEFUL_TIMEOUT)
+                    self.signal_workers(signal.SIGKILL)
+                    self.killed = True
+                time.sleep(0.1)
+                continue
+            started = self.workers.pop(pid)
+            if self.stopping_since is None:
+                logger.error('Worker %d exited (status %d), starting a new one', pid, status)
+                if time.monotonic() - started < 1:
+                    time.sleep(1)  # Don't spin on a worker failing at startup
+                self.spawn()
+        self.sock.close()
+
+
+def run() -> None:
+    configure_logging()
+    workers = worker_count()
+    logger.info('Serving on %s:%d with %d workers (loop: %s, http: %s)', settings.SERVER_HOST,
+                settings.SERVER_PORT, workers, 'uvloop' if importlib.util.find_spec('uvloop') else 'asyncio',
+                'httptools' if importlib.util.find_spec('httptools') else 'h11')
+    PreforkServer(workers).run()
+
+
+if __name__ == '__main__':
+    run()
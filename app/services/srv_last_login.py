@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import DateTime, Integer, column, update, values
+
+from app.core.config import settings
+from app.db.session import db
+from app.helpers.metrics import Histogram
+from app.models import User
+from app.services.srv_user import user_cache
+
+logger = logging.getLogger(__name__)
+
+FLUSH_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class LastLoginWriter(object):
+    """
+    Write-behind of user.last_login: a login only records (user id, time) in memory, and a background thread
+    writes what piled up every LAST_LOGIN_FLUSH_INTERVAL seconds (or once LAST_LOGIN_FLUSH_SIZE users are
+    pending) with UPDATE user SET last_login = ... FROM (VALUES (id, last_login), ...), one row per user
+    however many times it logged in meanwhile. The queue is flushed on shutdown; a worker that is killed
+    loses up to one interval of last_login updates.
+    """
+
+    def __init__(self) -> None:
+        self.pending: Dict[int, datetime] = {}
+        self.flushed = 0  # Users written
+        self.failures = 0
+        self.flush_latency = Histogram(FLUSH_LATENCY_BUCKETS)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+    def _merge(self, user_id: int, last_login: datetime) -> None:
+        # Caller holds _lock. The newest login of a user wins, whatever the order they are queued in.
+        if self.pending.get(user_id, last_login) <= last_login:
+            self.pending[user_id] = last_login
+
+    def push(self, user_id: int, last_login: datetime) -> None:
+        with self._lock:
+            self._merge(user_id, last_login)
+            depth = len(self.pending)
+        if depth >= settings.LAST_LOGIN_FLUSH_SIZE:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """
+        Write the pending last_login values, return how many users were updated.
+        On any failure they are queued again, unless a newer login of the same user came in meanwhile.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self.pending = self.pending, {}
+            if not batch:
+                return 0
+            start = time.perf_counter()
+            rows = list(batch.items())
+            try:
+                with db(commit_on_exit=True):
+                    for offset in range(0, len(rows), settings.BATCH_UPDATE_CHUNK_SIZE):
+                        changed = values(column('id', Integer), column('last_login', DateTime), name='logins') \
+                            .data(rows[offset:offset + settings.BATCH_UPDATE_CHUNK_SIZE])
+                        db.session.execute(
+                            update(User).where(User.id == changed.c.id).values(last_login=changed.c.last_login)
+                            .execution_options(synchronize_session=False))
+            except Exception:
+                self.failures += 1
+                logger.exception('Could not write the last_login of %d users', len(batch))
+                with self._lock:
+                    for user_id, last_login in batch.items():
+                        self._merge(user_id, last_login)
+                return 0
+            finally:
+                self.flush_latency.observe(time.perf_counter() - start)
+            for user_id in batch:
+                user_cache.pop(user_id)
+            self.flushed += len(batch)
+            return len(batch)
+
+    def _run(self) -> None:
+        while not self._stopping:
+            self._wake.wait(settings.LAST_LOGIN_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:  # Keep the thread alive, the batch has been queued again by flush() if need be
+                logger.exception('last_login writer: flush failed')
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='last-login-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the thread, then write what is still pending
+        """
+        if self._thread is not None:
+            self._stopping = True
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+
+last_login_writer = LastLoginWriter()
@@ -1,17 +1,72 @@
+import re
 import jwt
 
-from typing import Optional
+from typing import Dict, Iterator, List, Optional, Tuple
+from datetime import datetime
 from fastapi import Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer
-from fastapi_sqlalchemy import db
-from pydantic import ValidationError
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import Integer, column, func, or_, select, update, values
+from sqlalchemy.dialects.postgresql import Insert, insert as pg_insert
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import Executable
+from sqlalchemy.orm import sessionmaker
 from starlette import status
 
 from app.models import User
 from app.core.config import settings
-from app.core.security import verify_password, get_password_hash
+from app.core.security import verify_password_async, get_password_hash
+from app.db.session import db
+from app.helpers.cache import TTLCache
+from app.helpers.etag import is_precondition_met, resource_version
+from app.helpers.exception_handler import CustomException
+from app.helpers.request_timing import timed
 from app.schemas.sche_token import TokenPayload
-from app.schemas.sche_user import UserCreateRequest, UserUpdateMeRequest, UserUpdateRequest, UserRegisterRequest
+from app.schemas.sche_user import UserCreateRequest, UserUpdateMeRequest, UserUpdateRequest, UserRegisterRequest, \
+    UserItemResponse, UserSnapshot, UserBatchUpdateRequest, UserBatchUpdateResult, UserBatchUpdateError, \
+    UserFilterParams
+
+UPDATE_FIELDS = {'full_name', 'email', 'is_active', 'role'}  # Columns of the partial updates, password is passed hashed
+
+user_cache = TTLCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL)
+
+
+# Returned by the single statement writes: the UserItemResponse fields and the version of the ETag
+USER_COLUMNS = tuple(User.__table__.c[name] for name in (*UserItemResponse.__fields__, 'updated_at'))
+
+
+def insert_user(values: dict) -> Insert:
+    """
+    INSERT ... ON CONFLICT (email) DO NOTHING RETURNING: a single statement creates the user, or returns no row
+    when the email is taken, also by a concurrent request (no check-then-insert race on the unique index)
+    """
+    return pg_insert(User).values(**values).on_conflict_do_nothing(index_elements=[User.email]) \
+        .returning(*USER_COLUMNS)
+
+
+def update_values(data: BaseModel, hashed_password: Optional[str]) -> dict:
+    """
+    SET clause of a partial update: only the fields set in data (None = unchanged), password given hashed
+    """
+    changes = data.dict(include=UPDATE_FIELDS, exclude_none=True)
+    if 'role' in changes:
+        changes['role'] = changes['role'].value
+    if hashed_password is not None:
+        changes['hashed_password'] = hashed_password
+    return changes
+
+
+def update_user(user_id: int, changes: dict) -> Executable:
+    """
+    UPDATE user SET <changes> WHERE id = :id RETURNING <USER_COLUMNS>: one statement, no User loaded nor reloaded.
+    Without changes, a SELECT of the same columns.
+    """
+    if not changes:
+        return select(*USER_COLUMNS).where(User.id == user_id)
+    return update(User).where(User.id == user_id).values(changes).returning(*USER_COLUMNS) \
+        .execution_options(synchronize_session=False)
 
 
 class UserService(object):
@@ -25,22 +80,35 @@ class UserService(object):
     )
 
     @staticmethod
-    def authenticate(*, email: str, password: str) -> Optional[User]:
+    def get_by_email(email: str) -> Optional[User]:
+        """
+        Load a user by email, then close the session so that its connection goes back to the pool.
+        The returned User is detached, add it back to db.session before changing it.
+        """
+        user = db.session.query(User).filter_by(email=email).first()
+        db.session.close()
+        return user
+
+    @staticmethod
+    async def authenticate(*, email: str, password: str) -> Optional[User]:
         """
         Check username and password is correct.
         Return object User if correct, else return None
+        bcrypt runs in the hashing process pool, after the DB connection has been released.
         """
-        user = db.session.query(User).filter_by(email=email).first()
+        user = await run_in_threadpool(UserService.get_by_email, email)
         if not user:
             return None
-        if not verify_password(password, user.hashed_password):
-            return None
+        with timed('auth'):
+            if not await verify_password_async(password, user.hashed_password):
+                return None
         return user
 
     @staticmethod
-    def get_current_user(http_authorization_credentials=Depends(reusable_oauth2)) -> User:
+    def get_current_user(http_authorization_credentials=Depends(reusable_oauth2)) -> UserSnapshot:
         """
-        Decode JWT token to get user_id => return User info from DB query
+        Decode JWT token to get user_id => return User info from user_cache, or DB query on a miss.
+        The snapshot is read-only, use UserService.get(snapshot.id) when a live User is needed.
         """
         try:
             payload = jwt.decode(
@@ -53,74 +121,248 @@ class UserService(object):
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=f"Could not validate credentials",
             )
-        user = db.session.query(User).get(token_data.user_id)
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        return user
+        snapshot = user_cache.get(token_data.user_id)
+        if snapshot is None:
+            user = db.session.query(User).get(token_data.user_id)
+            if not user:
+                raise HTTPException(status_code=404, detail="User not found")
+            snapshot = UserSnapshot.from_orm(user)
+            user_cache.set(user.id, snapshot)
+        return snapshot
 
     @staticmethod
-    def register_user(data: UserRegisterRequest):
-        exist_user = db.session.query(User).filter(User.email == data.email).first()
-        if exist_user:
+    def _create(values: dict) -> Row:
+        new_user = db.session.execute(insert_user(values)).first()
+        if new_user is None:
+            db.session.rollback()
             raise Exception('Email already exists')
-        register_user = User(
+        db.session.commit()
+        user_cache.pop(new_user.id)
+        return new_user
+
+    @staticmethod
+    def register_user(data: UserRegisterRequest, hashed_password: Optional[str] = None) -> Row:
+        """
+        Create the user with one statement, see insert_user. Return a Row of the UserItemResponse fields.
+        """
+        return UserService._create(dict(
             full_name=data.full_name,
             email=data.email,
-            hashed_password=get_password_hash(data.password),
+            hashed_password=hashed_password or get_password_hash(data.password),
             is_active=True,
             role=data.role.value,
-        )
-        db.session.add(register_user)
-        db.session.commit()
-        return register_user
+        ))
 
     @staticmethod
-    def create_user(data: UserCreateRequest):
-        exist_user = db.session.query(User).filter(User.email == data.email).first()
-        if exist_user:
-            raise Exception('Email already exists')
-        new_user = User(
+    def create_user(data: UserCreateRequest, hashed_password: Optional[str] = None) -> Row:
+        """
+        Create the user with one statement, see insert_user. Return a Row of the UserItemResponse fields.
+        """
+        return UserService._create(dict(
             full_name=data.full_name,
             email=data.email,
-            hashed_password=get_password_hash(data.password),
+            hashed_password=hashed_password or get_password_hash(data.password),
             is_active=data.is_active,
             role=data.role.value,
-        )
-        db.session.add(new_user)
-        db.session.commit()
-        return new_user
+        ))
 
     @staticmethod
-    def update_me(data: UserUpdateMeRequest, current_user: User):
-        if data.email is not None:
-            exist_user = db.session.query(User).filter(
-                User.email == data.email, User.id != current_user.id).first()
-            if exist_user:
+    def _update(user_id: int, changes: dict) -> Row:
+        """
+        Write changes with update_user and return the RETURNING row: 'User not exists' when no row matched,
+        'Email already exists' when the unique index rejects the new email
+        """
+        try:
+            user = db.session.execute(update_user(user_id, changes)).first()
+        except IntegrityError:
+            db.session.rollback()
+            if 'email' in changes:
                 raise Exception('Email already exists')
-        current_user.full_name = current_user.full_name if data.full_name is None else data.full_name
-        current_user.email = current_user.email if data.email is None else data.email
-        current_user.hashed_password = current_user.hashed_password if data.password is None else get_password_hash(
-            data.password)
-        db.session.commit()
-        return current_user
-
-    @staticmethod
-    def update(user_id: int, data: UserUpdateRequest):
-        user = db.session.query(User).get(user_id)
+            raise
         if user is None:
+            db.session.rollback()
             raise Exception('User not exists')
-        user.full_name = user.full_name if data.full_name is None else data.full_name
-        user.email = user.email if data.email is None else data.email
-        user.hashed_password = user.hashed_password if data.password is None else get_password_hash(
-            data.password)
-        user.is_active = user.is_active if data.is_active is None else data.is_active
-        user.role = user.role if data.role is None else data.role.value
         db.session.commit()
+        user_cache.pop(user_id)
         return user
 
     @staticmethod
-    def get(user_id):
-        exist_user = db.session.query(User).get(user_id)
+    def update_me(data: UserUpdateMeRequest, current_user: UserSnapshot, hashed_password: Optional[str] = None) -> Row:
+        if data.password is not None:
+            hashed_password = hashed_password or get_password_hash(data.password)
+        return UserService._update(current_user.id, update_values(data, hashed_password))
+
+    @staticmethod
+    def update(user_id: int, data: UserUpdateRequest, hashed_password: Optional[str] = None,
+               if_match: Optional[str] = None) -> Row:
+        """
+        if_match (If-Match header) makes the update conditional: the user's version is read and locked
+        (SELECT ... FOR UPDATE) first, and the user left unchanged with a 412 when it is not the one the client read
+        """
+        if if_match is not None:
+            updated_at = db.session.query(User.updated_at).filter(User.id == user_id).with_for_update().first()
+            if updated_at is None:
+                raise Exception('User not exists')
+            if not is_precondition_met(if_match, resource_version(user_id, updated_at[0])):
+                db.session.rollback()
+                raise CustomException(http_code=412, code='412',
+                                      message='User has been modified, reload it and retry')
+        if data.password is not None:
+            hashed_password = hashed_password or get_password_hash(data.password)
+        return UserService._update(user_id, update_values(data, hashed_password))
+
+    @staticmethod
+    def batch_update(items: List[UserBatchUpdateRequest],
+                     hashed_passwords: List[Optional[str]]) -> UserBatchUpdateResult:
+        """
+        Apply many partial updates in one transaction: only the fields set in an item change (None = unchanged,
+        like update()), later items for the same id override earlier ones. Users are grouped by the set of
+        columns they change and each group is written with
+        UPDATE user SET ... FROM (VALUES (id, ...), ...) AS changes WHERE user.id = changes.id RETURNING id,
+        BATCH_UPDATE_CHUNK_SIZE rows per statement. Unknown ids and emails still owned by another user once the
+        batch is applied are reported.
+        """
+        changes: Dict[int, dict] = {}
+        for item, hashed_password in zip(items, hashed_passwords):
+            fields = item.dict(include=UPDATE_FIELDS, exclude_unset=True, exclude_none=True)
+            if 'role' in fields:
+                fields['role'] = fields['role'].value
+            if hashed_password is not None:
+                fields['hashed_password'] = hashed_password
+            changes.setdefault(item.id, {}).update(fields)
+
+        emails = {user_id: fields['email'] for user_id, fields in changes.items() if 'email' in fields}
+        owners = {}
+        email_list = list(set(emails.values()))
+        for start in range(0, len(email_list), settings.BATCH_UPDATE_CHUNK_SIZE):
+            owners.update(db.session.query(User.email, User.id).filter(
+                User.email.in_(email_list[start:start + settings.BATCH_UPDATE_CHUNK_SIZE])))
+
+        # Checked against the state after the batch: the first item asking for an email wins it, an email owned
+        # by a user of the batch who is accepted to move to another one is free (swaps, free and reuse)
+        emails = {user_id: email for user_id, email in emails.items() if owners.get(email) != user_id}
+        winners, rejected_ids = {}, set()
+        for user_id, email in emails.items():
+            if winners.setdefault(email, user_id) != user_id:
+                rejected_ids.add(user_id)
+        rejected = True
+        while rejected:  # Rejecting a user keeps its email taken, which may reject the user wanting it
+            rejected = False
+            for email, user_id in list(winners.items()):
+                owner = owners.get(email)
+                if owner is not None and (owner not in emails or owner in rejected_ids):
+                    rejected_ids.add(user_id)
+                    del winners[email]
+                    rejected = True
+        errors = [UserBatchUpdateError(id=user_id, message='Email already exists')
+                  for user_id in emails if user_id in rejected_ids]
+        for user_id in rejected_ids:
+            del changes[user_id]
+
+        # Unique checks of Postgres are done per row, not at the end of the statement: release the emails that
+        # change hands first
+        vacated_ids = [owners[email] for email in winners if email in owners]
+        for start in range(0, len(vacated_ids), settings.BATCH_UPDATE_CHUNK_SIZE):
+            db.session.execute(
+                update(User).where(User.id.in_(vacated_ids[start:start + settings.BATCH_UPDATE_CHUNK_SIZE]))
+                .values(email=None).execution_options(synchronize_session=False))
+
+        groups: Dict[Tuple[str, ...], list] = {}
+        for user_id, fields in changes.items():
+            if fields:
+                names = tuple(sorted(fields))
+                groups.setdefault(names, []).append((user_id, *(fields[name] for name in names)))
+
+        updated_ids = set()
+        for names, rows in groups.items():
+            for start in range(0, len(rows), settings.BATCH_UPDATE_CHUNK_SIZE):
+                changed = values(
+                    column('id', Integer), *(column(name, User.__table__.c[name].type) for name in names),
+                    name='changes'
+                ).data(rows[start:start + settings.BATCH_UPDATE_CHUNK_SIZE])
+                statement = update(User).where(User.id == changed.c.id) \
+                    .values({name: changed.c[name] for name in names}).returning(User.id) \
+                    .execution_options(synchronize_session=False)
+                updated_ids.update(db.session.execute(statement).scalars())
+        db.session.commit()
+
+        for user_id in updated_ids:
+            user_cache.pop(user_id)
+        requested_ids = {user_id for user_id, fields in changes.items() if fields}
+        return UserBatchUpdateResult(
+            updated_ids=sorted(updated_ids),
+            missing_ids=sorted(requested_ids - updated_ids),
+            errors=errors
+        )
+
+    @staticmethod
+    def get(user_id, columns: Optional[list] = None):
+        """
+        Return the User, or only a Row of columns (no ORM object loaded) when given.
+        It is read from db.read_session (maybe a replica), never change it.
+        """
+        if columns:
+            exist_user = db.read_session.query(*columns).filter(User.id == user_id).first()
+        else:
+            exist_user = db.read_session.query(User).get(user_id)
         if exist_user is None:
             raise Exception('User not exists')
         return exist_user
+
+    @staticmethod
+    def get_version(user_id: int) -> Optional[str]:
+        """
+        Current version of a user (see app.helpers.etag) from a primary key probe, None if it does not exist
+        """
+        updated_at = db.read_session.query(User.updated_at).filter(User.id == user_id).first()
+        return None if updated_at is None else resource_version(user_id, updated_at[0])
+
+    @staticmethod
+    def list_state(clauses: list) -> Tuple[int, Optional[datetime]]:
+        """
+        count() and max(updated_at) of the users matching clauses, the version of a list (see page_version)
+        """
+        return tuple(db.read_session.query(func.count(User.id), func.max(User.updated_at)).filter(*clauses).one())
+
+    @staticmethod
+    def list_filters(filters: UserFilterParams) -> list:
+        """
+        WHERE clauses of filters, each backed by an index (see the User model and its migrations)
+        """
+        clauses = []
+        if filters.role is not None:
+            clauses.append(User.role == filters.role.value)
+        if filters.is_active is not None:
+            clauses.append(User.is_active == filters.is_active)
+        for column, start, end in (
+            (User.created_at, filters.created_at_from, filters.created_at_to),
+            (User.last_login, filters.last_login_from, filters.last_login_to),
+        ):
+            if start is not None:
+                clauses.append(column >= start)
+            if end is not None:
+                clauses.append(column < end)
+        if filters.q:
+            pattern = '%{}%'.format(re.sub(r'([\\%_])', r'\\\1', filters.q.lower()))
+            clauses.append(or_(
+                func.lower(User.full_name).like(pattern, escape='\\'),
+                func.lower(User.email).like(pattern, escape='\\'),
+            ))
+        return clauses
+
+    @staticmethod
+    def export_rows(columns: list, clauses: list, chunk_size: int,
+                    session_factory: Optional[sessionmaker] = None) -> Iterator[List[Row]]:
+        """
+        Stream the users matching clauses in id order, chunk_size rows at a time, from a server side cursor.
+        It runs on a session of its own: db.session is closed before a StreamingResponse body is sent,
+        and this one stays open (holding a pooled connection) until the last chunk has been consumed.
+        session_factory defaults to the primary's, pass db.read_session_factory to read from a replica.
+        """
+        session = (session_factory or db.session_factory)()
+        try:
+            statement = select(*columns).filter(*clauses).order_by(User.id).execution_options(
+                stream_results=True, max_row_buffer=chunk_size)
+            yield from session.execute(statement).partitions(chunk_size)
+        finally:
+            session.close()
@@ -0,0 +1,155 @@
+import jwt
+
+from datetime import datetime
+from typing import Optional, Tuple
+from fastapi import Depends, HTTPException
+from pydantic import ValidationError
+from sqlalchemy import func, select
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from app.models import User
+from app.core.config import settings
+from app.core.security import verify_password_async
+from app.db.base import get_async_db
+from app.helpers.etag import is_precondition_met, resource_version
+from app.helpers.exception_handler import CustomException
+from app.helpers.request_timing import timed
+from app.schemas.sche_token import TokenPayload
+from app.schemas.sche_user import UserCreateRequest, UserUpdateMeRequest, UserUpdateRequest, UserRegisterRequest, \
+    UserSnapshot
+from app.services.srv_user import insert_user, update_user, update_values, user_cache
+
+
+class AsyncUserService(object):
+    """
+    asyncio counterpart of UserService, working on an AsyncSession instead of the global db.session.
+    bcrypt runs in the hashing process pool so that it does not block the event loop: the routes hash the
+    passwords before calling it, outside of their try/except so that a saturated pool still answers 503.
+    """
+
+    def __init__(self, session: AsyncSession = Depends(get_async_db)) -> None:
+        self.session = session
+
+    async def _get_by_email(self, email: str) -> Optional[User]:
+        result = await self.session.execute(select(User).filter(User.email == email))
+        return result.scalars().first()
+
+    async def authenticate(self, *, email: str, password: str) -> Optional[User]:
+        """
+        Check username and password is correct.
+        Return object User if correct, else return None
+        """
+        user = await self._get_by_email(email)
+        await self.session.commit()  # Release the connection before hashing, expire_on_commit is off
+        if not user:
+            return None
+        with timed('auth'):
+            if not await verify_password_async(password, user.hashed_password):
+                return None
+        return user
+
+    async def get_current_user(self, http_authorization_credentials) -> UserSnapshot:
+        """
+        Decode JWT token to get user_id => return User info from user_cache, or DB query on a miss
+        """
+        try:
+            payload = jwt.decode(
+                http_authorization_credentials.credentials, settings.SECRET_KEY,
+                algorithms=[settings.SECURITY_ALGORITHM]
+            )
+            token_data = TokenPayload(**payload)
+        except (jwt.PyJWTError, ValidationError):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"Could not validate credentials",
+            )
+        snapshot = user_cache.get(token_data.user_id)
+        if snapshot is None:
+            user = await self.session.get(User, token_data.user_id)
+            if not user:
+                raise HTTPException(status_code=404, detail="User not found")
+            snapshot = UserSnapshot.from_orm(user)
+            user_cache.set(user.id, snapshot)
+        return snapshot
+
+    async def _create(self, values: dict) -> Row:
+        new_user = (await self.session.execute(insert_user(values))).first()
+        if new_user is None:
+            await self.session.rollback()
+            raise Exception('Email already exists')
+        await self.session.commit()
+        user_cache.pop(new_user.id)
+        return new_user
+
+    async def register_user(self, data: UserRegisterRequest, hashed_password: str) -> Row:
+        return await self._create(dict(
+            full_name=data.full_name,
+            email=data.email,
+            hashed_password=hashed_password,
+            is_active=True,
+            role=data.role.value,
+        ))
+
+    async def create_user(self, data: UserCreateRequest, hashed_password: str) -> Row:
+        return await self._create(dict(
+            full_name=data.full_name,
+            email=data.email,
+            hashed_password=hashed_password,
+            is_active=data.is_active,
+            role=data.role.value,
+        ))
+
+    async def _update(self, user_id: int, changes: dict) -> Row:
+        try:
+            user = (await self.session.execute(update_user(user_id, changes))).first()
+        except IntegrityError:
+            await self.session.rollback()
+            if 'email' in changes:
+                raise Exception('Email already exists')
+            raise
+        if user is None:
+            await self.session.rollback()
+            raise Exception('User not exists')
+        await self.session.commit()
+        user_cache.pop(user_id)
+        return user
+
+    async def update_me(self, data: UserUpdateMeRequest, current_user: UserSnapshot,
+                        hashed_password: Optional[str] = None) -> Row:
+        return await self._update(current_user.id, update_values(data, hashed_password))
+
+    async def update(self, user_id: int, data: UserUpdateRequest, hashed_password: Optional[str] = None,
+                     if_match: Optional[str] = None) -> Row:
+        if if_match is not None:
+            result = await self.session.execute(
+                select(User.updated_at).filter(User.id == user_id).with_for_update())
+            updated_at = result.first()
+            if updated_at is None:
+                raise Exception('User not exists')
+            if not is_precondition_met(if_match, resource_version(user_id, updated_at[0])):
+                await self.session.rollback()
+                raise CustomException(http_code=412, code='412',
+                                      message='User has been modified, reload it and retry')
+        return await self._update(user_id, update_values(data, hashed_password))
+
+    async def get(self, user_id, columns: Optional[list] = None):
+        if columns:
+            result = await self.session.execute(select(*columns).filter(User.id == user_id))
+            exist_user = result.first()
+        else:
+            exist_user = await self.session.get(User, user_id)
+        if exist_user is None:
+            raise Exception('User not exists')
+        return exist_user
+
+    async def get_version(self, user_id: int) -> Optional[str]:
+        result = await self.session.execute(select(User.updated_at).filter(User.id == user_id))
+        updated_at = result.first()
+        return None if updated_at is None else resource_version(user_id, updated_at[0])
+
+    async def list_state(self, clauses: list) -> Tuple[int, Optional[datetime]]:
+        result = await self.session.execute(select(func.count(User.id), func.max(User.updated_at)).filter(*clauses))
+        return tuple(result.one())
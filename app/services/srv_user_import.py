@@ -0,0 +1,132 @@
+import io
+import csv
+from datetime import datetime
+from itertools import repeat
+from typing import IO, TYPE_CHECKING, Dict, List, Set, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.models import User
+from app.core.security import get_password_hashes_async
+from app.db.session import db
+from app.helpers.enums import FileFormat, UserRole
+from app.helpers.exception_handler import CustomException
+from app.schemas.sche_user import UserImportError, UserImportResult
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+IMPORT_COLUMNS = ('full_name', 'email', 'password', 'role', 'is_active')
+COPY_COLUMNS = ('full_name', 'email', 'hashed_password', 'is_active', 'role', 'created_at', 'updated_at')
+REQUIRED_COLUMNS = {'email', 'password'}
+EMAIL_PATTERN = r'^[^@\s]+@[^@\s]+\.[^@\s]+$'
+TRUE_VALUES = ['true', 't', 'yes', 'y', '1', '']  # is_active defaults to true
+FALSE_VALUES = ['false', 'f', 'no', 'n', '0']
+
+
+class UserImportService(object):
+    """
+    Bulk user import from a CSV/NDJSON upload. The whole file is validated with vectorized pandas checks,
+    passwords are hashed in the bcrypt process pool and the valid rows are loaded with COPY (Postgres).
+    Invalid rows are reported, not fatal.
+    """
+
+    @staticmethod
+    def read(file: IO, file_format: FileFormat) -> 'pd.DataFrame':
+        import pandas as pd  # Only needed here, keep it out of the app's import time
+
+        try:
+            if file_format is FileFormat.NDJSON:
+                frame = pd.read_json(file, lines=True, dtype=False, convert_dates=False)
+            else:
+                frame = pd.read_csv(file, dtype=str, keep_default_na=False)
+        except ValueError as e:  # Also pandas' EmptyDataError/ParserError
+            raise CustomException(http_code=400, code='400', message=f'Invalid {file_format.value} file: {e}')
+
+        missing = REQUIRED_COLUMNS.difference(frame.columns)
+        if missing:
+            raise CustomException(http_code=400, code='400', message=f'Missing columns: {", ".join(sorted(missing))}')
+        for column in IMPORT_COLUMNS:
+            if column not in frame.columns:
+                frame[column] = ''
+        frame = frame[list(IMPORT_COLUMNS)].fillna('').astype(str)
+        frame.index = range(1, len(frame) + 1)
+        return frame
+
+    @staticmethod
+    def validate(frame: 'pd.DataFrame') -> Tuple['pd.DataFrame', Dict[int, List[str]]]:
+        """
+        Normalize frame like the request schemas do (email domain lowercased, role/is_active defaults)
+        and check every row at once. Return the valid rows and the error messages by row number.
+        """
+        parts = frame['email'].str.strip().str.rpartition('@')
+        frame['email'] = parts[0] + parts[1] + parts[2].str.lower()
+        frame['full_name'] = frame['full_name'].str.strip()
+        frame['role'] = frame['role'].str.strip().str.lower().replace('', UserRole.GUEST.value)
+        is_active = frame['is_active'].str.strip().str.lower()
+
+        checks = [
+            (~frame['email'].str.match(EMAIL_PATTERN), 'Invalid email'),
+            (frame['email'].duplicated(keep='first'), 'Duplicate email in file'),
+            (frame['password'] == '', 'Missing password'),
+            (~frame['role'].isin([role.value for role in UserRole]), 'Invalid role'),
+            (~is_active.isin(TRUE_VALUES + FALSE_VALUES), 'Invalid is_active'),
+        ]
+        errors: Dict[int, List[str]] = {}
+        invalid = None
+        for mask, message in checks:
+            invalid = mask if invalid is None else invalid | mask
+            for row in frame.index[mask]:
+                errors.setdefault(row, []).append(message)
+
+        frame['is_active'] = ~is_active.isin(FALSE_VALUES)
+        return frame[~invalid], errors
+
+    @staticmethod
+    def insert(frame: 'pd.DataFrame', hashed_passwords: List[str]) -> Set[str]:
+        """
+        COPY the rows into a temporary staging table, then move them with one
+        INSERT ... SELECT ... ON CONFLICT (email) DO NOTHING RETURNING email, in a single transaction.
+        A plain COPY into users would abort on the first email that already exists; here the emails
+        that are not returned are the ones that did.
+        """
+        now = datetime.now()
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(zip(
+            [full_name or None for full_name in frame['full_name'].tolist()],  # Unquoted empty field = NULL
+            frame['email'].tolist(), hashed_passwords, frame['is_active'].tolist(), frame['role'].tolist(),
+            repeat(now), repeat(now)
+        ))
+        buffer.seek(0)
+
+        connection = db.session.connection()
+        table = connection.dialect.identifier_preparer.format_table(User.__table__)
+        columns = ', '.join(COPY_COLUMNS)
+        connection.exec_driver_sql(
+            f'CREATE TEMP TABLE user_import ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA')
+        connection.connection.cursor().copy_expert(f'COPY user_import ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+        inserted = connection.exec_driver_sql(
+            f'INSERT INTO {table} ({columns}) SELECT {columns} FROM user_import '
+            f'ON CONFLICT (email) DO NOTHING RETURNING email'
+        ).scalars().all()
+        db.session.commit()
+        return set(inserted)
+
+    @staticmethod
+    async def import_users(file: IO, file_format: FileFormat) -> UserImportResult:
+        frame = await run_in_threadpool(UserImportService.read, file, file_format)
+        valid, errors = await run_in_threadpool(UserImportService.validate, frame)
+        hashed_passwords = await get_password_hashes_async(valid['password'].tolist())
+        inserted = await run_in_threadpool(UserImportService.insert, valid, hashed_passwords)
+
+        for row, email in valid['email'].items():
+            if email not in inserted:
+                errors.setdefault(row, []).append('Email already exists')
+        return UserImportResult(
+            total_rows=len(frame),
+            imported=len(inserted),
+            errors=[
+                UserImportError(row=row, email=frame.at[row, 'email'] or None, message='; '.join(errors[row]))
+                for row in sorted(errors)
+            ]
+        )
@@ -0,0 +1,276 @@
+"""
+HTTP load benchmark of the hot endpoints.
+
+Seeds --users users (tests/faker/user_provider.py) into a disposable database, serves the app with app.server in
+a separate process and drives every scenario at every --concurrency level for --duration seconds from client
+threads (one keep-alive session each). Prints req/s and the p50/p95/p99 latency of each run and writes them to
+--output. With --baseline, the run is compared to a previous output and exits non-zero when the throughput
+or the p95 of a scenario got worse by more than --tolerance percent, or when it had more failed requests.
+
+The tables of --database-url are dropped and created again, never point it at a database you care about.
+The client runs on the same machine: compare results of the same host only.
+
+    $ python -m benchmarks.bench_load --database-url postgresql+psycopg2://postgres:@localhost/bench --users 1000
+    $ python -m benchmarks.bench_load --database-url postgresql+psycopg2://postgres:@localhost/bench \\
+        --concurrency 1 10 50 --duration 10 --output baseline.json
+    $ python -m benchmarks.bench_load --database-url postgresql+psycopg2://postgres:@localhost/bench \\
+        --concurrency 1 10 50 --duration 10 --baseline baseline.json
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple
+
+import requests
+
+BENCH_PASSWORD = 'secret123'
+ADMIN_EMAIL = 'bench.admin@example.com'
+
+
+class Target(object):
+    """
+    The running server and what the scenarios need to call it
+    """
+
+    def __init__(self, base_url: str, token: str, user_ids: List[int], emails: List[str]):
+        self.base_url = base_url
+        self.headers = {'Authorization': f'Bearer {token}'}
+        self.user_ids = user_ids
+        self.emails = emails
+
+
+def login(session: requests.Session, target: Target) -> requests.Response:
+    return session.post(f'{target.base_url}/login',
+                        json={'username': random.choice(target.emails), 'password': BENCH_PASSWORD})
+
+
+def list_users(page_size: int, deep: bool = False) -> Callable:
+    def scenario(session: requests.Session, target: Target) -> requests.Response:
+        page = max(len(target.user_ids) // page_size, 1) if deep else 1
+        return session.get(f'{target.base_url}/users', params={'page_size': page_size, 'page': page},
+                           headers=target.headers)
+    return scenario
+
+
+def detail_me(session: requests.Session, target: Target) -> requests.Response:
+    return session.get(f'{target.base_url}/users/me', headers=target.headers)
+
+
+def update_user(session: requests.Session, target: Target) -> requests.Response:
+    return session.put(f'{target.base_url}/users/{random.choice(target.user_ids)}',
+                       json={'full_name': f'Bench {random.getrandbits(32)}'}, headers=target.headers)
+
+
+SCENARIOS: Dict[str, Callable] = {
+    'login': login,
+    'users_list_10': list_users(10),
+    'users_list_100': list_users(100),
+    'users_list_1000': list_users(1000),
+    'users_list_10_deep': list_users(10, deep=True),  # Last page, the largest OFFSET
+    'users_me': detail_me,
+    'users_update': update_user,
+}
+
+
+def seed(users: int) -> Tuple[List[int], List[str]]:
+    """
+    Recreate the tables, add the admin the scenarios authenticate as and `users` guests sharing BENCH_PASSWORD.
+    Return the ids and emails of the guests.
+    """
+    from app.db.base import engine
+    from app.models import Base
+    from tests.faker import fake
+
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    fake.user({'email': ADMIN_EMAIL, 'password': BENCH_PASSWORD, 'role': 'admin'})
+    guests = fake.users(users, {'password': BENCH_PASSWORD})
+    engine.dispose()
+    return [user.id for user in guests], [user.email for user in guests]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, workers: int) -> subprocess.Popen:
+    from app.core.config import BASE_DIR
+
+    log = tempfile.TemporaryFile()  # Shown only when the server does not come up
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'app.server'], cwd=BASE_DIR, stdout=log, stderr=subprocess.STDOUT,
+        env=dict(os.environ, SERVER_HOST='127.0.0.1', SERVER_PORT=str(port), SERVER_WORKERS=str(workers),
+                 SERVER_ACCESS_LOG='false', DB_CREATE_ALL='false', RATE_LIMIT_ENABLED='false')
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline and server.poll() is None:
+        try:
+            if requests.get(f'http://127.0.0.1:{port}/healthcheck', timeout=1).ok:
+                return server
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.1)
+    server.kill()
+    log.seek(0)
+    sys.exit(f'server did not start:\n{log.read().decode(errors="replace")}')
+
+
+def collect(name: str, target: Target, threads: int, duration: float, warmup: float) -> Tuple[List[float], int]:
+    """
+    threads threads issue requests back to back, the ones started after warmup are measured.
+    Return their latencies and the number of error responses.
+    """
+    scenario = SCENARIOS[name]
+    latencies: List[List[float]] = [[] for _ in range(threads)]
+    errors = [0] * threads
+    begin = time.perf_counter()
+    measure_from, stop_at = begin + warmup, begin + warmup + duration
+
+    def worker(index: int) -> None:
+        with requests.Session() as session:
+            while True:
+                start = time.perf_counter()
+                if start >= stop_at:
+                    return
+                response = scenario(session, target)
+                if start >= measure_from:
+                    latencies[index].append(time.perf_counter() - start)
+                    if not response.ok:
+                        errors[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return [latency for thread_latencies in latencies for latency in thread_latencies], sum(errors)
+
+
+def drive(name: str, target: Target, concurrency: int, duration: float, warmup: float, clients: int = 1) -> dict:
+    """
+    Run scenario name with concurrency requests in flight, spread over clients processes so that a single
+    client's GIL is not the bottleneck of a multi-worker server
+    """
+    if clients > 1:
+        threads = [count for count in (concurrency // clients + (index < concurrency % clients)
+                                       for index in range(clients)) if count]
+        with multiprocessing.get_context('fork').Pool(len(threads)) as pool:
+            parts = pool.starmap(collect, [(name, target, count, duration, warmup) for count in threads])
+    else:
+        parts = [collect(name, target, concurrency, duration, warmup)]
+
+    values = sorted(latency for latencies, _ in parts for latency in latencies)
+    return {
+        'concurrency': concurrency,
+        'requests': len(values),
+        'errors': sum(errors for _, errors in parts),
+        'rps': len(values) / duration,
+        'p50_ms': percentile(values, 0.50) * 1e3,
+        'p95_ms': percentile(values, 0.95) * 1e3,
+        'p99_ms': percentile(values, 0.99) * 1e3,
+    }
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return math.nan
+    return values[min(len(values) - 1, max(math.ceil(q * len(values)) - 1, 0))]
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Print the change of each run against the baseline and return the regressions: throughput or p95 worse by
+    more than tolerance percent, or more failed requests than in the baseline
+    """
+    regressions = []
+    print(f'\n{"run (baseline, change)":28} {"req/s":>8} {"":>8} {"p95 ms":>8} {"":>8} {"errors":>7} {"":>7}')
+    for key, result in results.items():
+        before = baseline.get(key)
+        if before is None:
+            continue
+        rps_change = (result['rps'] / before['rps'] - 1) * 100 if before['rps'] else 0.0
+        p95_change = (result['p95_ms'] / before['p95_ms'] - 1) * 100 if before['p95_ms'] else 0.0
+        errors_change = result['errors'] - before.get('errors', 0)
+        regressed = rps_change < -tolerance or p95_change > tolerance or errors_change > 0
+        if regressed:
+            regressions.append(key)
+        print(f'{key:28} {before["rps"]:8.1f} {rps_change:+7.1f}% {before["p95_ms"]:8.2f} {p95_change:+7.1f}%'
+              f' {before.get("errors", 0):7d} {errors_change:+7d}{"  REGRESSION" if regressed else ""}')
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', required=True, help='Disposable database, its tables are recreated')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--duration', type=float, default=5, help='Measured seconds per scenario and concurrency')
+    parser.add_argument('--warmup', type=float, default=1)
+    parser.add_argument('--workers', type=int, default=1, help='Server worker processes (app.server)')
+    parser.add_argument('--clients', type=int, default=1, help='Client processes sharing the concurrency')
+    parser.add_argument('--output', default='bench_load.json')
+    parser.add_argument('--baseline', help='Output of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=10, help='Percent of change reported as a regression')
+    args = parser.parse_args()
+
+    os.environ['SQL_DATABASE_URL'] = args.database_url  # Before app.core.config reads it
+    from sqlalchemy.engine import make_url
+
+    user_ids, emails = seed(args.users)
+    port = free_port()
+    server = start_server(port, args.workers)
+    try:
+        base_url = f'http://127.0.0.1:{port}'
+        response = requests.post(f'{base_url}/login', json={'username': ADMIN_EMAIL, 'password': BENCH_PASSWORD})
+        response.raise_for_status()
+        target = Target(base_url, response.json()['data']['access_token'], user_ids, emails)
+
+        results = {}
+        print(f'{"run":28} {"req/s":>9} {"p50":>9} {"p95":>9} {"p99":>9} {"errors":>7}')
+        for name in args.scenarios:
+            for concurrency in args.concurrency:
+                key = f'{name}/c{concurrency}'
+                results[key] = dict(scenario=name, **drive(name, target, concurrency, args.duration,
+                                                           args.warmup, args.clients))
+                run = results[key]
+                print(f'{key:28} {run["rps"]:9.1f} {run["p50_ms"]:7.2f}ms {run["p95_ms"]:7.2f}ms '
+                      f'{run["p99_ms"]:7.2f}ms {run["errors"]:7d}')
+    finally:
+        server.terminate()
+        server.wait()
+
+    with open(args.output, 'w') as file:
+        json.dump({
+            'meta': {
+                'database': make_url(args.database_url).get_backend_name(), 'users': args.users,
+                'workers': args.workers, 'clients': args.clients, 'duration': args.duration,
+                'python': platform.python_version(),
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+            },
+            'results': results,
+        }, file, indent=2)
+    print(f'results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file)['results'], args.tolerance)
+        if regressions:
+            sys.exit(f'{len(regressions)} regression(s) over {args.tolerance:.0f}%: {", ".join(regressions)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Per-request overhead of MetricsMiddleware.
+
+Drives a minimal FastAPI app through raw ASGI calls (no server, no socket) with and without the
+middleware and prints the mean cost added per request.
+
+    $ python -m benchmarks.bench_metrics --requests 20000
+"""
+import argparse
+import asyncio
+import time
+
+from fastapi import FastAPI
+
+from app.helpers.metrics import MetricsMiddleware, instrument_routes
+
+
+def build_app(with_metrics: bool) -> FastAPI:
+    application = FastAPI()
+
+    @application.get('/items/{item_id}')
+    async def get_item(item_id: int):
+        return {'id': item_id}
+
+    if with_metrics:
+        instrument_routes(application.routes)
+        application.add_middleware(MetricsMiddleware)
+    return application
+
+
+async def run(application: FastAPI, requests: int) -> float:
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    async def call(index: int):
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+            'scheme': 'http', 'path': f'/items/{index}', 'raw_path': f'/items/{index}'.encode(),
+            'query_string': b'', 'root_path': '', 'headers': [], 'client': ('127.0.0.1', 1), 'server': ('bench', 80),
+        }
+        await application(scope, receive, send)
+
+    for index in range(min(requests, 1000)):  # Warm up
+        await call(index)
+    start = time.perf_counter()
+    for index in range(requests):
+        await call(index)
+    return (time.perf_counter() - start) / requests
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    baseline, instrumented = build_app(False), build_app(True)
+    without, with_ = [], []
+    for _ in range(args.rounds):
+        without.append(asyncio.run(run(baseline, args.requests)))
+        with_.append(asyncio.run(run(instrumented, args.requests)))
+    best_without, best_with = min(without), min(with_)
+    print(f'without metrics: {best_without * 1e6:8.2f} us/request')
+    print(f'with metrics:    {best_with * 1e6:8.2f} us/request')
+    print(f'overhead:        {(best_with - best_without) * 1e6:8.2f} us/request '
+          f'({(best_with / best_without - 1) * 100:.1f}%)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Import-to-first-response time of the application.
+
+Every round starts a fresh interpreter that imports app.main, runs the ASGI lifespan startup and serves
+GET /healthcheck through raw ASGI calls (no server, no socket), then prints the best and median time of
+each phase. Pass --max-ms to exit non-zero when the best total goes over a limit, e.g. in CI.
+
+    $ python -m benchmarks.bench_startup --rounds 10
+    $ python -m benchmarks.bench_startup --rounds 5 --max-ms 1500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from app.core.config import BASE_DIR
+
+CHILD = '''
+import asyncio, json, time
+start = time.perf_counter()
+from app.main import app
+from app.core.config import settings
+imported = time.perf_counter()
+
+
+async def main():
+    lifespan = asyncio.Queue()
+    await lifespan.put({'type': 'lifespan.startup'})
+    sent = []
+
+    async def lifespan_send(message):
+        sent.append(message)
+        if message['type'].startswith('lifespan.startup'):
+            await lifespan.put({'type': 'lifespan.shutdown'})
+
+    task = asyncio.create_task(app({'type': 'lifespan', 'asgi': {'version': '3.0'}}, lifespan.get, lifespan_send))
+    while not sent:
+        await asyncio.sleep(0)
+    assert sent[0]['type'] == 'lifespan.startup.complete', sent[0]
+    started = time.perf_counter()
+
+    path = settings.API_PREFIX + '/healthcheck'
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [], 'client': ('127.0.0.1', 1), 'server': ('bench', 80),
+    }
+    status = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await app(scope, receive, send)
+    assert status == [200], status
+    responded = time.perf_counter()
+    await task  # Shutdown, not measured
+    return started, responded
+
+
+started, responded = asyncio.run(main())
+print(json.dumps({'import': imported - start, 'startup': started - imported, 'first_response': responded - started}))
+'''
+
+PHASES = ('interpreter', 'import', 'startup', 'first_response', 'total')
+
+
+def run_round() -> dict:
+    begin = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD], cwd=BASE_DIR, env=os.environ, check=True, capture_output=True, text=True
+    ).stdout
+    total = time.perf_counter() - begin
+    timings = json.loads(output.strip().splitlines()[-1])
+    timings['total'] = total
+    timings['interpreter'] = total - timings['import'] - timings['startup'] - timings['first_response']
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=None, help='Fail when the best total is above this')
+    args = parser.parse_args()
+
+    rounds = [run_round() for _ in range(args.rounds)]
+    print(f'{"phase":16} {"best":>10} {"median":>10}')
+    for phase in PHASES:
+        values = [timings[phase] for timings in rounds]
+        print(f'{phase:16} {min(values) * 1e3:7.1f} ms {statistics.median(values) * 1e3:7.1f} ms')
+
+    best_total = min(timings['total'] for timings in rounds) * 1e3
+    if args.max_ms is not None and best_total > args.max_ms:
+        sys.exit(f'startup regression: best total {best_total:.1f} ms > {args.max_ms:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Throughput scaling of app.server with its worker count.
+
+Seeds a disposable database like bench_load, then for every --workers value starts app.server with that many
+workers and drives the --scenarios at --concurrency from --clients client processes. Prints req/s, p95 and the
+speedup over the first worker count. Scaling needs free cores for the clients too: run it on a machine with
+more CPUs than the largest worker count, or drive a server on another host.
+
+    $ python -m benchmarks.bench_workers --database-url postgresql+psycopg2://postgres:@localhost/bench \\
+        --workers 1 2 4 --clients 4
+"""
+import argparse
+import os
+
+import requests
+
+from benchmarks.bench_load import ADMIN_EMAIL, BENCH_PASSWORD, SCENARIOS, Target, drive, free_port, seed, \
+    start_server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', required=True, help='Disposable database, its tables are recreated')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=['users_me', 'users_list_100'])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--clients', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--warmup', type=float, default=1)
+    args = parser.parse_args()
+
+    os.environ['SQL_DATABASE_URL'] = args.database_url  # Before app.core.config reads it
+    user_ids, emails = seed(args.users)
+
+    baseline = {}
+    print(f'{"scenario":20} {"workers":>7} {"req/s":>9} {"p95":>9} {"speedup":>8}')
+    for workers in args.workers:
+        port = free_port()
+        server = start_server(port, workers)
+        try:
+            base_url = f'http://127.0.0.1:{port}'
+            response = requests.post(f'{base_url}/login', json={'username': ADMIN_EMAIL, 'password': BENCH_PASSWORD})
+            response.raise_for_status()
+            target = Target(base_url, response.json()['data']['access_token'], user_ids, emails)
+            for name in args.scenarios:
+                run = drive(name, target, args.concurrency, args.duration, args.warmup, args.clients)
+                baseline.setdefault(name, run['rps'])
+                print(f'{name:20} {workers:7d} {run["rps"]:9.1f} {run["p95_ms"]:7.2f}ms '
+                      f'{run["rps"] / baseline[name]:7.2f}x')
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main()
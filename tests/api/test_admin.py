@@ -0,0 +1,84 @@
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+from starlette.testclient import TestClient
+
+from app.core.config import settings
+from app.core.security import create_access_token
+from app.db.base import engine
+from app.db.pool import InstrumentedQueuePool
+from app.db.session import SessionStats
+from app.helpers.enums import UserRole
+from tests.faker import fake
+
+
+class TestDBSession:
+    def test_lazy_session(self, client: TestClient):
+        """
+            Test session DB chỉ được mở khi request thực sự dùng database
+            Step by step:
+            - Khởi tạo admin mẫu, đếm số lần lấy connection từ pool
+            - Gọi API Health check, rồi API Get me (principal chưa có trong cache)
+            - Gọi API admin db/sessions
+            - Đầu ra mong muốn:
+                . Health check không mở session, không lấy connection nào
+                . Get me mở session và lấy connection
+                . db/sessions trả về đúng bộ đếm requests / requests_with_session
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+        checkouts = []
+
+        def on_checkout(*args):
+            checkouts.append(args)
+
+        event.listen(Pool, 'checkout', on_checkout)
+        try:
+            before = SessionStats.as_dict()
+            assert client.get(f"{settings.API_PREFIX}/healthcheck").status_code == 200
+            assert checkouts == []
+            assert SessionStats.requests == before['requests'] + 1
+            assert SessionStats.requests_with_session == before['requests_with_session']
+
+            assert client.get(f"{settings.API_PREFIX}/users/me", headers=headers).status_code == 200
+            assert checkouts
+            assert SessionStats.requests_with_session == before['requests_with_session'] + 1
+        finally:
+            event.remove(Pool, 'checkout', on_checkout)
+
+        r = client.get(f"{settings.API_PREFIX}/admin/db/sessions", headers=headers)
+        assert r.status_code == 200
+        # Counted once the response is sent, the stats request itself is not in its own response
+        assert r.json()['data'] == {'requests': before['requests'] + 2,
+                                    'requests_with_session': before['requests_with_session'] + 1}
+
+
+class TestDBPool:
+    def test_pool_stats(self, client: TestClient):
+        """
+            Test cấu hình pool connection từ Settings và API admin db/pool
+            Step by step:
+            - Kiểm tra pool của engine dùng chung lấy kích thước, overflow, timeout, recycle, pre-ping từ Settings
+            - Giữ 1 connection của engine, gọi API admin db/pool và API metrics
+            - Đầu ra mong muốn:
+                . db/pool trả về cấu hình pool, 1 connection đang dùng, thời gian chờ checkout được ghi nhận
+                . metrics có các series db_pool_*
+        """
+        pool = engine.pool
+        assert isinstance(pool, InstrumentedQueuePool)
+        assert (pool.size(), pool._max_overflow, pool._timeout, pool._recycle, pool._pre_ping) == (
+            settings.DB_POOL_SIZE, settings.DB_MAX_OVERFLOW, settings.DB_POOL_TIMEOUT, settings.DB_POOL_RECYCLE,
+            settings.DB_POOL_PRE_PING)
+
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+        checkouts = pool.checkout_wait.count
+        with engine.connect():
+            r = client.get(f"{settings.API_PREFIX}/admin/db/pool", headers=headers)
+            metrics = client.get(f"{settings.API_PREFIX}/metrics").text
+        assert r.status_code == 200
+        data = r.json()['data']
+        assert data['pool_size'] == settings.DB_POOL_SIZE and data['max_overflow'] == settings.DB_MAX_OVERFLOW
+        assert data['checked_out'] == 1 and data['overflow_in_use'] == 0
+        assert data['checkout_wait']['count'] == checkouts + 1
+        assert 'db_pool_checked_out 1' in metrics.splitlines()
+        assert f'db_pool_size {settings.DB_POOL_SIZE}' in metrics.splitlines()
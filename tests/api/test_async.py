@@ -0,0 +1,84 @@
+from starlette.testclient import TestClient
+
+from app.core.config import settings
+from app.core.security import create_access_token, verify_password
+from app.db.session import db
+from app.helpers.enums import UserRole
+from app.models import User
+from app.services.srv_last_login import last_login_writer
+from tests.faker import fake
+
+ASYNC_PREFIX = f"{settings.API_PREFIX}{settings.ASYNC_API_PREFIX}"
+
+
+class TestAsyncStack:
+    def test_register_login(self, client: TestClient):
+        """
+            Test api register/login trên asyncio database stack (ASYNC_DB_ENABLED=true)
+            Step by step:
+            - Gọi API Register async với đầu vào chuẩn, rồi gọi lại với cùng email
+            - Gọi API Login async với mật khẩu đúng và sai
+            - Đầu ra mong muốn:
+                . register thành công 1 lần với 1 query, lần 2 trả về 400 'Email already exists'
+                . login đúng trả về access_token và ghi last_login, login sai trả về 400
+        """
+        register_data = {'full_name': fake.name(), 'email': fake.email(), 'password': 'secret123', 'role': 'guest'}
+        r = client.post(f"{ASYNC_PREFIX}/register", json=register_data)
+        assert r.status_code == 200
+        assert r.json()['data']['email'] == register_data['email']
+        assert 'desc="1 queries"' in r.headers['server-timing']
+        r = client.post(f"{ASYNC_PREFIX}/register", json=register_data)
+        assert r.status_code == 400 and r.json()['message'] == 'Email already exists'
+
+        url = f"{ASYNC_PREFIX}/login"
+        r = client.post(url, json={'username': register_data['email'], 'password': 'secret123'})
+        assert r.status_code == 200
+        assert r.json()['data']['access_token']
+        assert client.post(url, json={'username': register_data['email'], 'password': 'wrong'}).status_code == 400
+
+        last_login_writer.stop()
+        with db():
+            assert db.session.query(User.last_login).filter(User.email == register_data['email']).scalar()
+
+    def test_user_crud(self, client: TestClient):
+        """
+            Test api user (list, create, detail, update, update me) trên asyncio database stack
+            Step by step:
+            - Khởi tạo admin và 4 user mẫu
+            - Gọi API Get list User async, Create User async, Get detail User async
+            - Gọi API Update User async với If-Match cũ và mới, Update me async với mật khẩu mới
+            - Đầu ra mong muốn:
+                . list trả về 5 user, create trả về user mới
+                . If-Match cũ trả về 412, If-Match mới cập nhật thành công
+                . update me đổi mật khẩu
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        fake.users(4)
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+
+        r = client.get(f"{ASYNC_PREFIX}/users", params={'page_size': 10}, headers=headers)
+        assert r.status_code == 200
+        assert r.json()['metadata']['total_items'] == 5
+
+        r = client.post(f"{ASYNC_PREFIX}/users", headers=headers, json={
+            'full_name': 'Async User', 'email': 'async@example.com', 'password': 'secret123', 'role': 'guest'
+        })
+        assert r.status_code == 200
+        user_id = r.json()['data']['id']
+
+        r = client.get(f"{ASYNC_PREFIX}/users/{user_id}", headers=headers)
+        assert r.status_code == 200
+        etag = r.headers['etag']
+
+        r = client.put(f"{ASYNC_PREFIX}/users/{user_id}", headers={**headers, 'If-Match': etag},
+                       json={'full_name': 'Async User 2'})
+        assert r.status_code == 200
+        assert r.json()['data']['full_name'] == 'Async User 2'
+        r = client.put(f"{ASYNC_PREFIX}/users/{user_id}", headers={**headers, 'If-Match': etag},
+                       json={'full_name': 'Async User 3'})
+        assert r.status_code == 412
+
+        r = client.put(f"{ASYNC_PREFIX}/users/me", headers=headers, json={'password': 'secret456'})
+        assert r.status_code == 200
+        with db():
+            assert verify_password('secret456', db.session.query(User).get(admin.id).hashed_password)
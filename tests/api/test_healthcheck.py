@@ -0,0 +1,79 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import requests
+from starlette.testclient import TestClient
+
+from app.core.config import BASE_DIR, settings
+
+STARTUP_SCRIPT = '''
+from starlette.testclient import TestClient
+from app.main import app
+with TestClient(app) as client:
+    assert client.get(app.url_path_for('get')).status_code == 200
+'''
+
+
+class TestHealthCheck:
+    def test_success(self, client: TestClient):
+        """
+            Test api health check
+            Step by step:
+            - Gọi API Health check
+            - Đầu ra mong muốn:
+                . status code: 200
+        """
+        r = client.get(f"{settings.API_PREFIX}/healthcheck")
+        assert r.status_code == 200
+        assert r.json()['message'] == 'Health check success'
+
+    def test_startup_without_database(self):
+        """
+            Test import và startup của app không chạm vào database
+            Step by step:
+            - Chạy app trong process mới với SQL_DATABASE_URL trỏ tới server không tồn tại, DB_CREATE_ALL tắt
+            - Gọi API Health check
+            - Đầu ra mong muốn:
+                . import, startup và health check đều thành công
+        """
+        env = dict(os.environ, SQL_DATABASE_URL='postgresql+psycopg2://nobody@127.0.0.1:1/nothing',
+                   DB_CREATE_ALL='false', PASSWORD_HASH_WORKERS='0')
+        result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=BASE_DIR, env=env,
+                                capture_output=True, text=True, timeout=60)
+        assert result.returncode == 0, result.stderr
+
+    def test_prefork_server(self):
+        """
+            Test server nhiều worker (app.server)
+            Step by step:
+            - Chạy app.server với 2 worker
+            - Gọi API Health check, gửi SIGTERM tới master
+            - Đầu ra mong muốn:
+                . status code: 200
+                . master và các worker dừng hẳn, exit code 0
+        """
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        env = dict(os.environ, SERVER_HOST='127.0.0.1', SERVER_PORT=str(port), SERVER_WORKERS='2',
+                   PASSWORD_HASH_WORKERS='0')
+        server = subprocess.Popen([sys.executable, '-m', 'app.server'], cwd=BASE_DIR, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    r = requests.get(f'http://127.0.0.1:{port}{settings.API_PREFIX}/healthcheck', timeout=1)
+                    break
+                except requests.ConnectionError:
+                    assert time.monotonic() < deadline and server.poll() is None
+                    time.sleep(0.1)
+            assert r.status_code == 200
+            server.send_signal(signal.SIGTERM)
+            assert server.wait(timeout=30) == 0
+        finally:
+            server.kill()
@@ -1,7 +1,14 @@
+import time
+from datetime import datetime
+
 from starlette.testclient import TestClient
 
 from app.core.config import settings
+from app.db.session import db
 from app.models import User
+from app.server import worker_config
+from app.services import srv_last_login
+from app.services.srv_last_login import last_login_writer
 from tests.faker import fake
 
 
@@ -58,3 +65,133 @@ class TestLogin:
             'password': 'secret123'
         })
         assert r.status_code == 401
+
+    def test_rate_limit(self, client: TestClient, monkeypatch):
+        """
+            Test giới hạn tần suất (token bucket) của API Login theo email và theo IP
+            Step by step:
+            - Khởi tạo data mẫu, hạ burst của email xuống 2 và của IP xuống 4
+            - Gọi API Login sai password 3 lần với cùng email, rồi 2 lần với email khác
+            - Đầu ra mong muốn:
+                . lần thứ 3 cùng email trả về 429 có Retry-After, không chạy query nào
+                . email khác được gọi tiếp cho tới khi IP hết token
+        """
+        monkeypatch.setattr(settings, 'RATE_LIMIT_EMAIL_BURST', 2)
+        monkeypatch.setattr(settings, 'RATE_LIMIT_IP_BURST', 4)
+        monkeypatch.setattr(settings, 'RATE_LIMIT_IP_RATE', 0.01)
+        current_user: User = fake.user({'password': 'secret123'})
+        url = f"{settings.API_PREFIX}/login"
+        for _ in range(2):
+            assert client.post(url, json={'username': current_user.email, 'password': 'wrong'}).status_code == 400
+
+        r = client.post(url, json={'username': current_user.email.upper(), 'password': 'secret123'})
+        assert r.status_code == 429
+        assert int(r.headers['retry-after']) >= 1
+        assert 'desc="0 queries"' in r.headers['server-timing']
+
+        assert client.post(url, json={'username': 'other@example.com', 'password': 'wrong'}).status_code == 400
+        r = client.post(url, json={'username': 'another@example.com', 'password': 'wrong'})
+        assert r.status_code == 429 and int(r.headers['retry-after']) >= 100
+
+    def test_rate_limit_behind_proxy(self, client: TestClient, monkeypatch):
+        """
+            Test giới hạn tần suất theo IP khi app.server chạy sau reverse proxy
+            Step by step:
+            - Hạ burst của IP xuống 2, tin cậy header X-Forwarded-For của proxy (client của TestClient)
+            - Gọi API Login sai password qua cấu hình uvicorn của worker, với 2 IP khác nhau trong X-Forwarded-For
+            - Làm lại khi proxy không nằm trong SERVER_FORWARDED_ALLOW_IPS
+            - Đầu ra mong muốn:
+                . proxy tin cậy: mỗi IP client có bucket riêng
+                . proxy không tin cậy: X-Forwarded-For bị bỏ qua, mọi request dùng chung bucket của proxy
+        """
+        monkeypatch.setattr(settings, 'RATE_LIMIT_IP_BURST', 2)
+        monkeypatch.setattr(settings, 'RATE_LIMIT_IP_RATE', 0.01)
+        url = f"{settings.API_PREFIX}/login"
+
+        def login(proxied: TestClient, ip: str) -> int:
+            return proxied.post(url, json={'username': fake.email(), 'password': 'wrong'},
+                                headers={'X-Forwarded-For': ip}).status_code
+
+        for allowed_ips, expected in [('testclient', [400, 400, 429, 400]), ('10.0.0.1', [400, 400, 429, 429])]:
+            monkeypatch.setattr(settings, 'SERVER_FORWARDED_ALLOW_IPS', allowed_ips)
+            config = worker_config()
+            config.load()
+            proxied = TestClient(config.loaded_app)
+            ips = ['203.0.113.1'] * 3 + ['203.0.113.2']
+            assert [login(proxied, ip) for ip in ips] == expected
+
+    def test_last_login_write_behind(self, client: TestClient):
+        """
+            Test ghi last_login kiểu write-behind
+            Step by step:
+            - Khởi tạo data mẫu, dừng thread ghi nền của hàng đợi last_login
+            - Gọi API Login 2 lần với cùng user
+            - Ghi hàng đợi xuống database (flush)
+            - Đầu ra mong muốn:
+                . login chỉ tốn 1 query (đọc user), không ghi gì
+                . 2 lần login gộp thành 1 user trong hàng đợi
+                . sau khi flush, last_login của user được cập nhật, hàng đợi rỗng
+        """
+        last_login_writer.stop()  # No background flush during the test
+        current_user: User = fake.user({'password': 'secret123'})
+        url = f"{settings.API_PREFIX}/login"
+        for _ in range(2):
+            r = client.post(url, json={'username': current_user.email, 'password': 'secret123'})
+            assert r.status_code == 200
+            assert 'desc="1 queries"' in r.headers['server-timing']
+
+        assert last_login_writer.pending.keys() == {current_user.id}
+        last_login = last_login_writer.pending[current_user.id]
+        assert last_login_writer.flush() == 1
+        assert len(last_login_writer) == 0
+        with db():
+            assert db.session.query(User.last_login).filter(User.id == current_user.id).scalar() == last_login
+
+    def test_last_login_flush_failure(self, client: TestClient, monkeypatch):
+        """
+            Test hàng đợi last_login khi ghi xuống database bị lỗi
+            Step by step:
+            - Khởi tạo data mẫu, dừng thread ghi nền, đưa 1 lần login vào hàng đợi
+            - Cho lệnh ghi raise RuntimeError, trong lúc ghi có 1 lần login mới hơn của user đó
+            - Chạy lại thread ghi nền với flush luôn raise, rồi bỏ lỗi
+            - Đầu ra mong muốn:
+                . flush lỗi không mất batch: user quay lại hàng đợi với last_login mới nhất
+                . thread ghi nền không chết khi flush raise, và ghi được hàng đợi khi hết lỗi
+        """
+        last_login_writer.stop()
+        current_user: User = fake.user({'password': 'secret123'})
+        first, newer = datetime(2022, 10, 1, 8, 0), datetime(2022, 10, 1, 9, 0)
+        last_login_writer.push(current_user.id, first)
+
+        def failing_values(*args, **kwargs):
+            last_login_writer.push(current_user.id, newer)
+            raise RuntimeError('boom')
+
+        failures = last_login_writer.failures
+        monkeypatch.setattr(srv_last_login, 'values', failing_values)
+        assert last_login_writer.flush() == 0
+        assert last_login_writer.failures == failures + 1
+        assert last_login_writer.pending == {current_user.id: newer}
+        monkeypatch.undo()
+
+        flush = last_login_writer.flush
+        calls = []
+
+        def failing_flush():
+            calls.append(1)
+            if len(calls) == 1:
+                raise RuntimeError('boom')
+            return flush()
+
+        monkeypatch.setattr(last_login_writer, 'flush', failing_flush)
+        monkeypatch.setattr(settings, 'LAST_LOGIN_FLUSH_INTERVAL', 0.01)
+        last_login_writer.start()
+        for _ in range(500):
+            if not last_login_writer.pending:
+                break
+            time.sleep(0.01)
+        assert last_login_writer._thread.is_alive()
+        last_login_writer.stop()
+        assert len(calls) >= 2
+        with db():
+            assert db.session.query(User.last_login).filter(User.id == current_user.id).scalar() == newer
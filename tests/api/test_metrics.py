@@ -0,0 +1,57 @@
+from starlette.testclient import TestClient
+
+from app.core.config import settings
+from app.core.security import create_access_token
+from app.helpers.enums import UserRole
+from tests.faker import fake
+
+
+def scrape(client: TestClient) -> dict:
+    """
+    Samples of GET /metrics as {'name{labels}': value}
+    """
+    r = client.get(f"{settings.API_PREFIX}/metrics")
+    assert r.status_code == 200
+    assert r.headers['content-type'].startswith('text/plain; version=0.0.4')
+    samples = {}
+    for line in r.text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+class TestMetrics:
+    def test_route_template_labels(self, client: TestClient):
+        """
+            Test api metrics dạng Prometheus, gán nhãn theo route template
+            Step by step:
+            - Khởi tạo admin và 2 user mẫu
+            - Gọi API Get detail User với 2 id khác nhau và 1 id không tồn tại
+            - Gọi API metrics trước và sau
+            - Đầu ra mong muốn:
+                . các request được đếm dưới route="/users/{user_id}", không có nhãn theo path thật (/users/1)
+                . đếm theo nhóm status (2xx, 4xx), histogram latency/response size tăng đúng số request
+                . không còn request nào đang chạy (in flight) trên route đó
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        users = fake.users(2)
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+        labels = f'method="GET",route="{settings.API_PREFIX}/users/{{user_id}}"'
+
+        before = scrape(client)
+        for user in users:
+            assert client.get(f"{settings.API_PREFIX}/users/{user.id}", headers=headers).status_code == 200
+        assert client.get(f"{settings.API_PREFIX}/users/{users[-1].id + 1000}", headers=headers).status_code == 400
+        after = scrape(client)
+
+        def delta(name: str) -> float:
+            return after.get(name, 0) - before.get(name, 0)
+
+        assert delta(f'http_requests_total{{{labels},status="2xx"}}') == 2
+        assert delta(f'http_requests_total{{{labels},status="4xx"}}') == 1
+        assert delta(f'http_request_duration_seconds_count{{{labels}}}') == 3
+        assert delta(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}}') == 3
+        assert delta(f'http_response_size_bytes_count{{{labels}}}') == 3
+        assert after[f'http_route_requests_in_flight{{{labels}}}'] == 0
+        assert not any(f'/users/{user.id}"' in name for name in after for user in users)
@@ -1,11 +1,16 @@
 import json
 import random
+from concurrent.futures import ThreadPoolExecutor
 
 from starlette.testclient import TestClient
 
+from app.core import security
 from app.core.config import settings
+from app.core.security import create_access_token
+from app.db.session import db
 from app.helpers.enums import UserRole
-from tests.faker.user_provider import fake
+from app.models import User
+from tests.faker import fake
 
 
 class TestRegister:
@@ -31,3 +36,57 @@ class TestRegister:
         assert response['code'] == '000'
         assert response['message'] == 'Thành công'
         assert response['data']['email'] is not None
+
+    def test_parallel_duplicates(self, client: TestClient, monkeypatch):
+        """
+            Test đăng ký đồng thời nhiều lần cùng 1 email
+            Step by step:
+            - Gọi API Register 8 lần song song với cùng email
+            - Gọi lại API Register với email đó
+            - Đầu ra mong muốn:
+                . đúng 1 request thành công (200), các request còn lại trả về 400 'Email already exists'
+                . database chỉ có 1 user với email đó
+                . mỗi request chỉ tốn 1 query (INSERT ... ON CONFLICT DO NOTHING RETURNING)
+        """
+        monkeypatch.setattr(settings, 'RATE_LIMIT_ENABLED', False)
+        register_data = {'full_name': fake.name(), 'email': fake.email(), 'password': 'secret123', 'role': 'guest'}
+
+        def register(_):
+            return client.post(f"{settings.API_PREFIX}/register", json=register_data)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(register, range(8)))
+        assert sorted(r.status_code for r in responses) == [200] + [400] * 7
+        assert all(r.json()['message'] == 'Email already exists' for r in responses if r.status_code == 400)
+        assert all('desc="1 queries"' in r.headers['server-timing'] for r in responses)
+
+        r = register(None)
+        assert r.status_code == 400 and r.json()['message'] == 'Email already exists'
+        with db():
+            assert db.session.query(User).filter(User.email == register_data['email']).count() == 1
+
+    def test_hash_pool_saturated(self, client: TestClient, monkeypatch):
+        """
+            Test api register/update khi hàng đợi hash mật khẩu đã đầy
+            Step by step:
+            - Đặt số job hash đang chờ bằng PASSWORD_HASH_MAX_PENDING
+            - Gọi API Register, API Register async và API Update me async với mật khẩu mới
+            - Đầu ra mong muốn:
+                . status code: 503 với header Retry-After, không tạo user nào
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        monkeypatch.setattr(security, 'hash_pending', settings.PASSWORD_HASH_MAX_PENDING)
+        register_data = {'full_name': fake.name(), 'email': fake.email(), 'password': 'secret123', 'role': 'guest'}
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+
+        for method, url, kwargs in [
+            ('post', f"{settings.API_PREFIX}/register", {'json': register_data}),
+            ('post', f"{settings.API_PREFIX}{settings.ASYNC_API_PREFIX}/register", {'json': register_data}),
+            ('put', f"{settings.API_PREFIX}{settings.ASYNC_API_PREFIX}/users/me",
+             {'json': {'password': 'secret456'}, 'headers': headers}),
+        ]:
+            r = getattr(client, method)(url, **kwargs)
+            assert r.status_code == 503
+            assert r.headers['retry-after'] == '1'
+        with db():
+            assert db.session.query(User).filter(User.email == register_data['email']).count() == 0
@@ -0,0 +1,870 @@
+import io
+import os
+import csv
+import json
+import pytest
+from datetime import datetime, timedelta
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import create_engine, event, func, text
+from sqlalchemy.engine import Engine, make_url
+from starlette.testclient import TestClient
+
+from app.api import api_user
+from app.core.config import settings
+from app.core.security import create_access_token, verify_password
+from app.db.replicas import recent_writers, replicas
+from app.db.session import db
+from app.helpers.enums import UserRole
+from app.helpers.paging import Cursor, Page, encode_cursor
+from app.helpers.request_timing import QueryBudgetExceeded
+from app.models import Base, User
+from app.schemas.sche_base import DataResponse
+from app.schemas.sche_user import UserItemResponse, UserFilterParams
+from app.services.srv_user import UserService, user_cache
+from tests.faker import fake
+
+
+class TestListUser:
+    def test_cursor_pagination(self, client: TestClient):
+        """
+            Test api get list user with keyset (cursor) pagination
+            Step by step:
+            - Khởi tạo 25 user mẫu
+            - Gọi API Get list User, đi hết các trang bằng next_cursor
+            - Quay lại trang trước bằng prev_cursor
+            - Đầu ra mong muốn:
+                . mỗi user xuất hiện đúng 1 lần, theo thứ tự id giảm dần
+                . trang lấy theo cursor giống trang lấy theo page/offset
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        fake.users(24)
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+
+        pages = []
+        r = client.get(f"{settings.API_PREFIX}/users", params={'page_size': 10}, headers=headers)
+        while True:
+            assert r.status_code == 200
+            response = r.json()
+            pages.append(response)
+            if not response['metadata']['next_cursor']:
+                break
+            r = client.get(f"{settings.API_PREFIX}/users", headers=headers, params={
+                'page_size': 10, 'cursor': response['metadata']['next_cursor']
+            })
+
+        ids = [item['id'] for page in pages for item in page['data']]
+        assert len(pages) == 3
+        assert ids == sorted(ids, reverse=True)
+        assert len(set(ids)) == 25
+
+        r = client.get(f"{settings.API_PREFIX}/users", params={'page_size': 10, 'page': 3}, headers=headers)
+        assert r.json()['data'] == pages[2]['data']
+
+        r = client.get(f"{settings.API_PREFIX}/users", headers=headers, params={
+            'page_size': 10, 'cursor': pages[1]['metadata']['prev_cursor']
+        })
+        assert r.json()['data'] == pages[0]['data']
+        assert r.json()['metadata']['prev_cursor'] is None
+
+    def test_count_strategy(self, client: TestClient):
+        """
+            Test api get list user with each total count strategy
+            Step by step:
+            - Khởi tạo 15 user mẫu
+            - Gọi API Get list User với từng count_strategy
+            - Đầu ra mong muốn:
+                . total_strategy cho biết strategy đã dùng
+                . exact/cached/window trả về đúng tổng số user, none trả về null
+        """
+        admin = fake.user({'password': 'secret123'})
+        fake.users(14)
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+
+        for strategy, total in [('exact', 15), ('cached', 15), ('window', 15), ('none', None)]:
+            r = client.get(f"{settings.API_PREFIX}/users", headers=headers, params={
+                'page_size': 10, 'page': 2, 'count_strategy': strategy
+            })
+            assert r.status_code == 200
+            metadata = r.json()['metadata']
+            assert metadata['total_items'] == total
+            assert metadata['total_strategy'] == strategy
+
+        r = client.get(f"{settings.API_PREFIX}/users", params={'include_total': False}, headers=headers)
+        assert r.json()['metadata']['total_items'] is None
+
+    def test_fast_serialization(self, client: TestClient):
+        """
+            Test api get list user/detail user trả về đúng byte như khi FastAPI tự serialize response_model
+            Step by step:
+            - Khởi tạo user mẫu có tên tiếng Việt và last_login
+            - Gọi API Get list User và Get detail User
+            - Encode lại body bằng response_model + jsonable_encoder + JSONResponse
+            - Đầu ra mong muốn:
+                . body giống hệt nhau (thứ tự key, định dạng datetime, ký tự unicode)
+        """
+        admin = fake.user({'name': 'Nguyễn Văn Ánh', 'password': 'secret123', 'role': UserRole.ADMIN.value})
+        fake.users(5)
+        with db():
+            db.session.query(User).update({User.last_login: datetime(2022, 10, 1, 8, 30, 15, 123456)})
+            db.session.commit()
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+
+        for url, response_model in [
+            (f"{settings.API_PREFIX}/users", Page[UserItemResponse]),
+            (f"{settings.API_PREFIX}/users/{admin.id}", DataResponse[UserItemResponse]),
+        ]:
+            r = client.get(url, headers=headers)
+            assert r.status_code == 200
+            expected = JSONResponse(jsonable_encoder(response_model(**r.json()))).body
+            assert r.content == expected
+        assert 'Nguyễn Văn Ánh' in r.content.decode()
+
+    def test_sparse_fields(self, client: TestClient):
+        """
+            Test api get list user/detail user với tham số fields
+            Step by step:
+            - Khởi tạo 15 user mẫu
+            - Gọi API Get list User với fields=id,email, sắp xếp theo full_name, đi hết các trang bằng next_cursor
+            - Gọi API Get detail User với fields=email
+            - Gọi API với field không có trong UserItemResponse
+            - Đầu ra mong muốn:
+                . chỉ trả về các field được yêu cầu, các SELECT của trang và của detail không đọc hashed_password
+                . phân trang theo cursor vẫn đúng khi sort_by không nằm trong fields
+                . field không hợp lệ trả về lỗi 400
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        fake.users(14)
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+        client.get(f"{settings.API_PREFIX}/users/me", headers=headers)  # The principal (a full row) is cached now
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            params = {'fields': 'id,email', 'sort_by': 'full_name', 'page_size': 10}
+            r = client.get(f"{settings.API_PREFIX}/users", params=params, headers=headers)
+            items = r.json()['data']
+            r = client.get(f"{settings.API_PREFIX}/users", headers=headers, params={
+                'fields': 'id,email', 'page_size': 10, 'cursor': r.json()['metadata']['next_cursor']
+            })
+            items += r.json()['data']
+            r = client.get(f"{settings.API_PREFIX}/users/{admin.id}", params={'fields': 'email'}, headers=headers)
+        finally:
+            event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+
+        assert all(list(item) == ['email', 'id'] for item in items)
+        assert len({item['id'] for item in items}) == 15
+        assert r.json()['data'] == {'email': admin.email}
+        # 2 pages (ETag probe, count, page) and the detail
+        user_statements = [statement for statement in statements if 'FROM "user"' in statement]
+        assert len(user_statements) == 7
+        assert not any('hashed_password' in statement for statement in user_statements)
+
+        r = client.get(f"{settings.API_PREFIX}/users", params={'fields': 'id,hashed_password'}, headers=headers)
+        assert r.status_code == 400
+
+    def test_sort_whitelist(self, client: TestClient):
+        """
+            Test api get list user với sort_by ngoài danh sách cột được phép sắp xếp
+            Step by step:
+            - Khởi tạo admin
+            - Gọi API Get list User với sort_by=hashed_password, và với cursor tự tạo có sort_by=hashed_password
+            - Đầu ra mong muốn:
+                . cả hai trả về lỗi 400, không lộ hashed_password qua cursor
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+
+        r = client.get(f"{settings.API_PREFIX}/users", params={'sort_by': 'hashed_password', 'page_size': 1},
+                       headers=headers)
+        assert r.status_code == 400
+
+        cursor = encode_cursor(Cursor('hashed_password', 'desc', True, '$2b$', admin.id + 1))
+        r = client.get(f"{settings.API_PREFIX}/users", params={'cursor': cursor}, headers=headers)
+        assert r.status_code == 400
+        assert r.json()['message'] == 'Invalid cursor'
+
+    def test_cursor_sort_ties(self, client: TestClient):
+        """
+            Test api get list user phân trang theo cursor với sort_by có nhiều giá trị trùng nhau
+            Step by step:
+            - Khởi tạo admin và 11 user mẫu: role, is_active trùng nhau, last_login trùng nhau hoặc NULL
+            - Với sort_by role, is_active, last_login và order desc/asc: đi hết các trang bằng next_cursor,
+              rồi quay lại bằng prev_cursor
+            - Đầu ra mong muốn:
+                . thứ tự theo (sort_by, id), NULL đứng đầu khi desc, cuối khi asc
+                . mỗi user xuất hiện đúng 1 lần, các trang đi lùi giống các trang đi tới
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        users = fake.users(11)
+        logins = [None, datetime(2022, 10, 1, 8, 0), datetime(2022, 10, 1, 9, 0)]
+        with db():
+            for index, user in enumerate(users):
+                db.session.query(User).filter(User.id == user.id).update({
+                    'role': UserRole.ADMIN.value if index % 4 == 0 else UserRole.GUEST.value,
+                    'is_active': index % 3 != 0,
+                    'last_login': logins[index % 3],
+                }, synchronize_session=False)
+            db.session.commit()
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+
+        for sort_by in ('role', 'is_active', 'last_login'):
+            for order in ('desc', 'asc'):
+                pages = []
+                params = {'sort_by': sort_by, 'order': order, 'page_size': 5}
+                while True:
+                    r = client.get(f"{settings.API_PREFIX}/users", params=params, headers=headers)
+                    assert r.status_code == 200
+                    pages.append(r.json())
+                    if not pages[-1]['metadata']['next_cursor']:
+                        break
+                    params = {'page_size': 5, 'cursor': pages[-1]['metadata']['next_cursor']}
+
+                items = [item for page in pages for item in page['data']]
+                # NULLs rank above every value, then ties are broken by id
+                keys = [(False, item[sort_by], item['id']) if item[sort_by] is not None else (True, item['id'])
+                        for item in items]
+                assert len(pages) == 3 and len({item['id'] for item in items}) == 12
+                assert keys == sorted(keys, reverse=order == 'desc')
+
+                for index in (1, 0):
+                    r = client.get(f"{settings.API_PREFIX}/users", headers=headers, params={
+                        'page_size': 5, 'cursor': pages[index + 1]['metadata']['prev_cursor']
+                    })
+                    assert r.json()['data'] == pages[index]['data']
+
+    def test_cursor_null_sort_values(self, client: TestClient):
+        """
+            Test api get list user phân trang theo cursor khi cột sort_by có giá trị NULL
+            Step by step:
+            - Khởi tạo 12 user mẫu, 5 user có full_name NULL
+            - Với order desc và asc: gọi API Get list User sort_by=full_name, đi hết các trang bằng next_cursor,
+              rồi quay lại bằng prev_cursor
+            - Đầu ra mong muốn:
+                . mỗi user xuất hiện đúng 1 lần, các user có full_name NULL nằm cuối khi asc, đầu khi desc
+                . has_next đúng: không có trang rỗng sau trang kết thúc bằng NULL
+                . các trang đi lùi giống các trang đi tới
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        users = fake.users(11)
+        with db():
+            db.session.query(User).filter(User.id.in_([user.id for user in users[::2][:5]])) \
+                .update({User.full_name: None}, synchronize_session=False)
+            db.session.commit()
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+
+        for order in ('desc', 'asc'):
+            pages = []
+            params = {'sort_by': 'full_name', 'order': order, 'page_size': 4}
+            while True:
+                r = client.get(f"{settings.API_PREFIX}/users", params=params, headers=headers)
+                assert r.status_code == 200
+                pages.append(r.json())
+                if not pages[-1]['metadata']['next_cursor']:
+                    break
+                params = {'page_size': 4, 'cursor': pages[-1]['metadata']['next_cursor']}
+
+            items = [item for page in pages for item in page['data']]
+            names = [item['full_name'] for item in items]
+            assert len(pages) == 3 and all(page['data'] for page in pages)
+            assert len({item['id'] for item in items}) == 12
+            assert names.count(None) == 5
+            assert names[:5] == [None] * 5 if order == 'desc' else names[-5:] == [None] * 5
+
+            for index in (1, 0):
+                r = client.get(f"{settings.API_PREFIX}/users", headers=headers, params={
+                    'page_size': 4, 'cursor': pages[index + 1]['metadata']['prev_cursor']
+                })
+                assert r.json()['data'] == pages[index]['data']
+
+    def test_filters(self, client: TestClient):
+        """
+            Test api get list user với các bộ lọc role, is_active, khoảng last_login và tìm kiếm q
+            Step by step:
+            - Khởi tạo admin và 6 user mẫu với role/is_active/last_login/tên khác nhau
+            - Gọi API Get list User với từng bộ lọc, và export với cùng bộ lọc
+            - Đầu ra mong muốn:
+                . chỉ trả về các user thoả mãn tất cả bộ lọc, total_items đúng
+                . q không phân biệt hoa thường, ký tự % và _ được tìm theo nghĩa đen
+        """
+        admin = fake.user({'name': 'Admin', 'email': 'admin@example.com', 'password': 'secret123',
+                           'role': UserRole.ADMIN.value})
+        users = [
+            fake.user({'name': 'Nguyễn Văn An', 'email': 'an@example.com', 'password': 'x'}),
+            fake.user({'name': 'Trần Thị Bình', 'email': 'binh@example.com', 'password': 'x', 'is_active': False}),
+            fake.user({'name': 'Lê Văn Cường', 'email': 'cuong@corp.vn', 'password': 'x', 'role': 'admin'}),
+            fake.user({'name': '100% Hoàng', 'email': 'hoang@example.com', 'password': 'x'}),
+            fake.user({'name': 'Phạm_Dũng', 'email': 'dung@example.com', 'password': 'x'}),
+            fake.user({'name': 'Phạm Dung', 'email': 'dung2@example.com', 'password': 'x'}),
+        ]
+        with db():
+            for days, user in enumerate(users):
+                db.session.query(User).filter(User.id == user.id).update(
+                    {User.last_login: datetime(2022, 10, 1 + days)})
+            db.session.commit()
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+
+        def ids(**params):
+            r = client.get(f"{settings.API_PREFIX}/users", params={**params, 'order': 'asc'}, headers=headers)
+            assert r.status_code == 200
+            assert r.json()['metadata']['total_items'] == len(r.json()['data'])
+            return [item['id'] for item in r.json()['data']]
+
+        assert ids(role='admin') == [admin.id, users[2].id]
+        assert ids(is_active=False) == [users[1].id]
+        assert ids(role='guest', is_active=True) == [users[0].id, users[3].id, users[4].id, users[5].id]
+        assert ids(last_login_from='2022-10-02T00:00:00', last_login_to='2022-10-04T00:00:00') \
+            == [users[1].id, users[2].id]
+        assert ids(q='VĂN') == [users[0].id, users[2].id]
+        assert ids(q='corp.vn') == [users[2].id]
+        assert ids(q='100%') == [users[3].id]
+        assert ids(q='phạm_') == [users[4].id]
+
+        r = client.get(f"{settings.API_PREFIX}/users", params={'q': 'an'}, headers=headers)
+        assert r.status_code == 422
+
+        r = client.get(f"{settings.API_PREFIX}/users/export", params={'q': 'văn', 'fields': 'id'}, headers=headers)
+        assert [json.loads(line)['id'] for line in r.text.splitlines()] == [users[0].id, users[2].id]
+
+    def test_filter_indexes(self, client: TestClient):
+        """
+            Test mỗi bộ lọc của api get list user dùng đúng index của nó
+            Step by step:
+            - Khởi tạo 20000 user, mỗi bộ lọc chỉ khớp khoảng 1-2% số user, chạy ANALYZE
+            - EXPLAIN câu count của từng tổ hợp bộ lọc và tìm kiếm q
+            - Đầu ra mong muốn:
+                . plan dùng index của bộ lọc chọn lọc nhất (ix_user_role, ix_user_is_active, ix_user_*_trgm...)
+        """
+        with db():
+            db.session.execute(User.__table__.insert(), [{
+                'full_name': f'Nguyen {index}' if index % 100 == 2 else f'User {index}',
+                'email': f'user{index}@example.com',
+                'hashed_password': '',
+                'role': UserRole.ADMIN.value if index % 100 == 0 else UserRole.GUEST.value,
+                'is_active': index % 100 != 1,
+                'created_at': datetime(2020, 1, 1) + timedelta(hours=index),
+                'last_login': datetime(2022, 1, 1) + timedelta(days=index // 50) if index % 50 == 0 else None,
+            } for index in range(20000)])
+            db.session.commit()
+            db.session.execute(text('ANALYZE "user"'))
+
+            cases = [
+                ({'role': 'admin'}, ['ix_user_role']),
+                ({'is_active': False}, ['ix_user_is_active']),
+                ({'created_at_from': datetime(2020, 1, 1), 'created_at_to': datetime(2020, 1, 3)},
+                 ['ix_user_created_at']),
+                ({'last_login_from': datetime(2022, 1, 1)}, ['ix_user_last_login']),
+                ({'role': 'guest', 'is_active': False}, ['ix_user_is_active']),
+                ({'role': 'guest', 'last_login_to': datetime(2022, 1, 3)}, ['ix_user_last_login']),
+                ({'q': 'nguyen'}, ['ix_user_full_name_trgm', 'ix_user_email_trgm']),
+                ({'q': 'nguyen', 'role': 'guest'}, ['ix_user_full_name_trgm', 'ix_user_email_trgm']),
+            ]
+            for filters, indexes in cases:
+                statement = db.session.query(func.count(User.id)) \
+                    .filter(*UserService.list_filters(UserFilterParams(**filters))).statement
+                compiled = statement.compile(dialect=db.session.get_bind().dialect)
+                plan = '\n'.join(row[0] for row in db.session.connection().exec_driver_sql(
+                    f'EXPLAIN {compiled}', compiled.params))
+                assert all(f' {index} ' in plan for index in indexes), (filters, plan)
+
+
+class TestExportUser:
+    def test_export(self, client: TestClient, monkeypatch):
+        """
+            Test api export user dạng NDJSON và CSV
+            Step by step:
+            - Khởi tạo 25 user mẫu, chunk export 10 dòng
+            - Gọi API Export User với format=ndjson, format=csv&fields=id,email
+            - Gọi API Export User bằng user không phải admin
+            - Đầu ra mong muốn:
+                . mỗi user 1 dòng, theo thứ tự id tăng dần, đúng các field yêu cầu
+                . user không phải admin bị từ chối
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        guest = fake.users(24)[0]
+        monkeypatch.setattr(settings, 'EXPORT_CHUNK_SIZE', 10)
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+
+        r = client.get(f"{settings.API_PREFIX}/users/export", headers=headers)
+        assert r.status_code == 200
+        assert r.headers['content-type'] == 'application/x-ndjson'
+        rows = [json.loads(line) for line in r.text.splitlines()]
+        assert [row['id'] for row in rows] == list(range(1, 26))
+        assert list(rows[0]) == list(UserItemResponse.__fields__)
+
+        r = client.get(f"{settings.API_PREFIX}/users/export", params={'format': 'csv', 'fields': 'id,email'},
+                       headers=headers)
+        assert r.status_code == 200
+        rows = list(csv.reader(io.StringIO(r.text)))
+        assert rows[0] == ['email', 'id']
+        assert rows[1] == [admin.email, str(admin.id)]
+        assert len(rows) == 26
+
+        r = client.get(f"{settings.API_PREFIX}/users/export",
+                       headers={'Authorization': f'Bearer {create_access_token(guest.id)}'})
+        assert r.status_code == 400
+
+    def test_export_empty(self, client: TestClient):
+        """
+            Test api export user khi bộ lọc không khớp user nào
+            Step by step:
+            - Khởi tạo admin mẫu
+            - Gọi API Export User với format=csv và format=ndjson, q không khớp user nào
+            - Đầu ra mong muốn:
+                . CSV chỉ có dòng tiêu đề, NDJSON rỗng
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+
+        r = client.get(f"{settings.API_PREFIX}/users/export", headers=headers,
+                       params={'format': 'csv', 'fields': 'id,email', 'q': 'no-such-user'})
+        assert r.status_code == 200
+        assert list(csv.reader(io.StringIO(r.text))) == [['email', 'id']]
+
+        r = client.get(f"{settings.API_PREFIX}/users/export", headers=headers, params={'q': 'no-such-user'})
+        assert r.status_code == 200
+        assert r.text == ''
+
+
+class TestImportUser:
+    def test_import(self, client: TestClient):
+        """
+            Test api import user từ file CSV và NDJSON
+            Step by step:
+            - Khởi tạo admin mẫu
+            - Gọi API Import User với file CSV gồm dòng hợp lệ, email sai, email trùng trong file,
+              email đã tồn tại, role sai, thiếu password
+            - Gọi API Import User với file NDJSON
+            - Đầu ra mong muốn:
+                . các dòng hợp lệ được tạo, đăng nhập được bằng password trong file
+                . các dòng lỗi được báo theo số dòng, không làm hỏng cả file
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+        content = '\n'.join([
+            'full_name,email,password,role,is_active',
+            'User One,one@Example.COM,secret123,guest,true',
+            'User Two,two@example.com,secret123,admin,0',
+            'Bad Email,not-an-email,secret123,guest,',
+            'Duplicate,one@EXAMPLE.com,secret123,guest,',
+            f'Existing,{admin.email},secret123,guest,',
+            'Bad Role,three@example.com,secret123,owner,',
+            'No Password,four@example.com,,guest,',
+        ])
+        r = client.post(f"{settings.API_PREFIX}/users/import", headers=headers,
+                        files={'file': ('users.csv', content, 'text/csv')})
+        assert r.status_code == 200
+        result = r.json()['data']
+        assert result['total_rows'] == 7
+        assert result['imported'] == 2
+        assert [(error['row'], error['message']) for error in result['errors']] == [
+            (3, 'Invalid email'), (4, 'Duplicate email in file'), (5, 'Email already exists'),
+            (6, 'Invalid role'), (7, 'Missing password'),
+        ]
+
+        with db():
+            user = db.session.query(User).filter_by(email='one@example.com').one()
+            assert verify_password('secret123', user.hashed_password)
+            assert db.session.query(User).filter_by(email='two@example.com').one().is_active is False
+
+        content = '{"email": "five@example.com", "password": "secret123", "is_active": false}\n' \
+                  '{"email": "six@example.com"}'
+        r = client.post(f"{settings.API_PREFIX}/users/import", headers=headers,
+                        files={'file': ('users.ndjson', content, 'application/x-ndjson')})
+        assert r.status_code == 200
+        assert r.json()['data']['imported'] == 1
+        assert r.json()['data']['errors'] == [{'row': 2, 'email': 'six@example.com', 'message': 'Missing password'}]
+
+
+class TestBatchUpdateUser:
+    def test_batch_update(self, client: TestClient):
+        """
+            Test api update nhiều user cùng lúc (PATCH /users)
+            Step by step:
+            - Khởi tạo admin và 4 user mẫu
+            - Gọi API Batch Update: khoá 2 user, đổi role 1 user, 1 id không tồn tại, 1 email đã có người dùng
+            - Đầu ra mong muốn:
+                . chỉ các field được gửi bị thay đổi
+                . id không tồn tại nằm trong missing_ids, email trùng nằm trong errors
+                . mỗi nhóm cột thay đổi chỉ tốn 1 câu UPDATE
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        users = fake.users(4)
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+
+        r = client.patch(f"{settings.API_PREFIX}/users", headers=headers, json=[
+            {'id': users[0].id, 'is_active': False},
+            {'id': users[1].id, 'is_active': False},
+            {'id': users[2].id, 'role': 'admin'},
+            {'id': 999, 'is_active': False},
+            {'id': users[3].id, 'email': admin.email},
+        ])
+        assert r.status_code == 200
+        assert r.json()['data'] == {
+            'updated_ids': [users[0].id, users[1].id, users[2].id],
+            'missing_ids': [999],
+            'errors': [{'id': users[3].id, 'message': 'Email already exists'}],
+        }
+        # principal + email check + one UPDATE per group of changed columns
+        assert 'desc="4 queries"' in r.headers['server-timing']
+
+        with db():
+            updated = {user.id: user for user in db.session.query(User)}
+        assert [updated[user.id].is_active for user in users] == [False, False, True, True]
+        assert [updated[user.id].role for user in users] == ['guest', 'guest', 'admin', 'guest']
+        assert updated[users[3].id].email == users[3].email
+
+    def test_batch_update_emails(self, client: TestClient):
+        """
+            Test api update nhiều user cùng lúc khi các user trong batch đổi email cho nhau
+            Step by step:
+            - Khởi tạo admin và 6 user mẫu
+            - Gọi API Batch Update: 2 user đổi email cho nhau, 1 user đổi email mới và 1 user lấy email cũ của user đó,
+              1 user lấy email của user thứ 6, user thứ 6 lại lấy email của admin (admin không đổi email)
+            - Đầu ra mong muốn:
+                . đổi email cho nhau và lấy lại email vừa được trả đều thành công (kiểm tra theo trạng thái sau batch)
+                . user thứ 6 bị từ chối nên vẫn giữ email, kéo theo user lấy email của nó cũng bị từ chối
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        users = fake.users(6)
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+
+        r = client.patch(f"{settings.API_PREFIX}/users", headers=headers, json=[
+            {'id': users[0].id, 'email': users[1].email},
+            {'id': users[1].id, 'email': users[0].email},
+            {'id': users[2].id, 'email': 'moved@example.com'},
+            {'id': users[3].id, 'email': users[2].email},
+            {'id': users[4].id, 'email': users[5].email},
+            {'id': users[5].id, 'email': admin.email},
+        ])
+        assert r.status_code == 200
+        assert r.json()['data'] == {
+            'updated_ids': [user.id for user in users[:4]],
+            'missing_ids': [],
+            'errors': [{'id': users[4].id, 'message': 'Email already exists'},
+                       {'id': users[5].id, 'message': 'Email already exists'}],
+        }
+        # principal + email check + releasing the emails that change hands + one UPDATE for the email group
+        assert 'desc="4 queries"' in r.headers['server-timing']
+
+        with db():
+            emails = dict(db.session.query(User.id, User.email))
+        assert [emails[user.id] for user in users] == [
+            users[1].email, users[0].email, 'moved@example.com', users[2].email, users[4].email, users[5].email]
+        assert emails[admin.id] == admin.email
+
+
+class TestCurrentUser:
+    def test_single_user_lookup(self, client: TestClient, monkeypatch):
+        """
+            Test api dùng chung 1 principal cho cả request
+            Step by step:
+            - Khởi tạo admin mẫu, đếm số lần lookup user (user_cache.get)
+            - Gọi API Get me, Update me, Update User (PermissionRequired)
+            - Đầu ra mong muốn:
+                . mỗi request chỉ lookup user đúng 1 lần
+                . Get me trả về dữ liệu mới sau khi Update me
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+        calls = []
+        cache_get = user_cache.get
+        monkeypatch.setattr(user_cache, 'get', lambda *args: calls.append(args) or cache_get(*args))
+
+        requests = [
+            ('get', f"{settings.API_PREFIX}/users/me", None),
+            ('put', f"{settings.API_PREFIX}/users/me", {'full_name': 'Updated Name'}),
+            ('put', f"{settings.API_PREFIX}/users/{admin.id}", {'is_active': True}),
+            ('get', f"{settings.API_PREFIX}/users", None),
+        ]
+        for method, url, body in requests:
+            calls.clear()
+            r = client.request(method, url, json=body, headers=headers)
+            assert r.status_code == 200
+            assert len(calls) == 1
+
+        r = client.get(f"{settings.API_PREFIX}/users/me", headers=headers)
+        assert r.json()['data']['full_name'] == 'Updated Name'
+
+    def test_cache_invalidation(self, client: TestClient):
+        """
+            Test cache user (user_cache) bị xoá khi user bị cập nhật/khoá
+            Step by step:
+            - Khởi tạo admin và 1 user guest, guest gọi API Get me 2 lần
+            - Admin gọi API Update User đổi role guest thành admin và khoá guest (is_active=false)
+            - Guest gọi lại API Get me và 1 API chỉ dành cho admin
+            - Admin mở khoá guest bằng API Batch update User
+            - Đầu ra mong muốn:
+                . lần Get me thứ 2 lấy từ cache, không query database
+                . sau mỗi lần cập nhật, guest thấy ngay role/is_active mới (không đợi hết TTL)
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        guest = fake.user({'password': 'secret123'})
+        admin_headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+        guest_headers = {'Authorization': f'Bearer {create_access_token(guest.id)}'}
+        me_url = f"{settings.API_PREFIX}/users/me"
+
+        client.get(me_url, headers=guest_headers)
+        hits = user_cache.hits
+        r = client.get(me_url, headers=guest_headers)
+        assert user_cache.hits == hits + 1
+        assert 'desc="0 queries"' in r.headers['server-timing']
+        assert client.get(f"{settings.API_PREFIX}/users/export", headers=guest_headers).status_code == 400
+
+        r = client.put(f"{settings.API_PREFIX}/users/{guest.id}", headers=admin_headers,
+                       json={'role': UserRole.ADMIN.value, 'is_active': False})
+        assert r.status_code == 200
+        data = client.get(me_url, headers=guest_headers).json()['data']
+        assert data['role'] == UserRole.ADMIN.value and data['is_active'] is False
+        assert client.get(f"{settings.API_PREFIX}/users/export", headers=guest_headers).status_code == 200
+
+        r = client.patch(f"{settings.API_PREFIX}/users", headers=admin_headers,
+                         json=[{'id': guest.id, 'is_active': True}])
+        assert r.status_code == 200
+        assert client.get(me_url, headers=guest_headers).json()['data']['is_active'] is True
+
+
+class TestUpdateUser:
+    def test_single_statement_update(self, client: TestClient):
+        """
+            Test API update User và API Update current User bằng 1 câu UPDATE ... RETURNING
+            Step by step:
+            - Khởi tạo admin và 2 user mẫu
+            - Gọi API update User chỉ đổi full_name, rồi với id không tồn tại, rồi với email của user khác
+            - Gọi API Update current User đổi full_name, rồi với email của user khác
+            - Đầu ra mong muốn:
+                . chỉ full_name thay đổi, response lấy từ RETURNING: mỗi API chỉ 1 query (principal đã cache)
+                . id không tồn tại: 400 'User not exists'
+                . email đã dùng: 400 'Email already exists', user không đổi
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        user, other = fake.users(2)
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+        client.get(f"{settings.API_PREFIX}/users/me", headers=headers)  # Caches the principal
+
+        r = client.put(f"{settings.API_PREFIX}/users/{user.id}", headers=headers, json={'full_name': 'New Name'})
+        assert r.status_code == 200
+        assert 'desc="1 queries"' in r.headers['server-timing']
+        data = r.json()['data']
+        assert data['full_name'] == 'New Name' and data['email'] == user.email and data['role'] == user.role
+        assert r.headers['etag'] == client.get(f"{settings.API_PREFIX}/users/{user.id}", headers=headers) \
+            .headers['etag']
+
+        r = client.put(f"{settings.API_PREFIX}/users/{other.id + 1000}", headers=headers, json={'full_name': 'X'})
+        assert r.status_code == 400 and r.json()['message'] == 'User not exists'
+        r = client.put(f"{settings.API_PREFIX}/users/{user.id}", headers=headers, json={'email': other.email})
+        assert r.status_code == 400 and r.json()['message'] == 'Email already exists'
+
+        r = client.put(f"{settings.API_PREFIX}/users/me", headers=headers, json={'full_name': 'Admin Name'})
+        assert r.status_code == 200 and r.json()['data']['full_name'] == 'Admin Name'
+        assert 'desc="1 queries"' in r.headers['server-timing']
+        r = client.put(f"{settings.API_PREFIX}/users/me", headers=headers, json={'email': other.email})
+        assert r.status_code == 400 and r.json()['message'] == 'Email already exists'
+        with db():
+            assert db.session.query(User.email).filter(User.id == user.id).scalar() == user.email
+
+
+class TestConditionalRequest:
+    def test_etag_detail(self, client: TestClient):
+        """
+            Test ETag và If-None-Match của API get Detail User, Get me
+            Step by step:
+            - Khởi tạo admin và 1 user mẫu
+            - Gọi API get Detail User, gọi lại với If-None-Match = ETag nhận được
+            - Cập nhật user rồi gọi lại với ETag cũ
+            - Đầu ra mong muốn:
+                . lần gọi lại trả về 304 không có body, chỉ tốn 1 probe theo primary key
+                . ETag của sparse fieldset khác ETag đầy đủ
+                . sau khi cập nhật trả về 200 với ETag mới
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        user = fake.user({'password': 'secret123'})
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+        url = f"{settings.API_PREFIX}/users/{user.id}"
+
+        r = client.get(url, headers=headers)
+        assert r.status_code == 200
+        etag = r.headers['etag']
+        assert etag.startswith('"') and r.headers['cache-control'] == 'private, no-cache'
+
+        r = client.get(url, headers={**headers, 'If-None-Match': etag})
+        assert r.status_code == 304
+        assert r.content == b'' and r.headers['etag'] == etag
+        assert 'desc="1 queries"' in r.headers['server-timing']  # Only the probe, the principal is cached
+        assert client.get(url, headers={**headers, 'If-None-Match': f'"other", W/{etag}'}).status_code == 304
+
+        r = client.get(url, params={'fields': 'id,email'}, headers={**headers, 'If-None-Match': etag})
+        assert r.status_code == 200 and r.headers['etag'] != etag
+
+        client.put(url, headers=headers, json={'full_name': 'New Name'})
+        r = client.get(url, headers={**headers, 'If-None-Match': etag})
+        assert r.status_code == 200
+        assert r.json()['data']['full_name'] == 'New Name' and r.headers['etag'] != etag
+
+        r = client.get(f"{settings.API_PREFIX}/users/me", headers=headers)
+        r = client.get(f"{settings.API_PREFIX}/users/me", headers={**headers, 'If-None-Match': r.headers['etag']})
+        assert r.status_code == 304
+
+    def test_etag_list(self, client: TestClient):
+        """
+            Test ETag và If-None-Match của API Get list User
+            Step by step:
+            - Khởi tạo admin và 5 user mẫu
+            - Gọi API Get list User, gọi lại với If-None-Match = ETag nhận được
+            - Đổi tham số, cập nhật 1 user rồi gọi lại với ETag cũ
+            - Đầu ra mong muốn:
+                . lần gọi lại trả về 304
+                . tham số khác hoặc dữ liệu thay đổi thì trả về 200 với ETag mới
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        users = fake.users(5)
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+        url = f"{settings.API_PREFIX}/users"
+
+        r = client.get(url, params={'page_size': 2, 'role': 'guest'}, headers=headers)
+        etag = r.headers['etag']
+        r = client.get(url, params={'page_size': 2, 'role': 'guest'}, headers={**headers, 'If-None-Match': etag})
+        assert r.status_code == 304
+        # Only the count() and max(updated_at) probe, the principal is cached
+        assert 'desc="1 queries"' in r.headers['server-timing']
+
+        r = client.get(url, params={'page_size': 3, 'role': 'guest'}, headers={**headers, 'If-None-Match': etag})
+        assert r.status_code == 200 and r.headers['etag'] != etag
+
+        client.put(f"{url}/{users[0].id}", headers=headers, json={'full_name': 'New Name'})
+        r = client.get(url, params={'page_size': 2, 'role': 'guest'}, headers={**headers, 'If-None-Match': etag})
+        assert r.status_code == 200 and r.headers['etag'] != etag
+
+    def test_etag_list_membership(self, client: TestClient):
+        """
+            Test ETag của API Get list User khi 1 user ra khỏi bộ lọc
+            Step by step:
+            - Khởi tạo admin và 4 user mẫu đang active
+            - Gọi API Get list User lọc is_active=true, khoá 1 user bằng API Update User rồi gọi lại với ETag cũ
+            - Đầu ra mong muốn:
+                . max(updated_at) của các user còn khớp bộ lọc không đổi nhưng vẫn trả về 200 với ETag mới
+                . user bị khoá không còn trong danh sách
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        users = fake.users(4)
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+        url = f"{settings.API_PREFIX}/users"
+        params = {'page_size': 10, 'is_active': 'true'}
+
+        r = client.get(url, params=params, headers=headers)
+        etag = r.headers['etag']
+        assert users[1].id in [user['id'] for user in r.json()['data']]
+
+        assert client.put(f"{url}/{users[1].id}", headers=headers, json={'is_active': False}).status_code == 200
+        r = client.get(url, params=params, headers={**headers, 'If-None-Match': etag})
+        assert r.status_code == 200 and r.headers['etag'] != etag
+        assert users[1].id not in [user['id'] for user in r.json()['data']]
+
+    def test_if_match(self, client: TestClient):
+        """
+            Test optimistic concurrency của API update User với If-Match
+            Step by step:
+            - Khởi tạo admin và 1 user mẫu, lấy ETag từ API get Detail User
+            - Cập nhật user với If-Match = ETag đó, rồi cập nhật lại với cùng ETag (đã cũ)
+            - Đầu ra mong muốn:
+                . lần đầu 200 với ETag mới, lần sau 412 và user không đổi
+                . ETag của sparse fieldset cũng dùng được cho If-Match
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        user = fake.user({'password': 'secret123'})
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+        url = f"{settings.API_PREFIX}/users/{user.id}"
+        etag = client.get(url, params={'fields': 'full_name'}, headers=headers).headers['etag']
+
+        r = client.put(url, headers={**headers, 'If-Match': etag}, json={'full_name': 'First'})
+        assert r.status_code == 200
+        assert r.headers['etag'] == client.get(url, headers=headers).headers['etag']
+
+        r = client.put(url, headers={**headers, 'If-Match': etag}, json={'full_name': 'Second'})
+        assert r.status_code == 412
+        assert r.json()['code'] == '412'
+        assert client.get(url, headers=headers).json()['data']['full_name'] == 'First'
+
+        r = client.put(url, headers={**headers, 'If-Match': '*'}, json={'full_name': 'Third'})
+        assert r.status_code == 200
+
+
+class TestReadReplica:
+    def test_replica_routing(self, client: TestClient, monkeypatch):
+        """
+            Test đọc từ read replica: round-robin, read-your-writes và loại replica bị trễ
+            Step by step:
+            - Tạo database thứ 2 (rỗng, cùng schema) làm replica, khởi tạo admin và 1 user mẫu trên primary
+            - Gọi API get Detail User, API Get list User
+            - Cập nhật user rồi gọi lại API get Detail User
+            - Giả lập replica trễ hơn DB_REPLICA_MAX_LAG rồi gọi lại
+            - Đầu ra mong muốn:
+                . API đọc lấy dữ liệu từ replica (user không tồn tại trên replica)
+                . ngay sau khi ghi, request của cùng principal đọc từ primary
+                . replica bị trễ bị loại, request đọc từ primary
+        """
+        url = make_url(os.getenv('SQLALCHEMY_DATABASE_URL'))
+        replica_url = url.set(database=f'{url.database}_replica')
+        if url.get_backend_name() == 'postgresql':
+            with create_engine(url, isolation_level='AUTOCOMMIT').connect() as connection:
+                if not connection.execute(text('SELECT 1 FROM pg_database WHERE datname = :name'),
+                                          {'name': replica_url.database}).scalar():
+                    connection.execute(text(f'CREATE DATABASE "{replica_url.database}"'))
+        replicas.configure([replica_url.render_as_string(hide_password=False)])
+        replica_engine = replicas.replicas[0].engine
+        Base.metadata.create_all(replica_engine)
+        try:
+            admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+            user = fake.user({'password': 'secret123'})
+            headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+            detail_url = f"{settings.API_PREFIX}/users/{user.id}"
+
+            r = client.get(detail_url, headers=headers)
+            assert r.status_code == 400 and r.json()['message'] == 'User not exists'
+            r = client.get(f"{settings.API_PREFIX}/users", headers=headers)
+            assert r.status_code == 200 and r.json()['data'] == []
+
+            assert client.put(detail_url, headers=headers, json={'full_name': 'New Name'}).status_code == 200
+            r = client.get(detail_url, headers=headers)
+            assert r.status_code == 200 and r.json()['data']['full_name'] == 'New Name'
+            recent_writers.clear()
+            assert client.get(detail_url, headers=headers).status_code == 400
+
+            monkeypatch.setattr(replicas, 'measure_lag', lambda replica: settings.DB_REPLICA_MAX_LAG + 1)
+            replicas.check()
+            assert not replicas.replicas[0].healthy
+            assert client.get(detail_url, headers=headers).status_code == 200
+        finally:
+            recent_writers.clear()
+            Base.metadata.drop_all(replica_engine)
+            replicas.configure([])
+
+
+class TestRequestTiming:
+    def test_server_timing_and_query_budget(self, client: TestClient, monkeypatch):
+        """
+            Test đo SQL theo request: header Server-Timing và query_budget
+            Step by step:
+            - Khởi tạo admin mẫu
+            - Gọi API Get list User
+            - Hạ query_budget của API Get list User xuống 1 rồi gọi lại
+            - Đầu ra mong muốn:
+                . header Server-Timing có db (số query) và auth
+                . request vượt query_budget bị lỗi (strict mode trong test)
+        """
+        admin = fake.user({'password': 'secret123', 'role': UserRole.ADMIN.value})
+        headers = {'Authorization': f'Bearer {create_access_token(admin.id)}'}
+
+        r = client.get(f"{settings.API_PREFIX}/users", headers=headers)
+        assert r.status_code == 200
+        server_timing = r.headers['server-timing']
+        # principal + ETag probe + count + page
+        assert 'db;dur=' in server_timing and 'desc="4 queries"' in server_timing
+        assert 'auth;dur=' in server_timing and 'serialize;dur=' in server_timing
+
+        monkeypatch.setattr(api_user.get, 'query_budget', 1)
+        with pytest.raises(QueryBudgetExceeded):
+            client.get(f"{settings.API_PREFIX}/users", headers=headers)
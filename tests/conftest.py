@@ -1,5 +1,15 @@
 import os
 import pytest
+from dotenv import load_dotenv
+
+load_dotenv(verbose=True)
+SQLALCHEMY_DATABASE_URL = os.getenv('SQLALCHEMY_DATABASE_URL', '/tests')
+# The queries are written for Postgres (INSERT ... ON CONFLICT, UPDATE ... RETURNING, COPY, pg_trgm...): stop the
+# test session before importing the app rather than failing (or skipping) every test on another database
+if not SQLALCHEMY_DATABASE_URL.startswith('postgresql'):
+    pytest.exit(f'SQLALCHEMY_DATABASE_URL must be a Postgres database, got {SQLALCHEMY_DATABASE_URL!r}', returncode=4)
+os.environ.setdefault('ASYNC_DB_ENABLED', 'true')  # Mount the asyncio routes too, they are included at import
+
 import requests
 from datetime import datetime
 from operator import itemgetter
@@ -7,27 +17,33 @@ from docstring_parser import parse
 from app.main import get_application
 from app.models.model_base import Base
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from typing import Any, Generator
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
-from app.db.base import get_db
-from fastapi_sqlalchemy import DBSessionMiddleware
-from dotenv import load_dotenv
+from app.core.config import settings
+from app.db.base import ASYNC_DRIVERS, get_async_db, get_db
+from app.db.session import db
+from app.helpers.paging import count_cache
+from app.helpers.rate_limit import rate_limiter
+from app.services.srv_user import user_cache
 
-load_dotenv(verbose=True)
+settings.SQL_QUERY_BUDGET_STRICT = True  # A route going over its query_budget fails the test
 
-SQLALCHEMY_DATABASE_URL = os.getenv('SQLALCHEMY_DATABASE_URL', '/tests')
-connect_args = {}
-if SQLALCHEMY_DATABASE_URL[:6] == 'sqlite':
-    connect_args['check_same_thread'] = False
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args=connect_args
-)
+engine = create_engine(SQLALCHEMY_DATABASE_URL)
 
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Every TestClient runs its own event loop: no pool, connections must not outlive the loop that opened them
+async_engine = create_async_engine(
+    make_url(SQLALCHEMY_DATABASE_URL).set(drivername=ASYNC_DRIVERS['postgresql']), poolclass=NullPool
+)
+TestingAsyncSessionLocal = sessionmaker(
+    autocommit=False, autoflush=False, expire_on_commit=False, bind=async_engine, class_=AsyncSession
+)
 
 @pytest.hookimpl(hookwrapper=True, tryfirst=True)
 def pytest_runtest_makereport(item, call):
@@ -215,8 +231,11 @@ def app() -> Generator[FastAPI, Any, None]:
     Create a fresh database on each test case.
     """
     Base.metadata.create_all(engine)  # Create the tables.
+    user_cache.clear()  # Ids restart on every fresh database
+    count_cache.clear()
+    rate_limiter.backend.clear()  # All the test requests come from the same client
+    db.configure(TestingSessionLocal)  # Sessions of the app's DBSessionMiddleware, and of `with db():`
     _app = get_application()
-    _app.add_middleware(DBSessionMiddleware, db_url=SQLALCHEMY_DATABASE_URL)
     yield _app
     Base.metadata.drop_all(engine)
 
@@ -249,7 +268,7 @@ def db_session(app: FastAPI) -> Generator[TestingSessionLocal, Any, None]:
 def client(app: FastAPI, db_session: TestingSessionLocal) -> Generator[TestClient, Any, None]:
     """
     Create a new FastAPI TestClient that uses the `db_session` fixture to override
-    the `get_db` dependency that is injected into routes.
+    the `get_db` dependency that is injected into routes, and the testing database for the asyncio routes.
     """
 
     def _get_test_db():
@@ -258,7 +277,12 @@ def client(app: FastAPI, db_session: TestingSessionLocal) -> Generator[TestClien
         finally:
             pass
 
+    async def _get_test_async_db():
+        async with TestingAsyncSessionLocal() as session:
+            yield session
+
     app.dependency_overrides[get_db] = _get_test_db
+    app.dependency_overrides[get_async_db] = _get_test_async_db
     with TestClient(app) as client:
         yield client
 
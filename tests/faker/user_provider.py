@@ -3,7 +3,7 @@ import faker.providers
 
 from app.helpers.enums import UserRole
 from app.models import User
-from fastapi_sqlalchemy import db
+from app.db.session import db
 from app.core.security import get_password_hash
 
 logger = logging.getLogger()
@@ -29,3 +29,26 @@ class UserProvider(faker.providers.BaseProvider):
             db.session.commit()
             db.session.refresh(user)
         return user
+
+    @staticmethod
+    def users(count: int, data={}):
+        """
+        Fake many users in db for testing, sharing one password hash to keep bcrypt out of the loop
+        :return: list of user model objects
+        """
+        hashed_password = get_password_hash(data.get('password') or fake.lexify(text='?????????'))
+        users = [
+            User(
+                full_name=fake.name(),
+                email=f'{index}.{fake.email()}',
+                hashed_password=hashed_password,
+                is_active=data.get('is_active') if data.get('is_active') is not None else True,
+                role=data.get('role') if data.get('role') is not None else UserRole.GUEST.value
+            ) for index in range(count)
+        ]
+        with db():
+            db.session.add_all(users)
+            db.session.commit()
+            for user in users:
+                db.session.refresh(user)
+        return users